@@ -0,0 +1,79 @@
+"""
+Moves finished games out of the hot collection, into the archive collection or a gzipped JSON lines file
+
+Each chunk is written to the archive before it is removed from the hot collections, so an interrupted run only
+leaves games that the next run archives again under the same ids.
+"""
+
+import gzip
+import json
+from datetime import timedelta
+from django.utils import timezone
+from pymongo import ReplaceOne
+from blackjack.bulk import collection, model_document
+from blackjack.models import GameAction, GameArchive, GameEvent
+from blackjack.projection import projected
+
+
+def strip_finished_decks():
+    """
+    Drop the decks finished games still store, from before they were dropped at the end of the game
+    :return: None
+    """
+
+    GameAction.objects.filter(end_game_action=True).update(action_deck=[])
+
+
+def _json_default(value):
+    """
+
+    :param value: datetime
+    :return: str
+    """
+
+    return value.isoformat()
+
+
+def archive_games(days=30, chunk_size=500, path=None, now=None):
+    """
+    Archive finished games last played more than some days ago, together with their events
+    :param days: int age threshold
+    :param chunk_size: int games per read, write and delete
+    :param path: str gzipped JSON lines file to append the archive to, the archive collection when None
+    :param now: datetime, timezone.now() when None
+    :return: int games archived
+    """
+
+    now = now or timezone.now()
+    cutoff = now - timedelta(days=days)
+    archive = gzip.open(path, 'ab') if path else None
+    games, events = collection(GameAction), collection(GameEvent)
+    archived = 0
+    try:
+        while True:
+            chunk = list(projected(GameAction.objects.filter(end_game_action=True, action_time__lt=cutoff)
+                                   .defer('action_deck')).order_by('action_time')[:chunk_size])
+            if not chunk:
+                break
+            ids = [action.pk for action in chunk]
+            logs = {}
+            for event in projected(GameEvent.objects.filter(action__in=ids).defer('deck')).order_by('sequence'):
+                logs.setdefault(event.action_id, []).append(event)
+            records = [model_document(GameArchive.from_game(action, logs.get(action.pk, ()), now))
+                       for action in chunk]
+
+            if archive is not None:
+                for record in records:
+                    archive.write(json.dumps(record, default=_json_default, separators=(',', ':')) + '\n')
+                archive.flush()
+            else:
+                collection(GameArchive).bulk_write([ReplaceOne({'_id': record['_id']}, record, upsert=True)
+                                                    for record in records], ordered=False)
+
+            events.remove({GameEvent._meta.get_field('action').column: {'$in': ids}})
+            games.remove({'_id': {'$in': ids}})
+            archived += len(ids)
+    finally:
+        if archive is not None:
+            archive.close()
+    return archived
@@ -0,0 +1,330 @@
+"""
+Seeded micro-benchmarks of the hot paths, run and compared against a saved baseline by the benchmark command
+"""
+
+import platform
+import random
+import time
+import timeit
+from collections import OrderedDict
+from io import BytesIO
+from django.utils import timezone
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from blackjack.cards import Card, CompactDeck, FrenchDeck
+from blackjack.fastserializers import compile_serializer
+from blackjack.models import Player, GameAction, new_id
+from blackjack.serializers import GameActionSerializer
+
+# Benchmark name and the function building its timed callable, in run order
+BENCHMARKS = OrderedDict()
+
+def benchmark(name):
+    """
+    Register a benchmark, the decorated function does its setup and returns the callable to time
+    :param name: str dotted benchmark name
+    :return: decorator
+    """
+
+    def register(function):
+        BENCHMARKS[name] = function
+        return function
+    return register
+
+
+def best_of(function, number, repeat=5):
+    """
+    Best time per call over several runs, the least disturbed by the rest of the machine
+    :param function: callable without arguments
+    :param number: int calls per run
+    :param repeat: int runs
+    :return: float microseconds
+    """
+
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number * 1e6
+
+
+def _offline(action):
+    """
+    Keep a game's bet and settlements off the database
+    :param action: GameAction
+    :return: GameAction
+    """
+
+    action.reserve = lambda: None
+    action.settle = lambda amount: None
+    return action
+
+
+def _deck_seed():
+    """
+    Deck seed drawn from the random module, which run seeds before each benchmark, so deals repeat run to run
+    :return: int
+    """
+
+    return random.getrandbits(63)
+
+
+def sample_game():
+    """
+    Unsaved game midway through a hand, so nothing touches the database
+    :return: GameAction
+    """
+
+    return GameAction(player=Player(wallet_id='benchmark'), bet=50, action_id='benchmark', action_type='hit',
+                      action_time=timezone.now(), player_action='hit', next_actions='hit/stand',
+                      player_hand=[Card('7', 'hearts'), Card('2', 'clubs'), Card('4', 'spades')],
+                      dealer_hand=[Card('K', 'diamonds'), Card('6', 'hearts')], player_points=13, dealer_points=16)
+
+
+def play_out(action, stand_on=17):
+    """
+    Hit below stand_on, then stand, until the game ends
+    :param action: dealt GameAction
+    :param stand_on: int player total to stand on
+    :return: GameAction
+    """
+
+    while action.next_actions == 'hit/stand' and action.player_points < stand_on:
+        action.hit()
+    if action.next_actions == 'hit/stand':
+        action.stand()
+    return action
+
+
+@benchmark('deck.french')
+def french_deck():
+    """
+    FrenchDeck construction and shuffle
+    """
+
+    return lambda: FrenchDeck()
+
+
+@benchmark('deck.compact')
+def compact_deck():
+    """
+    CompactDeck construction and shuffle
+    """
+
+    return lambda: CompactDeck()
+
+
+@benchmark('hand.calculate_points')
+def calculate_points():
+    """
+    Points of a three card hand
+    """
+
+    action = sample_game()
+    hand = action.player_hand
+    return lambda: action.calculate_points(hand)
+
+
+@benchmark('game.deal')
+def deal():
+    """
+    Deal on an unsaved game
+    """
+
+    player = Player(wallet_id='benchmark')
+    return lambda: _offline(GameAction(player=player, bet=50, deck_seed=_deck_seed())).deal()
+
+
+@benchmark('game.deal_hit_stand')
+def deal_hit_stand():
+    """
+    A whole unsaved game, hitting below 17
+    """
+
+    player = Player(wallet_id='benchmark')
+
+    def run():
+        action = _offline(GameAction(player=player, bet=50, deck_seed=_deck_seed()))
+        action.deal()
+        play_out(action)
+    return run
+
+
+@benchmark('serializer.drf')
+def drf_serializer():
+    """
+    GameActionSerializer output
+    """
+
+    action = sample_game()
+    return lambda: GameActionSerializer(action).data
+
+
+@benchmark('serializer.compiled')
+def compiled_serializer():
+    """
+    Compiled GameActionSerializer output
+    """
+
+    action, compiled = sample_game(), compile_serializer(GameActionSerializer)
+    return lambda: compiled(action)
+
+
+@benchmark('renderer.drf')
+def drf_renderer():
+    """
+    DRF JSONRenderer on a game state
+    """
+
+    data, renderer = GameActionSerializer(sample_game()).data, JSONRenderer()
+    return lambda: renderer.render(data)
+
+
+@benchmark('serializer.round_trip')
+def round_trip():
+    """
+    Game state to JSON and back through the compiled serializer and DRF's renderer and parser
+    """
+
+    action, compiled = sample_game(), compile_serializer(GameActionSerializer)
+    renderer, parser = JSONRenderer(), JSONParser()
+    return lambda: parser.parse(BytesIO(renderer.render(compiled(action))))
+
+
+class _ApiGames(object):
+    """
+    Admin client and fresh games for the API benchmarks, removed again afterwards
+    """
+
+    def __init__(self, count):
+        """
+
+        :param count: int games to create
+        :return:
+        """
+
+        from django.contrib.auth.models import User
+        from rest_framework.test import APIClient
+
+        # A throwaway admin, so an existing account is neither needed nor removed
+        username = 'benchmark-%s' % new_id()[:8]
+        self.user = User.objects.create_superuser(username=username, password='benchmark', email='')
+        self.client = APIClient()
+        self.client.login(username=username, password='benchmark')
+        self.player = Player(wallet_id=new_id(), wallet_balance=10 ** 9)
+        self.player.save()
+        self.games = []
+        for i in range(count):
+            action = GameAction(player=self.player, bet=1, action_id=new_id(), deck_seed=_deck_seed())
+            action.save()
+            self.games.append('/blackjack/gameactions/%s/' % action.pk)
+
+    def patch(self, url, player_action):
+        """
+        PATCH one action
+        :param url: str game url
+        :param player_action: str
+        :return: Response
+        """
+
+        return self.client.patch(url, {'player_action': player_action}, format='json')
+
+    def close(self):
+        """
+        Remove everything the benchmark created
+        :return: None
+        """
+
+        GameAction.objects.filter(player=self.player).delete()
+        self.player.delete()
+        self.user.delete()
+
+
+def _time_api(number, play):
+    """
+    Time full requests, one fresh game per call
+    :param number: int games
+    :param play: callable of _ApiGames and a game url
+    :return: float microseconds per game
+    """
+
+    games = _ApiGames(number)
+    try:
+        started = time.time()
+        for url in games.games:
+            play(games, url)
+        return (time.time() - started) / number * 1e6
+    finally:
+        games.close()
+
+
+def _deal(games, url):
+    """
+    Deal through the API
+    :param games: _ApiGames
+    :param url: str game url
+    :return: None
+    """
+
+    games.patch(url, 'deal')
+
+
+def _deal_hit_stand(games, url):
+    """
+    Play a whole game through the API, hitting below 17
+    :param games: _ApiGames
+    :param url: str game url
+    :return: None
+    """
+
+    state = games.patch(url, 'deal').data
+    while state['next_actions'] == 'hit/stand' and state['player_points'] < 17:
+        state = games.patch(url, 'hit').data
+    if state['next_actions'] == 'hit/stand':
+        games.patch(url, 'stand')
+
+
+# Benchmarks timing full requests, they need a database and the in-process stand-in of webapp.settings_local will do
+DATABASE_BENCHMARKS = OrderedDict([
+    ('api.patch_deal', _deal),
+    ('api.patch_hit_stand', _deal_hit_stand),
+])
+
+
+def run(names=None, number=2000, seed=0):
+    """
+    Run benchmarks, each from the same random state
+    :param names: iterable of benchmark names, all of them when None
+    :param number: int calls per timing run, the API benchmarks play a tenth as many games
+    :param seed: int seed for the random module
+    :return: dict of report metadata and results in microseconds per call
+    """
+
+    names = list(names) if names is not None else list(BENCHMARKS) + list(DATABASE_BENCHMARKS)
+    results = OrderedDict()
+    for name in names:
+        random.seed(seed)
+        if name in DATABASE_BENCHMARKS:
+            results[name] = _time_api(max(number // 10, 1), DATABASE_BENCHMARKS[name])
+        else:
+            results[name] = best_of(BENCHMARKS[name](), number)
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'seed': seed,
+        'number': number,
+        'results': results,
+    }
+
+
+def compare(report, baseline, tolerance=0.2):
+    """
+    Benchmarks of a report against a baseline report
+    :param report: dict from run
+    :param baseline: dict from run
+    :param tolerance: float slowdown allowed before a benchmark counts as a regression
+    :return: list of tuples of name, current, baseline microseconds or None, ratio or None and regression flag
+    """
+
+    rows = []
+    for name, current in report['results'].items():
+        before = baseline['results'].get(name)
+        ratio = current / before if before else None
+        rows.append((name, current, before, ratio, ratio is not None and ratio > 1 + tolerance))
+    return rows
@@ -0,0 +1,258 @@
+"""
+Bulk wallet creation and balance adjustment, validated per row and written in chunks of bulk operations
+
+The engine's insert only writes one document per call and every update is its own round trip, so batches go to
+the collection directly: one insert_many or bulk_write per chunk. A bad row is reported and skipped, it never
+aborts the rest of the batch.
+"""
+
+import re
+from django.conf import settings
+from django.db import connections
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from blackjack.models import Player, new_id, once_per_batch
+
+# Wallet ids must fit the player urls
+WALLET_ID = re.compile(r'^[A-Za-z0-9-]+$')
+
+
+def chunk_size():
+    """
+    Rows per bulk operation
+    :return: int
+    """
+
+    return getattr(settings, 'BLACKJACK_BULK_CHUNK', 1000)
+
+
+def max_rows():
+    """
+    Rows accepted in one call
+    :return: int
+    """
+
+    return getattr(settings, 'BLACKJACK_BULK_MAX_ROWS', 50000)
+
+
+def collection(model):
+    """
+    Collection of a model on the database it is written to
+    :param model: Model class
+    :return: Collection
+    """
+
+    return connections[model.objects.db].get_collection(model._meta.db_table)
+
+
+def model_document(instance):
+    """
+    Model instance as the engine would store it
+    :param instance: Model
+    :return: dict
+    """
+
+    connection = connections[instance.__class__.objects.db]
+    document = {}
+    for field in instance._meta.fields:
+        value = connection.ops.value_for_db(field.get_db_prep_save(getattr(instance, field.attname),
+                                                                   connection=connection), field)
+        document['_id' if field.primary_key else field.column] = value
+    return document
+
+
+def _integer(value):
+    """
+    Whole number sent as a number or a string
+    :param value: object
+    :return: int or None when it isn't one
+    """
+
+    if isinstance(value, bool):
+        return None
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return None
+    return number if number == value or str(number) == str(value).strip() else None
+
+
+def _chunks(rows, size):
+    """
+
+    :param rows: list
+    :param size: int
+    :return: generator of lists
+    """
+
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def _existing(players, wallet_ids, fields=None):
+    """
+    Stored wallets among some ids
+    :param players: Collection
+    :param wallet_ids: list of str
+    :param fields: list of str fields to read, only the id when None
+    :return: dict of wallet id and document
+    """
+
+    projection = dict((name, True) for name in fields or ('_id',))
+    return dict((document['_id'], document) for document in
+                players.find({'_id': {'$in': wallet_ids}}, projection))
+
+
+def create_players(rows, size=None):
+    """
+    Create wallets
+    :param rows: list of dict with an optional wallet_id and wallet_balance, the model default when omitted
+    :param size: int rows per insert, settings.BLACKJACK_BULK_CHUNK when None
+    :return: list of dict per row, in row order, with index, status created or error and wallet_id or errors
+    """
+
+    results = [None] * len(rows)
+    valid = []
+    seen = set()
+    for index, row in enumerate(rows):
+        errors = {}
+        if not isinstance(row, dict):
+            results[index] = {'index': index, 'status': 'error',
+                              'errors': {'non_field_errors': ['Expected an object.']}}
+            continue
+
+        wallet_id = row.get('wallet_id') or new_id()
+        if not isinstance(wallet_id, basestring) or not WALLET_ID.match(wallet_id):
+            errors['wallet_id'] = ['Only letters, digits and dashes are allowed.']
+        elif wallet_id in seen:
+            errors['wallet_id'] = ['Duplicate wallet in this batch.']
+        balance = row.get('wallet_balance')
+        if balance is None:
+            balance = Player._meta.get_field('wallet_balance').get_default()
+        balance = _integer(balance)
+        if balance is None:
+            errors['wallet_balance'] = ['A valid integer is required.']
+        elif balance < 1:
+            errors['wallet_balance'] = ['Ensure this value is greater than or equal to 1.']
+
+        if errors:
+            results[index] = {'index': index, 'status': 'error', 'errors': errors}
+        else:
+            seen.add(wallet_id)
+            valid.append((index, Player(wallet_id=wallet_id, wallet_balance=balance)))
+
+    players = collection(Player)
+    for chunk in _chunks(valid, size or chunk_size()):
+        existing = _existing(players, [player.wallet_id for index, player in chunk])
+        documents, indexes = [], []
+        for index, player in chunk:
+            if player.wallet_id in existing:
+                results[index] = {'index': index, 'status': 'error', 'errors': {'wallet_id': ['Already exists.']}}
+            else:
+                documents.append(model_document(player))
+                indexes.append(index)
+                results[index] = {'index': index, 'status': 'created', 'wallet_id': player.wallet_id}
+        if not documents:
+            continue
+
+        # Unordered, so a wallet created concurrently only fails its own row
+        try:
+            players.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get('writeErrors', ()):
+                index = indexes[error['index']]
+                duplicate = error.get('code') == 11000
+                results[index] = {'index': index, 'status': 'error', 'errors': {
+                    'wallet_id' if duplicate else 'non_field_errors': [
+                        'Already exists.' if duplicate else error.get('errmsg', 'Write failed.')]}}
+    return results
+
+
+def adjust_balances(rows, batch=None, size=None):
+    """
+    Credit or debit wallets, each row is one guarded atomic increment and never takes a balance below zero
+
+    A wallet is adjusted at most once per batch id, so a batch sent again after a timeout doesn't pay twice, even
+    when other batches reached the wallet in between. Wallets remember their last models.APPLIED_BATCHES batches.
+    :param rows: list of dict with wallet_id and a signed amount
+    :param batch: str batch id, a new one when None
+    :param size: int rows per bulk write, settings.BLACKJACK_BULK_CHUNK when None
+    :return: tuple of the batch id and a list of dict per row, in row order, with index, wallet_id, status
+             applied, skipped or error, and errors
+    """
+
+    batch = batch or new_id()
+    results = [None] * len(rows)
+    valid = []
+    seen = set()
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            results[index] = {'index': index, 'status': 'error',
+                              'errors': {'non_field_errors': ['Expected an object.']}}
+            continue
+        errors = {}
+        wallet_id = row.get('wallet_id')
+        if not isinstance(wallet_id, basestring) or not wallet_id:
+            errors['wallet_id'] = ['This field is required.']
+        elif wallet_id in seen:
+            errors['wallet_id'] = ['Duplicate wallet in this batch.']
+        amount = _integer(row.get('amount'))
+        if amount is None:
+            errors['amount'] = ['A valid integer is required.']
+
+        if errors:
+            results[index] = {'index': index, 'wallet_id': wallet_id, 'status': 'error', 'errors': errors}
+        else:
+            seen.add(wallet_id)
+            valid.append((index, wallet_id, amount))
+
+    players = collection(Player)
+    unapplied, mark = once_per_batch(batch)
+    for chunk in _chunks(valid, size or chunk_size()):
+        stored = _existing(players, [wallet_id for index, wallet_id, amount in chunk],
+                           ['wallet_balance', 'applied_batches'])
+        requests, sent = [], []
+        for index, wallet_id, amount in chunk:
+            document = stored.get(wallet_id)
+            result = {'index': index, 'wallet_id': wallet_id}
+            if document is None:
+                result.update(status='error', errors={'wallet_id': ['Not found.']})
+            elif batch in document.get('applied_batches', ()):
+                result.update(status='skipped', errors={'non_field_errors': ['Already applied in this batch.']})
+            elif document.get('wallet_balance', 0) + amount < 0:
+                result.update(status='error', errors={'wallet_balance': ['Insufficient funds.']})
+            else:
+                result['status'] = 'applied'
+                requests.append(UpdateOne(dict(unapplied, _id=wallet_id, wallet_balance={'$gte': max(-amount, 0)}),
+                                          dict(mark, **{'$inc': {'wallet_balance': amount, 'version': 1}})))
+                sent.append(index)
+            results[index] = result
+        if not requests:
+            continue
+
+        matched = players.bulk_write(requests, ordered=False).matched_count
+        if matched == len(requests):
+            continue
+
+        # A concurrent write got in between, the batch marker tells which rows were applied
+        applied = _existing(players, [results[index]['wallet_id'] for index in sent], ['applied_batches'])
+        for index in sent:
+            document = applied.get(results[index]['wallet_id'])
+            if document is None:
+                results[index].update(status='error', errors={'wallet_id': ['Not found.']})
+            elif batch not in document.get('applied_batches', ()):
+                results[index].update(status='error', errors={'wallet_balance': ['Insufficient funds.']})
+    return batch, results
+
+
+def summary(results):
+    """
+    Row count per status
+    :param results: list of dict from create_players or adjust_balances
+    :return: dict
+    """
+
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    return counts
@@ -1,5 +1,6 @@
 import collections
-from random import shuffle
+from array import array
+from random import Random, SystemRandom, shuffle
 
 # namedtuple for FrenchDeck card list
 Card = collections.namedtuple('Card', ['rank', 'suit'])
@@ -13,14 +14,18 @@ class FrenchDeck:
     ranks = [str(n) for n in range(2, 11)] + list('JQKA')
     suits = 'spades diamonds clubs hearts'.split()
 
-    def __init__(self):
+    def __init__(self, seed=None):
         """
 
+        :param seed: int shuffle seed, the global random state when omitted
         :return:
         """
 
         self.cards = [Card(rank, suit) for suit in self.suits for rank in self.ranks]
-        shuffle(self.cards)
+        if seed is None:
+            shuffle(self.cards)
+        else:
+            seeded_shuffle(self.cards, seed)
 
     def __len__(self):
         """
@@ -28,4 +33,240 @@ class FrenchDeck:
         :return:
         """
 
-        return len(self.cards)
\ No newline at end of file
+        return len(self.cards)
+
+    def compact(self):
+        """
+        Integer coded copy of the deck, drawing in list.pop() order
+        :return: CompactDeck
+        """
+
+        return CompactDeck.from_cards(reversed(self.cards))
+
+
+# Seeds of new games come from the OS, so neither other threads nor earlier games can predict or disturb them
+_seeds = SystemRandom()
+
+
+def new_seed():
+    """
+    Fresh shuffle seed, it fits a signed 64-bit integer
+    :return: int
+    """
+
+    return _seeds.getrandbits(63)
+
+
+def seeded_shuffle(items, seed):
+    """
+    Shuffle in place with a private generator, the order depends only on the seed
+    :param items: mutable sequence
+    :param seed: int
+    :return: None
+    """
+
+    # Fisher-Yates over random() rather than Random.shuffle, whose index selection differs between Python versions
+    rng = Random(seed)
+    for i in reversed(range(1, len(items))):
+        j = int(rng.random() * (i + 1))
+        items[i], items[j] = items[j], items[i]
+
+
+# Integer card codes, a card's code is its position in an unshuffled FrenchDeck (suit * 13 + rank)
+CARDS = tuple(Card(rank, suit) for suit in FrenchDeck.suits for rank in FrenchDeck.ranks)
+CODES = dict((card, code) for code, card in enumerate(CARDS))
+
+
+def encode(card):
+    """
+    Card to integer code
+    :param card: namedtuple or list of rank and suit
+    :return: int 0-51
+    """
+
+    return CODES[(card[0], card[1])]
+
+
+def decode(code):
+    """
+    Integer code to card
+    :param code: int 0-51
+    :return: namedtuple
+    """
+
+    return CARDS[code]
+
+
+def to_card(value):
+    """
+    Card from either an integer code or a stored rank/suit pair
+    :param value: int or list
+    :return: namedtuple
+    """
+
+    if isinstance(value, int):
+        return CARDS[value]
+    return Card(value[0], value[1])
+
+
+class CompactDeck(object):
+    """
+    Card deck stored as one byte per card, drawn with a cursor
+    """
+
+    __slots__ = ('codes', 'cursor')
+
+    def __init__(self, codes=None, cursor=0):
+        """
+
+        :param codes: iterable of card codes in draw order, a freshly shuffled deck when omitted
+        :param cursor: int index of the next card to draw
+        :return:
+        """
+
+        if codes is None:
+            codes = array('B', range(len(CARDS)))
+            shuffle(codes)
+        elif not isinstance(codes, array):
+            codes = array('B', codes)
+        self.codes = codes
+        self.cursor = cursor
+
+    def __len__(self):
+        """
+
+        :return: int cards left to draw
+        """
+
+        return len(self.codes) - self.cursor
+
+    def __eq__(self, other):
+        """
+
+        :param other:
+        :return:
+        """
+
+        return isinstance(other, CompactDeck) and self.remaining() == other.remaining()
+
+    def __ne__(self, other):
+        """
+
+        :param other:
+        :return:
+        """
+
+        return not self == other
+
+    def __hash__(self):
+        """
+
+        :return:
+        """
+
+        return hash(self.tobytes())
+
+    @classmethod
+    def shoe(cls, decks):
+        """
+        Freshly shuffled shoe of several decks
+        :param decks: int number of decks
+        :return: CompactDeck
+        """
+
+        codes = array('B', range(len(CARDS))) * decks
+        shuffle(codes)
+        return cls(codes)
+
+    @classmethod
+    def seeded(cls, seed, decks=1):
+        """
+        Deck shuffled from a seed, the same seed always gives the same order
+        :param seed: int shuffle seed
+        :param decks: int number of decks
+        :return: CompactDeck
+        """
+
+        codes = array('B', range(len(CARDS))) * decks
+        seeded_shuffle(codes, seed)
+        return cls(codes)
+
+    @classmethod
+    def from_cards(cls, cards):
+        """
+        Build from Card tuples in draw order
+        :param cards: iterable of namedtuple or list
+        :return: CompactDeck
+        """
+
+        return cls(array('B', [encode(card) for card in cards]))
+
+    @classmethod
+    def frombytes(cls, data):
+        """
+        Build from a byte buffer produced by tobytes
+        :param data: bytes
+        :return: CompactDeck
+        """
+
+        return cls(array('B', bytearray(data)))
+
+    def draw(self):
+        """
+        Draw the next card code
+        :return: int card code
+        """
+
+        code = self.codes[self.cursor]
+        self.cursor += 1
+        return code
+
+    def draw_card(self):
+        """
+        Draw the next card
+        :return: namedtuple
+        """
+
+        return CARDS[self.draw()]
+
+    def remaining(self):
+        """
+        Codes left to draw, next card first
+        :return: list of int
+        """
+
+        return self.codes[self.cursor:].tolist()
+
+    def as_stack(self):
+        """
+        Codes left to draw as a list whose last element is the next card, matching list.pop() order
+        :return: list of int
+        """
+
+        stack = self.remaining()
+        stack.reverse()
+        return stack
+
+    def to_cards(self):
+        """
+        Cards left to draw, next card first
+        :return: list of namedtuple
+        """
+
+        return [CARDS[code] for code in self.codes[self.cursor:]]
+
+    def tobytes(self):
+        """
+        Cards left to draw as a byte buffer
+        :return: bytes
+        """
+
+        return bytes(bytearray(self.codes[self.cursor:]))
+
+    def copy(self):
+        """
+        Independent copy of the undrawn cards
+        :return: CompactDeck
+        """
+
+        return CompactDeck(self.codes[self.cursor:])
@@ -0,0 +1,105 @@
+"""
+Validators and cache headers for conditional reads, so polling clients are answered without serializing anything
+"""
+
+import calendar
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from rest_framework.response import Response
+
+# Finished games never change again
+FINAL_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def make_etag(pk, version):
+    """
+    Entity tag of a document revision
+    :param pk: str primary key
+    :param version: int revision counter, None for documents written before it existed
+    :return: str quoted etag
+    """
+
+    return quote_etag('%s-%d' % (pk, version or 0))
+
+
+def timestamp(value):
+    """
+    Seconds since the epoch of a stored datetime
+    :param value: datetime, naive values are taken as UTC
+    :return: int or None
+    """
+
+    if value is None:
+        return None
+    return calendar.timegm(value.utctimetuple())
+
+
+def game_validators(pk, version, end_game_action, action_time):
+    """
+    Validators of a game, the modification time is only reliable once the game is finished and written
+    :param pk: str action id
+    :param version: int GameAction.version
+    :param end_game_action: bool
+    :param action_time: datetime
+    :return: tuple of etag and last modified timestamp or None
+    """
+
+    return make_etag(pk, version), timestamp(action_time) if end_game_action else None
+
+
+def is_conditional(request):
+    """
+    Whether a request carries validators worth checking before the document is loaded
+    :param request: rest_framework Request
+    :return: bool
+    """
+
+    return bool(request.META.get('HTTP_IF_NONE_MATCH') or request.META.get('HTTP_IF_MODIFIED_SINCE'))
+
+
+def not_modified(request, etag, last_modified=None):
+    """
+    Whether the client's cached copy is still current, If-None-Match takes precedence over If-Modified-Since
+    :param request: rest_framework Request
+    :param etag: str quoted etag of the current revision
+    :param last_modified: int timestamp, None when the document has no reliable modification time
+    :return: bool
+    """
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return '*' in etags or etag.strip('"') in etags
+
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return last_modified is not None and if_modified_since is not None and last_modified <= if_modified_since
+
+
+def add_validators(response, etag, last_modified=None, final=False):
+    """
+    Set the validators and cache policy of a response
+    :param response: Response
+    :param etag: str quoted etag
+    :param last_modified: int timestamp or None
+    :param final: bool the document will never change again
+    :return: Response
+    """
+
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+
+    # Live documents may be stored by clients but have to be revalidated on every use
+    response['Cache-Control'] = 'private, max-age=%d' % FINAL_MAX_AGE if final else 'private, no-cache'
+    return response
+
+
+def not_modified_response(etag, last_modified=None, final=False):
+    """
+    Empty 304 carrying the current validators
+    :param etag: str quoted etag
+    :param last_modified: int timestamp or None
+    :param final: bool the document will never change again
+    :return: Response
+    """
+
+    return add_validators(Response(status=304), etag, last_modified, final)
@@ -0,0 +1,138 @@
+"""
+Serializers compiled to plain functions, output identical to the DRF serializers they are generated from
+"""
+
+import threading
+from collections import OrderedDict
+from django.utils import six
+from rest_framework import fields as drf_fields
+from rest_framework import relations
+from rest_framework.settings import ISO_8601
+
+# Compiled functions keyed by serializer class and field selection, the oldest dropped past MAX_COMPILED
+MAX_COMPILED = 256
+_compiled = OrderedDict()
+_lock = threading.Lock()
+
+
+def _same_method(field, cls):
+    """
+    Whether a field renders exactly like a DRF field class, subclasses that keep its to_representation included
+    :param field: Field instance
+    :param cls: Field class
+    :return: bool
+    """
+
+    method = type(field).to_representation
+    return isinstance(field, cls) and getattr(method, '__func__', method) is getattr(
+        cls.to_representation, '__func__', cls.to_representation)
+
+
+def _expression(field, index, namespace):
+    """
+    Source of the expression rendering a non-None value v, DRF's to_representation inlined where it is trivial
+    :param field: bound Field instance
+    :param index: int position of the field, names its helpers in the namespace
+    :param namespace: dict globals of the generated function
+    :return: str
+    """
+
+    if _same_method(field, drf_fields.CharField):
+        return 'text_type(v)'
+    if _same_method(field, drf_fields.IntegerField):
+        return 'int(v)'
+    if _same_method(field, drf_fields.FloatField):
+        return 'float(v)'
+    if _same_method(field, drf_fields.BooleanField):
+        namespace['f%d' % index] = field.to_representation
+        return 'v if v is True or v is False else f%d(v)' % index
+    if _same_method(field, drf_fields.UUIDField) and field.uuid_format == 'hex_verbose':
+        return 'str(v)'
+    if _same_method(field, drf_fields.DateTimeField) and field.format is None:
+        return 'v'
+    if _same_method(field, drf_fields.DateTimeField) and field.format.lower() == ISO_8601:
+        return 'iso_datetime(v)'
+    if _same_method(field, drf_fields.ListField) and isinstance(field.child, drf_fields._UnvalidatedField):
+        return 'list(v)'
+    namespace['f%d' % index] = field.to_representation
+    return 'f%d(v)' % index
+
+
+def iso_datetime(value):
+    """
+    DateTimeField's ISO 8601 representation
+    :param value: datetime
+    :return: str
+    """
+
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def _source(serializer_class, fields):
+    """
+    Source of the function rendering one instance
+    :param serializer_class: Serializer class
+    :param fields: frozenset of field names or None for all
+    :return: tuple of source str and namespace dict
+    """
+
+    namespace = {'OrderedDict': OrderedDict, 'text_type': six.text_type, 'iso_datetime': iso_datetime}
+    lines = ['def serialize(instance):', '    ret = OrderedDict()']
+    for index, field in enumerate(serializer_class()._readable_fields):
+        if fields is not None and field.field_name not in fields:
+            continue
+        name = repr(field.field_name)
+
+        # Primary key relations render the stored id without touching the related document
+        if isinstance(field, relations.PrimaryKeyRelatedField) and field.pk_field is None and \
+                len(field.source_attrs) == 1:
+            model_field = serializer_class.Meta.model._meta.get_field(field.source_attrs[0])
+            lines.append('    ret[%s] = instance.%s' % (name, model_field.attname))
+            continue
+
+        if len(field.source_attrs) == 1:
+            lines.append('    v = instance.%s' % field.source_attrs[0])
+        else:
+            namespace['g%d' % index] = field.get_attribute
+            lines.append('    v = g%d(instance)' % index)
+        lines.append('    ret[%s] = None if v is None else %s' % (name, _expression(field, index, namespace)))
+    lines.append('    return ret')
+    return '\n'.join(lines) + '\n', namespace
+
+
+def compile_serializer(serializer_class, fields=None):
+    """
+    Function rendering instances like serializer_class(instance, fields=fields).data, generated once per selection
+    :param serializer_class: ModelSerializer class without nested serializers or source='*' fields
+    :param fields: iterable of field names or None for all
+    :return: callable of a model instance returning an OrderedDict
+    """
+
+    # Output follows the serializer's field order, so a selection is the same whatever order it was asked in
+    key = (serializer_class, frozenset(fields) if fields is not None else None)
+    function = _compiled.get(key)
+    if function is None:
+        with _lock:
+            function = _compiled.get(key)
+            if function is None:
+                source, namespace = _source(serializer_class, key[1])
+                exec(compile(source, '<%s serializer>' % serializer_class.__name__, 'exec'), namespace)
+                function = _compiled[key] = namespace['serialize']
+                while len(_compiled) > MAX_COMPILED:
+                    _compiled.popitem(last=False)
+    return function
+
+
+def serialize(serializer_class, instance, fields=None):
+    """
+    Render one instance with the compiled serializer
+    :param serializer_class: ModelSerializer class
+    :param instance: model instance
+    :param fields: iterable of field names or None for all
+    :return: OrderedDict
+    """
+
+    return compile_serializer(serializer_class, fields)(instance)
@@ -0,0 +1,403 @@
+"""
+Hot cache for live games, so the actions of an active game don't each read and rewrite the document
+
+While a game is cached, each action only appends its events, the document is the snapshot written behind.
+"""
+
+import atexit
+import threading
+import time
+from datetime import timedelta
+from collections import OrderedDict
+from contextlib import contextmanager
+from uuid import uuid4
+from django.conf import settings
+from django.core.cache import get_cache
+from django.core.cache.backends.dummy import DummyCache
+from django.db.models import Q
+from django.utils import timezone
+from blackjack.models import GameAction, GameEvent
+from blackjack.projection import projected
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# Version token left behind by a finished game
+FINISHED = 'finished'
+
+
+class GameBusy(Exception):
+    """
+    Another request holds the game or round, or moved it on while this one was playing it
+    """
+
+
+@contextmanager
+def claim_row(model, pk, claim_timeout=10, claim_wait=1.0, load=None):
+    """
+    Lease a document in the database before it is read, so only one request at a time plays it
+    :param model: Model class with a claimed_until field
+    :param pk: str primary key
+    :param claim_timeout: int seconds the lease outlives a request that died holding it
+    :param claim_wait: float seconds to wait for another request's lease
+    :param load: callable of the primary key reading the instance once leased, a plain get when None
+    :return: context manager yielding the model instance
+    :raise GameBusy: the lease stayed with another request
+    :raise model.DoesNotExist:
+    """
+
+    deadline = time.time() + claim_wait
+    while True:
+        now = timezone.now()
+        free = model.objects.filter(Q(claimed_until=None) | Q(claimed_until__lt=now), pk=pk)
+        if free.update(claimed_until=now + timedelta(seconds=claim_timeout)):
+            break
+        if not model.objects.filter(pk=pk).exists():
+            raise model.DoesNotExist('%s matching query does not exist.' % model._meta.object_name)
+        if time.time() > deadline:
+            raise GameBusy(pk)
+        time.sleep(0.01)
+    try:
+        yield load(pk) if load is not None else model.objects.get(pk=pk)
+    finally:
+        model.objects.filter(pk=pk).update(claimed_until=None)
+
+
+class GameCache(object):
+    """
+    Process-local LRU of live games in front of an optional shared Django cache
+
+    Finished games are written through and dropped. An intermediate state only appends its action's events, the
+    snapshot document is written every snapshot_every revisions, and for a cached game also when the entry is
+    evicted, expires or the process exits. Reads replay the events a snapshot trails. With a shared backend the
+    local copy is only trusted while its version token matches the shared one, so several worker processes stay
+    consistent. A DummyCache backend disables caching, every state is read from the database. Requests that play
+    a game claim it first, in the shared backend, in this process or with a lease on the document when caching is
+    disabled.
+    """
+
+    def __init__(self, alias='default', max_entries=1024, timeout=300, claim_timeout=10, claim_wait=1.0,
+                 snapshot_every=8):
+        """
+
+        :param alias: str CACHES alias of the shared backend, None to cache in this process only
+        :param max_entries: int live games kept locally
+        :param timeout: int seconds before an idle game is persisted and dropped
+        :param claim_timeout: int seconds a claim outlives a request that died holding it
+        :param claim_wait: float seconds a request waits for a claimed game before giving up
+        :param snapshot_every: int revisions between snapshot writes of a live game
+        :return:
+        """
+
+        self.shared = get_cache(alias) if alias else None
+        self.enabled = not isinstance(self.shared, DummyCache)
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.claim_timeout = claim_timeout
+        self.claim_wait = claim_wait
+        self.snapshot_every = snapshot_every
+        self.local = OrderedDict()
+        self.claimed = set()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        """
+        Cache configured by settings.BLACKJACK_GAME_CACHE
+        :return: GameCache
+        """
+
+        options = getattr(settings, 'BLACKJACK_GAME_CACHE', {})
+        return cls(options.get('ALIAS', 'default'), options.get('MAX_ENTRIES', 1024), options.get('TIMEOUT', 300),
+                   options.get('CLAIM_TIMEOUT', 10), options.get('CLAIM_WAIT', 1.0), options.get('SNAPSHOT_EVERY', 8))
+
+    def _keys(self, pk):
+        """
+        Shared cache keys of a game's state and version token
+        :param pk: str action id
+        :return: tuple of str
+        """
+
+        return 'blackjack:game:%s' % pk, 'blackjack:game:%s:token' % pk
+
+    @contextmanager
+    def claim(self, pk):
+        """
+        Hold a game for one request, the state is read once the claim is held so it can't be a stale copy
+        :param pk: str action id
+        :return: context manager yielding the GameAction
+        :raise GameBusy: the game stayed claimed by another request
+        :raise GameAction.DoesNotExist:
+        """
+
+        if not self.enabled:
+            with self._claimed_row(pk) as action:
+                yield action
+            return
+
+        owner = uuid4().hex
+        deadline = time.time() + self.claim_wait
+        while not self._acquire(pk, owner):
+            if time.time() > deadline:
+                raise GameBusy(pk)
+            time.sleep(0.01)
+        try:
+            yield self.get(pk)
+        finally:
+            self._release(pk, owner)
+
+    def _acquire(self, pk, owner):
+        """
+        Try to claim a game, in the shared cache so every worker sees it, or in this process
+        :param pk: str action id
+        :param owner: str id of the claim
+        :return: bool whether the claim is held
+        """
+
+        if self.shared is not None:
+            return self.shared.add('blackjack:game:%s:claim' % pk, owner, self.claim_timeout)
+        with self.lock:
+            if pk in self.claimed:
+                return False
+            self.claimed.add(pk)
+            return True
+
+    def _release(self, pk, owner):
+        """
+        Give a claim back, one that expired and went to another request is left alone
+        :param pk: str action id
+        :param owner: str id of the claim
+        :return: None
+        """
+
+        if self.shared is not None:
+            key = 'blackjack:game:%s:claim' % pk
+            if self.shared.get(key) == owner:
+                self.shared.delete(key)
+            return
+        with self.lock:
+            self.claimed.discard(pk)
+
+    def _claimed_row(self, pk):
+        """
+        Claim without a cache, the game's document is leased in the database before it is read
+        :param pk: str action id
+        :return: context manager yielding the GameAction
+        :raise GameBusy: the lease stayed with another request
+        :raise GameAction.DoesNotExist:
+        """
+
+        return claim_row(GameAction, pk, self.claim_timeout, self.claim_wait, self.get)
+
+    def get(self, pk, only=None):
+        """
+        Current state of a game
+        :param pk: str action id
+        :param only: iterable of field names to read on a miss, a partial game is served but never cached
+        :return: GameAction, a private copy the caller may mutate
+        :raise GameAction.DoesNotExist:
+        """
+
+        queryset = projected(GameAction.objects.only(*only)) if only is not None else GameAction.objects
+        token = None
+        if self.enabled:
+            action, token = self._cached(pk)
+            if action is not None:
+                return action
+
+        action = queryset.get(action_id=pk)
+        if action.end_game_action:
+            return action
+
+        # Actions logged after the last written snapshot, a partial game can't replay them so it is read whole
+        events = list(GameEvent.objects.filter(action=pk, sequence__gt=action.version).order_by('sequence'))
+        if only is not None:
+            if not events:
+                return action
+            action = GameAction.objects.get(action_id=pk)
+        replayed = action.replay(events)
+        if action.end_game_action:
+            action.save()
+        elif self.enabled:
+            self._remember(pk, token, pickle.dumps(action, pickle.HIGHEST_PROTOCOL), replayed > 0)
+        return action
+
+    def validators(self, pk):
+        """
+        Revision of a game for conditional reads, from the cache or a projection that leaves the cards behind
+        :param pk: str action id
+        :return: tuple of version, end_game_action and action_time
+        :raise GameAction.DoesNotExist:
+        """
+
+        action = self._cached(pk)[0] if self.enabled else None
+        if action is not None:
+            return action.version, action.end_game_action, action.action_time
+
+        rows = GameAction.objects.filter(action_id=pk).values_list('version', 'end_game_action', 'action_time')
+        rows = list(rows[:1])
+        if not rows:
+            raise GameAction.DoesNotExist('GameAction matching query does not exist.')
+        version, ended, action_time = rows[0]
+
+        # Finished games are written at once, a live snapshot may trail its event log
+        if not ended:
+            events = GameEvent.objects.filter(action=pk, sequence__gt=version).order_by('-sequence')
+            events = list(events.values_list('sequence', 'event_time')[:1])
+            if events:
+                version, action_time = events[0]
+        return version, ended, action_time
+
+    def _cached(self, pk):
+        """
+        Current state of a game if this process or the shared cache holds it
+        :param pk: str action id
+        :return: tuple of GameAction or None and the shared version token read before it
+        """
+
+        state_key, token_key = self._keys(pk)
+        token = self.shared.get(token_key) if self.shared is not None else None
+        with self.lock:
+            entry = self.local.pop(pk, None)
+            if entry is not None:
+                expires, local_token, data, dirty = entry
+                if expires > time.time() and (self.shared is None or local_token == token):
+                    self.local[pk] = (time.time() + self.timeout, local_token, data, dirty)
+                    return pickle.loads(data), token
+        if entry is not None and dirty:
+            self._persist(data, local_token)
+
+        # Another worker holds a newer state
+        if token not in (None, FINISHED):
+            data = self.shared.get(state_key)
+            if data is not None:
+                self._remember(pk, token, data, False)
+                return pickle.loads(data), token
+        return None, token
+
+    def store(self, action):
+        """
+        Record a new state, finished games are saved at once and dropped from the cache
+        :param action: GameAction, read under a claim
+        :return: None
+        :raise GameBusy: the game was finished by another request
+        """
+
+        # A game finished elsewhere is never written again, nor brought back to life in the cache
+        state_key, token_key = self._keys(action.pk)
+        if self.enabled and self.shared is not None and self.shared.get(token_key) == FINISHED:
+            raise GameBusy(action.pk)
+
+        if action.end_game_action:
+            action.save()
+            self.discard(action.pk)
+            return
+
+        # Stored shoes advance as their cards are claimed, an unsaved one is written now, and the action's events
+        # are small inserts that make the state durable until the periodic snapshot is written. A change that
+        # logged no events can only be kept by a snapshot
+        snapshot = action.version % self.snapshot_every == 0 or not action.__dict__.get('_events')
+        if snapshot:
+            action.save()
+        else:
+            action.save_shoe()
+            action.save_events()
+        if not self.enabled:
+            return
+        data = pickle.dumps(action, pickle.HIGHEST_PROTOCOL)
+        token = uuid4().hex
+        if self.shared is not None:
+            self.shared.set_many({state_key: data, token_key: token}, self.timeout)
+        self._remember(action.pk, token, data, not snapshot)
+
+    def discard(self, pk):
+        """
+        Forget a game everywhere, stale copies in other workers are fenced off from writing it back
+        :param pk: str action id
+        :return: None
+        """
+
+        with self.lock:
+            self.local.pop(pk, None)
+        if self.enabled and self.shared is not None:
+            state_key, token_key = self._keys(pk)
+            self.shared.delete(state_key)
+            self.shared.set(token_key, FINISHED, self.timeout)
+
+    def flush(self):
+        """
+        Persist every intermediate state held by this process
+        :return: int games written
+        """
+
+        with self.lock:
+            entries, self.local = list(self.local.values()), OrderedDict()
+        written = 0
+        for expires, token, data, dirty in entries:
+            if dirty and self._persist(data, token):
+                written += 1
+        return written
+
+    def _remember(self, pk, token, data, dirty):
+        """
+        Keep a state locally, persisting whatever falls out of the LRU or has expired
+        :param pk: str action id
+        :param token: str version token, None when read from the database
+        :param data: bytes pickled GameAction
+        :param dirty: bool state is newer than the database
+        :return: None
+        """
+
+        now = time.time()
+        evicted = []
+        with self.lock:
+            self.local.pop(pk, None)
+            self.local[pk] = (now + self.timeout, token, data, dirty)
+            while len(self.local) > self.max_entries:
+                evicted.append(self.local.popitem(last=False)[1])
+            for key, entry in list(self.local.items()):
+                if entry[0] > now:
+                    break
+                evicted.append(self.local.pop(key))
+        for expires, old_token, old_data, old_dirty in evicted:
+            if old_dirty:
+                self._persist(old_data, old_token)
+
+    def _persist(self, data, token):
+        """
+        Write behind a cached state unless another worker has moved the game on since
+        :param data: bytes pickled GameAction
+        :param token: str version token of the state
+        :return: bool whether the state was saved
+        """
+
+        action = pickle.loads(data)
+        if self.shared is not None and self.shared.get(self._keys(action.pk)[1]) not in (None, token):
+            return False
+
+        # Write-behind is rare, so one extra read keeps a stale copy from overwriting a settled game
+        if GameAction.objects.filter(action_id=action.pk, end_game_action=True).exists():
+            return False
+        action.save()
+        return True
+
+
+_game_cache = None
+_game_cache_lock = threading.Lock()
+
+
+def get_game_cache():
+    """
+    Process-wide GameCache, created on first use and flushed at exit
+    :return: GameCache
+    """
+
+    global _game_cache
+    if _game_cache is None:
+        with _game_cache_lock:
+            if _game_cache is None:
+                _game_cache = GameCache.from_settings()
+                atexit.register(_game_cache.flush)
+    return _game_cache
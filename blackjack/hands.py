@@ -0,0 +1,88 @@
+"""
+Incremental hand evaluation
+"""
+
+from cards import CARDS
+
+# Hard point value per card rank, aces count as 1 here and are promoted to 11 while the hand stays soft
+RANK_VALUES = dict([(str(n), n) for n in range(2, 11)] + [(rank, 10) for rank in 'JQK'] + [('A', 1)])
+
+# The same table indexed by integer card code
+CODE_VALUES = tuple(RANK_VALUES[card.rank] for card in CARDS)
+
+
+class Hand(object):
+    """
+    Running hand state, updated in O(1) per card
+    """
+
+    __slots__ = ('hard', 'aces', 'count')
+
+    def __init__(self, cards=()):
+        """
+
+        :param cards: iterable of cards already in the hand
+        :return:
+        """
+
+        self.hard = 0
+        self.aces = 0
+        self.count = 0
+        for card in cards:
+            self.add(card)
+
+    def add(self, card):
+        """
+        Add a card to the hand
+        :param card: int card code, or namedtuple or list with the rank first
+        :return: int hand points
+        """
+
+        if isinstance(card, int):
+            value = CODE_VALUES[card]
+        else:
+            value = RANK_VALUES[card[0]]
+        self.hard += value
+        if value == 1:
+            self.aces += 1
+        self.count += 1
+        return self.points
+
+    @property
+    def soft(self):
+        """
+        Whether an ace is currently counted as 11
+        :return: bool
+        """
+
+        return self.aces > 0 and self.hard <= 11
+
+    @property
+    def points(self):
+        """
+        Best hand total
+        :return: int hand points
+        """
+
+        # Only one ace can ever be promoted without busting, so a single +10 is enough
+        if self.aces and self.hard <= 11:
+            return self.hard + 10
+        return self.hard
+
+    @property
+    def blackjack(self):
+        """
+        Two card 21
+        :return: bool
+        """
+
+        return self.count == 2 and self.points == 21
+
+    @property
+    def bust(self):
+        """
+        Hand is over 21
+        :return: bool
+        """
+
+        return self.hard > 21
@@ -0,0 +1,296 @@
+"""
+Load generator playing whole games against a running API, one thread per concurrent player
+"""
+
+import math
+import threading
+import time
+from collections import defaultdict
+import requests
+from blackjack import strategy
+from blackjack.hands import Hand, RANK_VALUES
+
+
+class LostGame(Exception):
+    """
+    A game was created but its final state could not be read back, so what it cost the wallet is unknown
+    """
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile
+    :param values: sorted list of float
+    :param fraction: float between 0 and 1
+    :return: float or None for no values
+    """
+
+    if not values:
+        return None
+
+    # The rank is ceil(fraction * n), the small offset keeps float noise such as 0.07 * 100 = 7.000000000000001
+    # from pushing it up a rank
+    rank = int(math.ceil(fraction * len(values) - 1e-9))
+    return values[min(len(values), max(1, rank)) - 1]
+
+
+class Recorder(object):
+    """
+    Latencies and status codes per endpoint and action, shared by all worker threads
+    """
+
+    def __init__(self):
+        """
+
+        :return:
+        """
+
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.started = time.time()
+        self.finished = None
+
+    def record(self, key, seconds, status):
+        """
+        Record one request
+        :param key: str endpoint and action label
+        :param seconds: float latency
+        :param status: int HTTP status, 0 when the request failed outright
+        :return: None
+        """
+
+        with self.lock:
+            self.latencies[key].append(seconds)
+            self.statuses[key][status] += 1
+
+    def report(self):
+        """
+        Throughput, latency percentiles and status rates per label and overall
+        :return: dict
+        """
+
+        elapsed = (self.finished or time.time()) - self.started
+        rows = {}
+        with self.lock:
+            keys = sorted(self.latencies)
+            all_latencies = sorted(s for key in keys for s in self.latencies[key])
+            totals = defaultdict(int)
+            for key in keys:
+                for status, count in self.statuses[key].items():
+                    totals[status] += count
+                rows[key] = self._summary(sorted(self.latencies[key]), self.statuses[key], elapsed)
+        rows['all'] = self._summary(all_latencies, totals, elapsed)
+        return rows
+
+    def _summary(self, latencies, statuses, elapsed):
+        """
+
+        :param latencies: sorted list of float seconds
+        :param statuses: dict of status and count
+        :param elapsed: float seconds the run took
+        :return: dict
+        """
+
+        count = len(latencies)
+        errors = sum(n for status, n in statuses.items() if status == 0 or status >= 500 or status in (401, 403))
+        return {
+            'requests': count,
+            'throughput': count / elapsed if elapsed else 0.0,
+            'p50_ms': _ms(percentile(latencies, 0.50)),
+            'p95_ms': _ms(percentile(latencies, 0.95)),
+            'p99_ms': _ms(percentile(latencies, 0.99)),
+            'error_rate': float(errors) / count if count else 0.0,
+            'not_modified_rate': float(statuses.get(304, 0)) / count if count else 0.0,
+            'bad_request_rate': float(statuses.get(400, 0)) / count if count else 0.0,
+        }
+
+
+def _ms(seconds):
+    """
+
+    :param seconds: float or None
+    :return: float milliseconds or None
+    """
+
+    return seconds * 1000.0 if seconds is not None else None
+
+
+class ApiClient(object):
+    """
+    One thread's HTTP session against the API, every call is timed into the recorder
+    """
+
+    def __init__(self, base_url, auth, recorder, timeout=30):
+        """
+
+        :param base_url: str server root, e.g. http://127.0.0.1:8000
+        :param auth: tuple of admin username and password, sent as HTTP basic auth
+        :param recorder: Recorder
+        :param timeout: float seconds per request
+        :return:
+        """
+
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+        self.session.auth = auth
+        self.session.headers['Accept'] = 'application/json'
+        self.recorder = recorder
+        self.timeout = timeout
+
+    def call(self, key, method, path, data=None):
+        """
+        Send a JSON request
+        :param key: str label the latency is recorded under
+        :param method: str HTTP method
+        :param path: str path below the server root
+        :param data: dict JSON body
+        :return: tuple of status and decoded body, None for empty or failed responses
+        """
+
+        started = time.time()
+        try:
+            response = self.session.request(method, self.base_url + path, json=data, timeout=self.timeout)
+        except requests.RequestException:
+            self.recorder.record(key, time.time() - started, 0)
+            return 0, None
+        self.recorder.record(key, time.time() - started, response.status_code)
+        try:
+            return response.status_code, response.json() if response.content else None
+        except ValueError:
+            return response.status_code, None
+
+
+def choose(state, stand_on):
+    """
+    Next action of a live game
+    :param state: dict game state from the API
+    :param stand_on: int player total to stand on, 0 to follow the strategy table
+    :return: str hit or stand
+    """
+
+    if stand_on:
+        return 'hit' if state['player_points'] < stand_on else 'stand'
+    hand = [(card[0], card[1]) for card in state['player_hand']]
+    entry = strategy.lookup(state['player_points'], Hand(hand).soft, RANK_VALUES[state['dealer_hand'][0][0]])
+    return entry['action'] if entry else 'stand'
+
+
+def settlement(state):
+    """
+    Wallet change of a game, as GameAction settles it
+    :param state: dict final game state
+    :return: float
+    """
+
+    # The bet is reserved at the deal, a dealt game left open keeps it and an undealt one took nothing
+    if not state['end_game_action']:
+        return -state['bet'] if state['player_hand'] else 0
+    if state['player_win']:
+        return state['bet'] * 1.5 if state['player_blackjack'] else state['bet']
+    if state['dealer_win']:
+        return -state['bet']
+    return 0
+
+
+def play_game(client, wallet_id, bet, stand_on):
+    """
+    Create a game and play it to the end
+    :param client: ApiClient
+    :param wallet_id: str player
+    :param bet: int
+    :param stand_on: int player total to stand on, 0 to follow the strategy table
+    :return: dict final state, None when no game was created
+    :raise LostGame: the game was abandoned and its stored state could not be read
+    """
+
+    status, state = client.call('POST gameactions', 'POST', '/blackjack/gameactions/',
+                                {'player': wallet_id, 'bet': bet})
+    if status not in (200, 201) or not state or 'action_id' not in state:
+        return None
+    path = '/blackjack/gameactions/%s/' % state['action_id']
+
+    player_action = 'deal'
+    while True:
+        status, new_state = client.call('PATCH ' + player_action, 'PATCH', path, {'player_action': player_action})
+
+        # An action turned away or lost may follow a deal that already took the bet, the stored game tells
+        if status != 200 or not new_state:
+            status, stored = client.call('GET gameaction', 'GET', path)
+            if status != 200 or not stored:
+                raise LostGame(path)
+            return stored
+        if new_state['end_game_action']:
+            return new_state
+        state, player_action = new_state, choose(new_state, stand_on)
+
+
+def balance_check(start, change, actual, lost=0):
+    """
+    Whether a wallet holds what its games' settlements add up to
+    :param start: int balance the wallet started with
+    :param change: float sum of the settlements of its games
+    :param actual: int balance read back, None when it could not be read
+    :param lost: int games of the wallet whose cost is unknown, the balance can't be checked then
+    :return: dict of expected, actual, lost and ok
+    """
+
+    expected = start + change
+    return {'expected': expected, 'actual': actual, 'lost': lost,
+            'ok': not lost and actual is not None and actual == expected}
+
+
+def run(base_url, auth, players=10, games=10, bet=10, stand_on=17, shared_wallet=False, balance=10 ** 6):
+    """
+    Create players and have each play its games in its own thread
+    :param base_url: str server root
+    :param auth: tuple of admin username and password
+    :param players: int concurrent players
+    :param games: int games per player
+    :param bet: int bet per game, even so blackjack payouts stay whole
+    :param stand_on: int player total to stand on, 0 to follow the strategy table
+    :param shared_wallet: bool all players bet from one wallet, to check concurrent settlements
+    :param balance: int starting balance of each wallet
+    :return: tuple of Recorder and dict of wallet id and balance check
+    """
+
+    recorder = Recorder()
+    setup = ApiClient(base_url, auth, recorder)
+    wallets = []
+    for i in range(1 if shared_wallet else players):
+        status, player = setup.call('POST players', 'POST', '/players/', {'wallet_balance': balance})
+        if status not in (200, 201) or not player or 'wallet_id' not in player:
+            raise RuntimeError('Could not create a player: %s %s' % (status, player))
+        wallets.append(player['wallet_id'])
+
+    expected, lost = defaultdict(float), defaultdict(int)
+    lock = threading.Lock()
+
+    def worker(wallet_id):
+        client = ApiClient(base_url, auth, recorder)
+        for game in range(games):
+            try:
+                state = play_game(client, wallet_id, bet, stand_on)
+            except LostGame:
+                with lock:
+                    lost[wallet_id] += 1
+                continue
+            if state is not None:
+                with lock:
+                    expected[wallet_id] += settlement(state)
+
+    threads = [threading.Thread(target=worker, args=(wallets[i % len(wallets)],)) for i in range(players)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    recorder.finished = time.time()
+
+    # Every settlement must have reached the wallet exactly once, checked outside the measured traffic
+    checks = {}
+    check = ApiClient(base_url, auth, Recorder())
+    for wallet_id in wallets:
+        status, player = check.call('GET players', 'GET', '/players/%s/' % wallet_id)
+        checks[wallet_id] = balance_check(balance, expected[wallet_id], player['wallet_balance'] if player else None,
+                                          lost[wallet_id])
+    return recorder, checks
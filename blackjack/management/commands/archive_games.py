@@ -0,0 +1,33 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from blackjack import archive
+
+
+class Command(BaseCommand):
+    """
+    Move old finished games to cold storage
+    """
+
+    help = ('Strip the decks of finished games and move those older than --days, with their events, to the archive '
+            'collection or a gzipped JSON lines file')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--days', type='int', default=30, help='Archive finished games last played before this many days'),
+        make_option('--chunk-size', type='int', default=500, help='Games moved per bulk write and delete'),
+        make_option('--file', default=None, help='Gzipped JSON lines file to append to instead of the collection'),
+    )
+
+    def handle(self, *args, **options):
+        """
+
+        :param args:
+        :param options:
+        :return:
+        """
+
+        if options['days'] < 0 or options['chunk_size'] < 1:
+            raise CommandError('--days must not be negative and --chunk-size must be positive')
+
+        archive.strip_finished_decks()
+        archived = archive.archive_games(options['days'], options['chunk_size'], options['file'])
+        self.stdout.write('Games archived: %d' % archived)
@@ -0,0 +1,61 @@
+import json
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from blackjack import benchmarks
+
+
+class Command(BaseCommand):
+    """
+    Time the hot paths and compare them with a saved baseline
+    """
+
+    help = 'Run the seeded micro-benchmarks, optionally saving the results and comparing them with a baseline'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--number', type='int', default=2000, help='Calls per timing run'),
+        make_option('--seed', type='int', default=0, help='Seed of the random module before each benchmark'),
+        make_option('--only', action='append', default=None, help='Benchmark to run, may be repeated'),
+        make_option('--api', action='store_true', default=False,
+                    help='Also time full PATCH requests, needs a database such as webapp.settings_local'),
+        make_option('--output', default=None, help='JSON file to write the results to'),
+        make_option('--baseline', default=None, help='JSON results of an earlier run to compare with'),
+        make_option('--tolerance', type='float', default=0.2, help='Slowdown allowed before failing, 0.2 is 20%'),
+    )
+
+    def handle(self, *args, **options):
+        """
+
+        :param args:
+        :param options:
+        :return:
+        """
+
+        names = options['only'] or list(benchmarks.BENCHMARKS) + (
+            list(benchmarks.DATABASE_BENCHMARKS) if options['api'] else [])
+        unknown = set(names) - set(benchmarks.BENCHMARKS) - set(benchmarks.DATABASE_BENCHMARKS)
+        if unknown:
+            raise CommandError('Unknown benchmarks: %s' % ', '.join(sorted(unknown)))
+
+        report = benchmarks.run(names, options['number'], options['seed'])
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+        if not options['baseline']:
+            for name, us in report['results'].items():
+                self.stdout.write('%-24s %12.2f us' % (name, us))
+            return
+
+        with open(options['baseline']) as f:
+            baseline = json.load(f)
+        regressions = []
+        for name, current, before, ratio, regressed in benchmarks.compare(report, baseline, options['tolerance']):
+            if ratio is None:
+                self.stdout.write('%-24s %12.2f us %12s' % (name, current, 'new'))
+                continue
+            self.stdout.write('%-24s %12.2f us %12.2f us %7.2fx%s' % (name, current, before, ratio,
+                                                                        '  REGRESSION' if regressed else ''))
+            if regressed:
+                regressions.append(name)
+        if regressions:
+            raise CommandError('Slower than %s: %s' % (options['baseline'], ', '.join(regressions)))
@@ -0,0 +1,31 @@
+import time
+from optparse import make_option
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from blackjack import strategy
+
+
+class Command(BaseCommand):
+    """
+    Precompute the strategy table into the on-disk cache
+    """
+
+    help = 'Compute hit/stand decisions and EVs for the house rules and cache them on disk'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--decks', type='int', default=None, help='Decks in the shoe, BLACKJACK_STRATEGY_DECKS by default'),
+    )
+
+    def handle(self, *args, **options):
+        """
+
+        :param args:
+        :param options:
+        :return:
+        """
+
+        started = time.time()
+        table = strategy.get_table(options['decks'])
+        self.stdout.write('%d entries for %s in %s (%.1fs)' % (
+            len(table), strategy.rules_key(options['decks'] or settings.BLACKJACK_STRATEGY_DECKS),
+            settings.BLACKJACK_STRATEGY_CACHE, time.time() - started))
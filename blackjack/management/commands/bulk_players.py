@@ -0,0 +1,54 @@
+import csv
+import json
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from blackjack import bulk
+
+
+class Command(BaseCommand):
+    """
+    Create or adjust wallets in bulk from a CSV file
+    """
+
+    args = 'create|adjust <csv file>'
+    help = ('Create wallets from a CSV with wallet_balance and optional wallet_id columns, or adjust balances from '
+            'one with wallet_id and amount columns')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch', default=None, help='Batch id of an adjustment, rerunning a batch never pays twice'),
+        make_option('--chunk-size', type='int', default=None, help='Rows per bulk operation'),
+        make_option('--output', default=None, help='JSON file to write the result of every row to'),
+    )
+
+    def handle(self, *args, **options):
+        """
+
+        :param args:
+        :param options:
+        :return:
+        """
+
+        if len(args) != 2 or args[0] not in ('create', 'adjust'):
+            raise CommandError('Usage: bulk_players %s' % self.args)
+        if options['chunk_size'] is not None and options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+        with open(args[1], 'rb') as f:
+            rows = [dict((key, value) for key, value in row.items() if value not in (None, ''))
+                    for row in csv.DictReader(f)]
+
+        report = {}
+        if args[0] == 'create':
+            results = bulk.create_players(rows, options['chunk_size'])
+        else:
+            report['batch'], results = bulk.adjust_balances(rows, options['batch'], options['chunk_size'])
+            self.stdout.write('Batch: %s' % report['batch'])
+        report.update(summary=bulk.summary(results), results=results)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+        for status, count in sorted(report['summary'].items()):
+            self.stdout.write('%-8s %d' % (status, count))
+        for result in results:
+            if result['status'] == 'error':
+                self.stdout.write('row %d: %s' % (result['index'] + 1, json.dumps(result['errors'])))
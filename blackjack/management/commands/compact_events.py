@@ -0,0 +1,52 @@
+from datetime import timedelta
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from blackjack.models import GameAction, GameEvent
+
+
+class Command(BaseCommand):
+    """
+    Fold the event log into the game snapshots
+    """
+
+    help = 'Write snapshots of live games whose events ran ahead of them, optionally prune the events of old games'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--prune-days', type='int', default=None,
+                    help='Delete the events of games finished more than this many days ago, kept by default'),
+        make_option('--chunk-size', type='int', default=500, help='Games per delete query when pruning'),
+    )
+
+    def handle(self, *args, **options):
+        """
+
+        :param args:
+        :param options:
+        :return:
+        """
+
+        # Live games replay their newer events, the result becomes their snapshot
+        snapshots = 0
+        for action in GameAction.objects.filter(end_game_action=False):
+            events = GameEvent.objects.filter(action=action.pk, sequence__gt=action.version).order_by('sequence')
+            if action.replay(events):
+                action.save()
+                snapshots += 1
+        self.stdout.write('Snapshots written: %d' % snapshots)
+
+        if options['prune_days'] is None:
+            return
+        if options['prune_days'] < 0 or options['chunk_size'] < 1:
+            raise CommandError('--prune-days must not be negative and --chunk-size must be positive')
+
+        # Finished games are whole snapshots, their events only matter for the audit trail
+        cutoff = timezone.now() - timedelta(days=options['prune_days'])
+        finished = list(GameAction.objects.filter(end_game_action=True, action_time__lt=cutoff)
+                        .values_list('action_id', flat=True))
+        pruned = 0
+        for start in range(0, len(finished), options['chunk_size']):
+            events = GameEvent.objects.filter(action__in=finished[start:start + options['chunk_size']])
+            pruned += events.count()
+            events.delete()
+        self.stdout.write('Events pruned: %d' % pruned)
@@ -0,0 +1,36 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import get_app, get_models
+
+
+class Command(BaseCommand):
+    """
+    Build the indexes declared on the blackjack models
+    """
+
+    help = ('Create the MongoMeta indexes and document_indexes of every blackjack collection, existing indexes are left '
+            'as they are')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--database', default=DEFAULT_DB_ALIAS, help='Database alias to create the indexes on'),
+    )
+
+    def handle(self, *args, **options):
+        """
+
+        :param args:
+        :param options:
+        :return:
+        """
+
+        connection = connections[options['database']]
+        for model in get_models(get_app('blackjack')):
+            connection.creation.sql_indexes_for_model(model, no_style())
+            collection = connection.get_collection(model._meta.db_table)
+            for index in getattr(model._meta, 'document_indexes', ()):
+                index = index.copy()
+                collection.ensure_index(index.pop('fields'), **index)
+            for name, info in sorted(collection.index_information().items()):
+                self.stdout.write('%s: %s %s' % (model._meta.db_table, name, info['key']))
@@ -0,0 +1,65 @@
+import json
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from blackjack import loadtest
+
+
+class Command(BaseCommand):
+    """
+    Play concurrent games against a running server and report latencies
+    """
+
+    help = ('Create players and have them play whole games concurrently against a running API, e.g. '
+            '"manage.py runserver --settings=webapp.settings_local" for an in-process database stand-in')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--url', default='http://127.0.0.1:8000', help='Server root'),
+        make_option('--username', default='admin', help='Admin user, sent as HTTP basic auth'),
+        make_option('--password', default='admin', help='Admin password'),
+        make_option('--players', type='int', default=10, help='Concurrent players'),
+        make_option('--games', type='int', default=20, help='Games per player'),
+        make_option('--bet', type='int', default=10, help='Bet per game'),
+        make_option('--stand-on', type='int', default=17,
+                    help='Player total to stand on, 0 follows the strategy table'),
+        make_option('--shared-wallet', action='store_true', default=False,
+                    help='All players bet from one wallet, to check concurrent settlements'),
+        make_option('--output', default=None, help='JSON file to write the report to'),
+    )
+
+    def handle(self, *args, **options):
+        """
+
+        :param args:
+        :param options:
+        :return:
+        """
+
+        if options['players'] < 1 or options['games'] < 1:
+            raise CommandError('--players and --games must be positive')
+        try:
+            recorder, checks = loadtest.run(options['url'], (options['username'], options['password']),
+                                            options['players'], options['games'], options['bet'],
+                                            options['stand_on'], options['shared_wallet'])
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        report = recorder.report()
+        self.stdout.write('%-20s %8s %9s %9s %9s %9s %7s %7s %7s' % (
+            'endpoint', 'requests', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors', '304', '400'))
+        for key in sorted(report, key=lambda key: (key == 'all', key)):
+            row = report[key]
+            self.stdout.write('%-20s %8d %9.1f %9.1f %9.1f %9.1f %6.1f%% %6.1f%% %6.1f%%' % (
+                key, row['requests'], row['throughput'], row['p50_ms'] or 0, row['p95_ms'] or 0, row['p99_ms'] or 0,
+                row['error_rate'] * 100, row['not_modified_rate'] * 100, row['bad_request_rate'] * 100))
+
+        for wallet_id, check in sorted(checks.items()):
+            if check['lost']:
+                self.stdout.write('Wallet %s: %d games of unknown outcome, not checked' % (wallet_id, check['lost']))
+            elif not check['ok']:
+                self.stdout.write('Wallet %s: expected %s, found %s' % (wallet_id, check['expected'], check['actual']))
+        self.stdout.write('%d of %d wallet balances consistent' % (
+            sum(1 for check in checks.values() if check['ok']), len(checks)))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'endpoints': report, 'wallets': checks}, f, indent=2)
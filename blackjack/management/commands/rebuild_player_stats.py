@@ -0,0 +1,88 @@
+from itertools import chain, islice
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from pymongo import UpdateOne
+from blackjack.bulk import collection
+from blackjack.models import Player, GameAction, GameArchive, Round, OUTCOME_FLAGS
+from blackjack.projection import projected
+
+
+def _net(action):
+    """
+    Amount a finished game paid the player
+    :param action: GameAction
+    :return: signed amount
+    """
+
+    if action.game_push:
+        return 0
+    if action.player_win:
+        return action.bet * 1.5 if action.player_blackjack else action.bet
+    return -action.bet if action.dealer_win else 0
+
+
+def _add(totals, wallet_id, increments):
+    """
+    Add a game's or seat's counter increments to a player's totals
+    :param totals: dict of wallet id and dict of counters
+    :param wallet_id: str
+    :param increments: dict of Player field and increment
+    :return: None
+    """
+
+    counters = totals.setdefault(wallet_id, {})
+    for name, value in increments.items():
+        counters[name] = counters.get(name, 0) + value
+
+
+class Command(BaseCommand):
+    """
+    Recount the player statistics from the finished games and the settled table seats
+    """
+
+    help = ('Overwrite the counters of every player that has finished games or settled table seats with totals '
+            'recounted from the games, the archive and the table rounds, for players from before the counters '
+            'existed. Run it while no games or rounds are being played')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size', type='int', default=1000, help='Players per bulk write'),
+    )
+
+    def handle(self, *args, **options):
+        """
+
+        :param args:
+        :param options:
+        :return:
+        """
+
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        # Games and rounds are streamed from their cursors, only the per-player totals are held in memory
+        fields = ('action_id', 'player', 'bet') + OUTCOME_FLAGS
+        finished = projected(GameAction.objects.filter(end_game_action=True).only(*fields)).iterator()
+        archived = (record.to_game() for record in projected(GameArchive.objects.defer('events')).iterator())
+        totals, games = {}, 0
+        for action in chain(finished, archived):
+            games += 1
+            _add(totals, action.player_id, action.outcome_stats(_net(action)))
+
+        # Table rounds settle their seats into the same counters
+        seats = 0
+        for game_round in projected(Round.objects.filter(end_round=True).only('round_id', 'seats')).iterator():
+            for seat in game_round.seats:
+                if seat.get('settled'):
+                    seats += 1
+                    _add(totals, seat['wallet_id'], Round.seat_stats(seat))
+
+        players = collection(Player)
+        requests = (UpdateOne({'_id': wallet_id}, {'$set': counters}) for wallet_id, counters in totals.items())
+        while True:
+            chunk = list(islice(requests, options['chunk_size']))
+            if not chunk:
+                break
+            players.bulk_write(chunk, ordered=False)
+        self.stdout.write('Games counted: %d' % games)
+        self.stdout.write('Table seats counted: %d' % seats)
+        self.stdout.write('Players updated: %d' % len(totals))
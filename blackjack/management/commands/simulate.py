@@ -0,0 +1,97 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import cpu_count
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from blackjack.simulation import SimulationResult, simulate_shard
+
+
+class Command(BaseCommand):
+    """
+    Sharded multi-core simulation of the house rules
+    """
+
+    help = 'Simulate hands under the house rules across worker processes'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--hands', type='int', default=10 ** 7, help='Total hands to play'),
+        make_option('--shard-size', type='int', default=10 ** 6, help='Hands per shard'),
+        make_option('--workers', type='int', default=cpu_count(), help='Worker processes'),
+        make_option('--seed', type='int', default=0, help='Master seed, shards derive their streams from it'),
+        make_option('--stand-on', type='int', default=17, help='Player total to stand on'),
+        make_option('--decks', type='int', default=1, help='Decks per shuffle'),
+        make_option('--checkpoint', default=None, help='JSON file to record finished shards in and resume from'),
+    )
+
+    def handle(self, *args, **options):
+        """
+
+        :param args:
+        :param options:
+        :return:
+        """
+
+        params = dict((key, options[key]) for key in ('hands', 'shard_size', 'seed', 'stand_on', 'decks'))
+        if params['hands'] < 1 or params['shard_size'] < 1:
+            raise CommandError('--hands and --shard-size must be positive')
+        shards = (params['hands'] + params['shard_size'] - 1) // params['shard_size']
+
+        # Resume from a checkpoint of the same run
+        checkpoint = options['checkpoint']
+        done = set()
+        result = SimulationResult()
+        if checkpoint and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                state = json.load(f)
+            if state['params'] != params:
+                raise CommandError('Checkpoint %s belongs to a different run: %s' % (checkpoint, state['params']))
+            done = set(state['done'])
+            result = SimulationResult(state['counts'])
+            self.stdout.write('Resuming with %d of %d shards done' % (len(done), shards))
+
+        # Shard results are integer counts, so the merged total does not depend on completion order
+        pending = [index for index in range(shards) if index not in done]
+        started = time.time()
+        played = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            futures = [executor.submit(simulate_shard, index, self.shard_hands(params, index), params['seed'],
+                                       params['stand_on'], params['decks']) for index in pending]
+            for future in as_completed(futures):
+                index, counts = future.result()
+                shard = SimulationResult(counts)
+                result.merge(shard)
+                done.add(index)
+                played += shard.hands
+                if checkpoint:
+                    self.save_checkpoint(checkpoint, params, done, result)
+                self.stdout.write('Shard %d done, %d/%d shards, %.0f hands/s' % (
+                    index, len(done), shards, played / max(time.time() - started, 1e-9)))
+
+        self.stdout.write(json.dumps(result.as_dict(), indent=2, sort_keys=True))
+
+    def shard_hands(self, params, index):
+        """
+        Hands in a shard, the last one takes the remainder
+        :param params: dict run parameters
+        :param index: int shard index
+        :return: int
+        """
+
+        return min(params['shard_size'], params['hands'] - index * params['shard_size'])
+
+    def save_checkpoint(self, path, params, done, result):
+        """
+        Write the checkpoint atomically so an interrupted run never leaves a partial file
+        :param path: str checkpoint file
+        :param params: dict run parameters
+        :param done: set of finished shard indexes
+        :param result: SimulationResult merged so far
+        :return: None
+        """
+
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'params': params, 'done': sorted(done), 'counts': result.counts}, f)
+        os.rename(tmp, path)
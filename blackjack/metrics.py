@@ -0,0 +1,486 @@
+"""
+In-process request histograms, exposed in the Prometheus text format
+
+Collection is switched on by settings.BLACKJACK_METRICS. When it is off the middleware unloads itself, no request
+context is ever opened, every hook below returns at its first check and the database collections are not wrapped.
+Each worker process keeps its own histograms, so every worker has to be scraped.
+"""
+
+import threading
+import time
+from bson import BSON
+from bson.errors import InvalidDocument
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+# Upper bounds of the histogram buckets
+SECONDS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNTS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+# Name, help text and buckets of every histogram, observed once per request
+HISTOGRAMS = (
+    ('blackjack_request_seconds', 'Wall time of a request', SECONDS),
+    ('blackjack_db_seconds', 'Time waiting on the database per request', SECONDS),
+    ('blackjack_db_operations', 'Database operations per request', COUNTS),
+    ('blackjack_db_bytes_read', 'BSON bytes of the documents read per request', BYTES),
+    ('blackjack_db_bytes_written', 'BSON bytes of the documents and updates written per request', BYTES),
+    ('blackjack_serializer_seconds', 'Time spent serializing responses per request', SECONDS),
+    ('blackjack_engine_seconds', 'Time spent in the game rules, hand points included, per request', SECONDS),
+)
+
+# Values of the action label, anything else a client sends is counted as other
+ACTIONS = ('deal', 'hit', 'stand', 'batch')
+
+# Request context fed by each histogram, in HISTOGRAMS order after the wall time
+FIELDS = ('db', 'db_operations', 'db_bytes_read', 'db_bytes_written', 'serializer', 'engine')
+
+
+def enabled():
+    """
+    Whether metrics are collected
+    :return: bool
+    """
+
+    return getattr(settings, 'BLACKJACK_METRICS', False)
+
+
+class Histogram(object):
+    """
+    Cumulative bucket counts, sum and count of one labelled series
+    """
+
+    __slots__ = ('bounds', 'buckets', 'sum', 'count')
+
+    def __init__(self, bounds):
+        """
+
+        :param bounds: tuple of bucket upper bounds, ascending
+        :return:
+        """
+
+        self.bounds = bounds
+        self.buckets = [0] * len(bounds)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """
+        Record one value, the caller holds the registry lock
+        :param value: float
+        :return: None
+        """
+
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.buckets[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class Registry(object):
+    """
+    Histograms keyed by name and labels
+    """
+
+    def __init__(self):
+        """
+
+        :return:
+        """
+
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def observe(self, name, bounds, labels, value):
+        """
+        Record a value
+        :param name: str metric name
+        :param bounds: tuple of bucket upper bounds
+        :param labels: tuple of label name and value pairs
+        :param value: float
+        :return: None
+        """
+
+        key = (name, labels)
+        with self.lock:
+            histogram = self.series.get(key)
+            if histogram is None:
+                histogram = self.series[key] = Histogram(bounds)
+            histogram.observe(value)
+
+    def render(self):
+        """
+        Every series in the Prometheus text exposition format
+        :return: str
+        """
+
+        with self.lock:
+            snapshot = [(key, list(h.buckets), h.sum, h.count) for key, h in self.series.items()]
+        lines = []
+        for name, help_text, bounds in HISTOGRAMS:
+            series = sorted((labels, buckets, total, count) for (metric, labels), buckets, total, count in snapshot
+                            if metric == name)
+            if not series:
+                continue
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s histogram' % name)
+            for labels, buckets, total, count in series:
+                cumulative = 0
+                for bound, n in zip(bounds, buckets):
+                    cumulative += n
+                    lines.append('%s_bucket%s %d' % (name, _labels(labels + (('le', _number(bound)),)), cumulative))
+                lines.append('%s_bucket%s %d' % (name, _labels(labels + (('le', '+Inf'),)), count))
+                lines.append('%s_sum%s %s' % (name, _labels(labels), _number(total)))
+                lines.append('%s_count%s %d' % (name, _labels(labels), count))
+        return '\n'.join(lines) + '\n'
+
+
+def _number(value):
+    """
+
+    :param value: int or float
+    :return: str
+    """
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(labels):
+    """
+    Label set in exposition syntax
+    :param labels: tuple of name and value pairs
+    :return: str
+    """
+
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"')
+                                          .replace('\n', '\\n')) for name, value in labels)
+
+
+registry = Registry()
+_local = threading.local()
+
+
+class RequestContext(object):
+    """
+    Counters of the request being served by this thread
+    """
+
+    __slots__ = ('started', 'view', 'action') + FIELDS
+
+    def __init__(self):
+        """
+
+        :return:
+        """
+
+        self.started = time.time()
+        self.view = ''
+        self.action = ''
+        for field in FIELDS:
+            setattr(self, field, 0)
+
+
+def begin():
+    """
+    Open the context of a new request on this thread
+    :return: RequestContext
+    """
+
+    _local.context = context = RequestContext()
+    return context
+
+
+def current():
+    """
+    Context of the request being served, None when metrics are off
+    :return: RequestContext or None
+    """
+
+    return getattr(_local, 'context', None)
+
+
+def finish():
+    """
+    Close the thread's request context and record its histograms
+    :return: None
+    """
+
+    context = current()
+    if context is None:
+        return
+    _local.context = None
+    labels = (('view', context.view), ('action', context.action))
+    values = (time.time() - context.started,) + tuple(getattr(context, field) for field in FIELDS)
+    for (name, help_text, bounds), value in zip(HISTOGRAMS, values):
+        registry.observe(name, bounds, labels, value)
+
+
+def set_action(action):
+    """
+    Label the current request with a game action
+    :param action: str deal, hit, stand or batch
+    :return: None
+    """
+
+    context = current()
+    if context is not None:
+        context.action = action if action in ACTIONS else 'other'
+
+
+def count_db(operations=1, read=0, written=0, seconds=0.0):
+    """
+    Add database work to the current request
+    :param operations: int
+    :param read: int bytes
+    :param written: int bytes
+    :param seconds: float time waiting on the database
+    :return: None
+    """
+
+    context = current()
+    if context is not None:
+        context.db_operations += operations
+        context.db_bytes_read += read
+        context.db_bytes_written += written
+        context.db += seconds
+
+
+class timer(object):
+    """
+    Context manager adding the time of a block to a field of the current request, serializer or engine, database
+    round trips made inside the block are left to the database histogram
+    """
+
+    __slots__ = ('field', 'context', 'started', 'db')
+
+    def __init__(self, field):
+        """
+
+        :param field: str serializer or engine
+        :return:
+        """
+
+        self.field = field
+
+    def __enter__(self):
+        self.context = current()
+        if self.context is not None:
+            self.db = self.context.db
+            self.started = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        context = self.context
+        if context is not None:
+            elapsed = time.time() - self.started - (context.db - self.db)
+            setattr(context, self.field, getattr(context, self.field) + elapsed)
+        return False
+
+
+def _size(document):
+    """
+    BSON size of a document
+    :param document: dict
+    :return: int bytes
+    """
+
+    try:
+        return len(BSON.encode(document))
+    except (InvalidDocument, TypeError):
+        return 0
+
+
+class MeteredCursor(object):
+    """
+    Cursor counting the bytes of the documents it yields, and the time fetching them, into the current request
+    """
+
+    def __init__(self, cursor):
+        """
+
+        :param cursor: pymongo Cursor
+        :return:
+        """
+
+        self.cursor = cursor
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        documents = iter(self.cursor)
+        while True:
+            started = time.time()
+            try:
+                document = next(documents)
+            except StopIteration:
+                count_db(0, seconds=time.time() - started)
+                return
+            count_db(0, read=_size(document), seconds=time.time() - started)
+            yield document
+
+    def sort(self, *args, **kwargs):
+        self.cursor.sort(*args, **kwargs)
+        return self
+
+    def skip(self, skip):
+        self.cursor.skip(skip)
+        return self
+
+    def limit(self, limit):
+        self.cursor.limit(limit)
+        return self
+
+    def count(self, *args, **kwargs):
+        started = time.time()
+        try:
+            return self.cursor.count(*args, **kwargs)
+        finally:
+            count_db(seconds=time.time() - started)
+
+
+class MeteredCollection(object):
+    """
+    Collection counting the operations the engine sends and the bytes it writes, like the engine's debug wrapper
+    """
+
+    def __init__(self, collection):
+        """
+
+        :param collection: pymongo Collection
+        :return:
+        """
+
+        self.collection = collection
+
+    def __getattr__(self, attr):
+        return getattr(self.collection, attr)
+
+    def timed(self, method, args, kwargs, written=0):
+        """
+        Run a collection method as one database operation
+        :param method: str
+        :param args: tuple
+        :param kwargs: dict
+        :param written: int bytes sent
+        :return: the method's result
+        """
+
+        started = time.time()
+        try:
+            return getattr(self.collection, method)(*args, **kwargs)
+        finally:
+            count_db(written=written, seconds=time.time() - started)
+
+    def find(self, *args, **kwargs):
+        # The query is sent on the first fetch, which the cursor times
+        count_db()
+        return MeteredCursor(self.collection.find(*args, **kwargs))
+
+    def save(self, document, *args, **kwargs):
+        return self.timed('save', (document,) + args, kwargs, _size(document))
+
+    def update(self, spec, document, *args, **kwargs):
+        return self.timed('update', (spec, document) + args, kwargs, _size(document))
+
+    def remove(self, *args, **kwargs):
+        return self.timed('remove', args, kwargs)
+
+    def insert_many(self, documents, *args, **kwargs):
+        return self.timed('insert_many', (documents,) + args, kwargs, sum(_size(d) for d in documents))
+
+    def bulk_write(self, requests, *args, **kwargs):
+        return self.timed('bulk_write', (requests,) + args, kwargs)
+
+    def update_one(self, spec, document, *args, **kwargs):
+        return self.timed('update_one', (spec, document) + args, kwargs, _size(document))
+
+    def find_one_and_update(self, spec, document, *args, **kwargs):
+        return self.timed('find_one_and_update', (spec, document) + args, kwargs, _size(document))
+
+
+def _metered(collection_class):
+    """
+    Collection factory wrapping the collections of another
+    :param collection_class: callable of database, name and options returning a Collection
+    :return: callable
+    """
+
+    def factory(database, name, **kwargs):
+        return MeteredCollection(collection_class(database, name, **kwargs))
+    factory.metered = True
+    return factory
+
+
+def meter_connection(sender, connection, **kwargs):
+    """
+    connection_created receiver, MongoDB connections hand out metered collections from then on
+    :param connection: DatabaseWrapper
+    :return: None
+    """
+
+    collection_class = getattr(connection, 'collection_class', None)
+    if collection_class is not None and not getattr(collection_class, 'metered', False):
+        connection.collection_class = _metered(collection_class)
+
+
+def install():
+    """
+    Meter the database connections, those of this thread and every one opened later
+    :return: None
+    """
+
+    connection_created.connect(meter_connection, dispatch_uid='blackjack.metrics.meter_connection')
+    for connection in connections.all():
+        meter_connection(None, connection)
+
+
+class MetricsMiddleware(object):
+    """
+    Opens a request context per request and records it once the response is ready
+    """
+
+    def __init__(self):
+        """
+        Only loaded when metrics are enabled
+        :raise MiddlewareNotUsed: metrics are off
+        """
+
+        if not enabled():
+            raise MiddlewareNotUsed()
+        install()
+
+    def process_request(self, request):
+        """
+
+        :param request: HttpRequest
+        :return: None
+        """
+
+        begin()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """
+        Label the request with the view class or function name
+        :return: None
+        """
+
+        context = current()
+        if context is not None:
+            view = getattr(view_func, 'cls', view_func)
+            context.view = getattr(view, '__name__', '')
+
+    def process_response(self, request, response):
+        """
+
+        :param request: HttpRequest
+        :param response: HttpResponse
+        :return: HttpResponse
+        """
+
+        finish()
+        return response
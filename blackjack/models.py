@@ -1,8 +1,38 @@
-from django.db import models as models
-from cards import FrenchDeck
+from django.conf import settings
+from django.db import connections, models as models
+from django.db.models import F
+from cards import CARDS, CompactDeck, encode, new_seed, to_card
+from hands import Hand
 from djangotoolbox.fields import ListField
 from uuid import uuid4
-from django.core.validators import MinValueValidator
+from django.core.validators import MinValueValidator, MaxValueValidator
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+from pymongo import DESCENDING, UpdateOne
+
+def new_id():
+    """
+    Fresh primary key for each instance
+    :return: str uuid
+    """
+
+    return str(uuid4())
+
+
+# Batch ids remembered per wallet, a batch retried after that many newer ones reached the wallet pays again
+APPLIED_BATCHES = 100
+
+
+def once_per_batch(batch):
+    """
+    Filter and update that make a raw wallet write apply once per batch id, whatever else wrote in between
+    :param batch: str bulk batch or round id
+    :return: tuple of filter dict and update dict
+    """
+
+    return ({'applied_batches': {'$ne': batch}},
+            {'$push': {'applied_batches': {'$each': [batch], '$slice': -APPLIED_BATCHES}}})
+
 
 class Player(models.Model):
     """
@@ -10,15 +40,197 @@ class Player(models.Model):
     """
 
     # Player instance variables
-    wallet_id = models.TextField(default=str(uuid4()), primary_key=True)
+    wallet_id = models.TextField(default=new_id, primary_key=True)
     wallet_balance = models.PositiveIntegerField(default=5000, validators=[MinValueValidator(1)])
+    version = models.PositiveIntegerField(default=0)
+
+    # Latest bulk adjustments and table rounds applied, each credits or debits a wallet only once
+    applied_batches = ListField()
+
+    # Table rounds whose bet is held until they settle
+    held_rounds = ListField()
+
+    # Finished games, counted when the game ends so stats never scan the history
+    hands_played = models.PositiveIntegerField(default=0)
+    hands_won = models.PositiveIntegerField(default=0)
+    hands_lost = models.PositiveIntegerField(default=0)
+    hands_pushed = models.PositiveIntegerField(default=0)
+    blackjacks = models.PositiveIntegerField(default=0)
+    busts = models.PositiveIntegerField(default=0)
+    total_wagered = models.PositiveIntegerField(default=0)
+    net_winnings = models.FloatField(default=0)
+
+    class MongoMeta:
+        # Leaderboards read the first entries of these
+        indexes = [
+            {'fields': [('net_winnings', DESCENDING)]},
+            {'fields': [('hands_played', DESCENDING)]},
+        ]
+
+    def adjust_balance(self, amount, stats=None):
+        """
+        Add to the wallet balance with one atomic server-side increment that never takes it below zero
+        :param amount: signed amount, negative to debit
+        :param stats: dict of counter field and increment, applied in the same update
+        :return: bool False when the wallet can't cover a debit
+        """
+
+        stats = stats or {}
+
+        # A player that was never saved has nothing to race with, saving it inserts the new balance
+        if self._state.adding:
+            if self.wallet_balance + amount < 0:
+                return False
+            self.wallet_balance += amount
+            self.version += 1
+            for name, value in stats.items():
+                setattr(self, name, getattr(self, name) + value)
+            self.save()
+            return True
+
+        # The balance filter and the $inc run as a single update, so concurrent settlements can't be lost
+        increments = dict((name, F(name) + value) for name, value in stats.items())
+        updated = Player.objects.filter(wallet_id=self.wallet_id, wallet_balance__gte=max(-amount, 0)).update(
+            wallet_balance=F('wallet_balance') + amount, version=F('version') + 1, **increments)
+        if not updated:
+            return False
+        self.wallet_balance += amount
+        self.version += 1
+        for name, value in stats.items():
+            setattr(self, name, getattr(self, name) + value)
+        return True
+
+
+class Shoe(models.Model):
+    """
+    Multi-deck shoe shared by consecutive hands, reshuffled when the cut card comes out
+
+    Games sharing a stored shoe claim cards by incrementing its cursor server side, the card order is only
+    written when the shoe is reshuffled. An unsaved shoe is drawn in memory.
+    """
+
+    # Shoe instance variables
+    shoe_id = models.TextField(default=new_id, primary_key=True)
+    decks = models.PositiveSmallIntegerField(default=6, validators=[MinValueValidator(1), MaxValueValidator(8)])
+    penetration = models.FloatField(default=0.75, validators=[MinValueValidator(0.25), MaxValueValidator(0.9)])
+    cards = ListField()
+    cursor = models.PositiveIntegerField(default=0)
+    cut_card = models.PositiveIntegerField(default=0)
+    shuffles = models.PositiveIntegerField(default=0)
+
+    def shuffle(self):
+        """
+        Gather all cards and reshuffle the shoe
+        :return: None
+        """
+
+        self.cards = CompactDeck.shoe(self.decks).remaining()
+        self.cursor = 0
+        self.cut_card = int(len(self.cards) * self.penetration)
+        self.shuffles += 1
+
+    def _collection(self):
+        """
+
+        :return: Collection
+        """
+
+        return connections[Shoe.objects.db].get_collection(Shoe._meta.db_table)
+
+    def refresh(self, fields=('cards', 'cursor', 'cut_card', 'shuffles')):
+        """
+        Reload the stored position, and the cards when they were reshuffled
+        :param fields: iterable of field names to read
+        :return: None
+        """
+
+        document = self._collection().find_one({'_id': self.pk}, dict((name, True) for name in fields))
+        if document.get('shuffles', self.shuffles) != self.shuffles and 'cards' not in document:
+            document = self._collection().find_one({'_id': self.pk})
+        for name in ('cards', 'cursor', 'cut_card', 'shuffles'):
+            if name in document:
+                setattr(self, name, document[name])
+
+    def reshuffle(self):
+        """
+        Reshuffle a stored shoe, unless another game has reshuffled it since it was read
+        :return: None
+        """
+
+        shuffles = self.shuffles
+        self.shuffle()
+        updated = self._collection().update_one(
+            {'_id': self.pk, 'shuffles': shuffles},
+            {'$set': {'cards': self.cards, 'cursor': 0, 'cut_card': self.cut_card, 'shuffles': self.shuffles}})
+        if not updated.matched_count:
+            self.refresh()
+
+    def start_hand(self):
+        """
+        Reshuffle before a new hand if the cut card has come out
+        :return: None
+        """
+
+        if not self._state.adding:
+            self.refresh(('cursor', 'cut_card', 'shuffles'))
+            if self.cursor >= self.cut_card:
+                self.reshuffle()
+        elif self.cursor >= self.cut_card:
+            self.shuffle()
+
+    def claim(self, count):
+        """
+        Draw the next cards, a stored shoe hands each card to exactly one game
+        :param count: int cards
+        :return: list of int card codes
+        """
+
+        if self._state.adding:
+            return [self.draw() for i in range(count)]
+
+        while True:
+            state = self._collection().find_one_and_update(
+                {'_id': self.pk, 'cursor': {'$lte': len(self.cards) - count}}, {'$inc': {'cursor': count}},
+                projection={'cursor': True, 'shuffles': True})
+
+            # The cut card only triggers a reshuffle between hands, running dry mid-hand is the exception
+            if state is None:
+                self.refresh(('cursor', 'shuffles'))
+                if self.cursor > len(self.cards) - count:
+                    self.reshuffle()
+                continue
+            if state['shuffles'] != self.shuffles:
+                self.refresh()
+
+                # Reshuffled again since the claim, those cards are gone
+                if state['shuffles'] != self.shuffles:
+                    continue
+            self.cursor = state['cursor'] + count
+            return self.cards[state['cursor']:self.cursor]
+
+    def draw(self):
+        """
+        Draw the next card code
+        :return: int card code
+        """
+
+        if not self._state.adding:
+            return self.claim(1)[0]
+
+        # The cut card only triggers a reshuffle between hands, running dry mid-hand is the exception
+        if self.cursor >= len(self.cards):
+            self.shuffle()
+        code = self.cards[self.cursor]
+        self.cursor += 1
+        return code
+
 
 class GameAction(models.Model):
     """ Game actions
     """
 
     # GameAction instance variables
-    action_id = models.TextField(default=str(uuid4()), primary_key=True)
+    action_id = models.TextField(default=new_id, primary_key=True)
     action_time = models.DateTimeField(auto_now_add=True, auto_now=True)
     action_type = models.TextField()
     next_actions = models.TextField()
@@ -37,7 +249,124 @@ class GameAction(models.Model):
     end_game_action = models.BooleanField(default=False)
     player = models.ForeignKey(Player, related_name='player', on_delete=models.CASCADE)
     action_deck = ListField()
+
+    # A dealt game stores the seed of its deck and how many cards it has drawn, not the cards themselves
+    deck_seed = models.BigIntegerField(null=True, blank=True)
+    deck_cursor = models.PositiveSmallIntegerField(default=0)
     player_action = models.TextField()
+    shoe = models.ForeignKey(Shoe, related_name='gameactions', null=True, blank=True, on_delete=models.SET_NULL)
+    version = models.PositiveIntegerField(default=0)
+
+    # Lease of the request playing the game when no cache arbitrates between requests
+    claimed_until = models.DateTimeField(null=True, blank=True)
+
+    class MongoMeta:
+        # Player history is read newest first, and filtered on whether the game is over
+        indexes = [
+            {'fields': ['player', ('action_time', DESCENDING)]},
+            {'fields': ['player', 'end_game_action']},
+
+            # Finished games are archived oldest first
+            {'fields': ['end_game_action', 'action_time']},
+        ]
+
+        # Game lists are paged newest first on (-action_time, -action_id). indexes resolves field names to columns and
+        # the primary key is stored as _id, so this one names document keys and ensure_indexes builds it
+        document_indexes = [
+            {'fields': [('action_time', DESCENDING), ('_id', DESCENDING)]},
+        ]
+
+    def save(self, *args, **kwargs):
+        """
+        Save the game and the shoe it drew from
+        :return: None
+        """
+
+        super(GameAction, self).save(*args, **kwargs)
+        self.save_shoe()
+        self.save_events()
+
+    def __getstate__(self):
+        """
+        Pickled state for the game cache, a stored shoe is left out so it is read again before the next draw
+        :return: dict
+        """
+
+        state = self.__dict__.copy()
+        shoe = state.get('_shoe_cache')
+        if shoe is not None and not shoe._state.adding:
+            del state['_shoe_cache']
+        return state
+
+    def save_shoe(self):
+        """
+        Persist a shoe drawn from before it was ever saved, a stored shoe advances as its cards are claimed
+        :return: None
+        """
+
+        if getattr(self, '_shoe_drawn', False):
+            if self.shoe._state.adding:
+                self.shoe.save()
+            self._shoe_drawn = False
+
+    def save_events(self):
+        """
+        Append the events recorded since the last call, ids are derived from the game so a retry rewrites them
+        :return: int events written
+        """
+
+        events = self.__dict__.pop('_events', None)
+        for event in events or ():
+            event.save()
+        return len(events or ())
+
+    def record(self, event_type, cards=(), deck=(), amount=None, deck_seed=None):
+        """
+        Queue an event for the revision the current action produces
+        :param event_type: str deal, hit, stand or settle
+        :param cards: list of int card codes drawn, in order
+        :param deck: list of int private deck stack before the deal
+        :param amount: signed settlement amount
+        :param deck_seed: int seed of the deck a deal shuffled
+        :return: GameEvent
+        """
+
+        sequence = self.version + 1
+        event = GameEvent(event_id='%s:%d:%s' % (self.pk, sequence, event_type), action_id=self.pk,
+                          sequence=sequence, event_type=event_type, cards=list(cards), deck=list(deck),
+                          amount=amount, deck_seed=deck_seed, event_time=timezone.now())
+        self.__dict__.setdefault('_events', []).append(event)
+        return event
+
+    def replay(self, events):
+        """
+        Bring a snapshot up to date with the events recorded after it, the wallet is left alone
+        :param events: iterable of GameEvent ordered by sequence
+        :return: int actions replayed
+        """
+
+        replayed = 0
+        for event in events:
+            if event.sequence <= self.version or event.event_type not in ('deal', 'hit', 'stand'):
+                continue
+            self._replay = list(event.cards)
+            try:
+                self.player_action = event.event_type
+                if event.event_type == 'deal' and event.deck_seed is not None:
+                    self.deck_seed = event.deck_seed
+                    self.deal()
+                elif event.event_type == 'deal':
+                    self.deal(deck=CompactDeck(reversed(event.deck)))
+                else:
+                    getattr(self, event.event_type)()
+            finally:
+                del self._replay
+            if self.end_game_action:
+                self.action_deck = []
+            self.version = event.sequence
+            self.action_time = event.event_time
+            replayed += 1
+        return replayed
 
     def calculate_points(self, cards):
         """
@@ -46,43 +375,172 @@ class GameAction(models.Model):
         :return: int hand points
         """
 
-        # Aggregate points
-        points = 0
+        return Hand(cards).points
 
-        for card in cards:
-            if card[0] in 'JQK':
-                points += 10
-                continue
-            if card[0] == 'A':
-                if points > 10:
-                    points += 1
-                else:
-                    points += 11
-                continue
-            else:
-                points += int(card[0])
-        return points
+    def reserve(self):
+        """
+        Take the bet from the wallet before any card is dealt
+        :return: None
+        :raise ValidationError: the wallet can't cover the bet
+        """
+
+        # Replayed deals reserved their bet when they happened
+        if '_replay' in self.__dict__:
+            return
+        if not self.player.adjust_balance(-self.bet):
+            raise ValidationError({'wallet_balance': ['Insufficient funds to cover the bet.']})
+
+    def settle(self, amount):
+        """
+        Return the reserved bet with the winnings, a credit that can't fail
+        :param amount: signed result for the player, -bet when the bet is lost
+        :return: None
+        """
+
+        # Replayed settlements were paid when they happened
+        if '_replay' in self.__dict__:
+            return
+        self.player.adjust_balance(self.bet + amount, self.outcome_stats(amount))
+        self._settled = amount
+
+    def outcome_stats(self, amount=0):
+        """
+        Player counter increments for a game that just ended
+        :param amount: signed amount paid out, 0 for a push
+        :return: dict of Player field and increment
+        """
+
+        return {'hands_played': 1, 'hands_won': int(self.player_win), 'hands_lost': int(self.dealer_win),
+                'hands_pushed': int(self.game_push), 'blackjacks': int(self.player_blackjack),
+                'busts': int(self.player_bust), 'total_wagered': self.bet, 'net_winnings': amount}
+
+    def draw(self):
+        """
+        Draw the next card from the game deck
+        :return: namedtuple
+        """
+
+        # Replays draw the recorded cards, keeping the private deck in step
+        replay = self.__dict__.get('_replay')
+        if replay is not None:
+            if self.action_deck:
+                self.action_deck.pop()
+            elif self.deck_seed is not None:
+                self.deck_cursor += 1
+            return CARDS[replay.pop(0)]
+
+        # Games dealt from a given deck store it as integer codes, older games may still hold rank/suit pairs
+        if self.action_deck:
+            card = to_card(self.action_deck.pop())
+
+        # Seeded games rebuild their deck from the seed once and step through it with the cursor
+        elif self.deck_seed is not None:
+            card = CARDS[self.seeded_deck().draw()]
+            self.deck_cursor += 1
+
+        # Games bound to a shoe draw from it, the deal claims its four cards at once
+        else:
+            self._shoe_drawn = True
+            claimed = self.__dict__.get('_shoe_cards')
+            card = CARDS[claimed.pop(0) if claimed else self.shoe.draw()]
 
-    def deal(self):
+        drawn = self.__dict__.get('_drawn')
+        if drawn is not None:
+            drawn.append(encode(card))
+        return card
+
+    def seeded_deck(self):
+        """
+        Cards a seeded game has yet to draw, rebuilt from the seed and the cursor
+        :return: CompactDeck, or None when the game has no seed
+        """
+
+        if self.deck_seed is None:
+            return None
+        cached = self.__dict__.get('_deck')
+        if cached is None or cached[0] != self.deck_seed:
+            cached = self._deck = (self.deck_seed, CompactDeck.seeded(self.deck_seed).codes)
+        return CompactDeck(cached[1], self.deck_cursor)
+
+    def apply(self, player_action):
+        """
+        Run a player action if the game allows it next
+        :param player_action: str deal, hit or stand
+        :return: bool False when the action is not allowed in the current state
+        """
+
+        if self.end_game_action:
+            return False
+        if self.next_actions == 'hit/stand' and player_action in ('hit', 'stand'):
+            pass
+        elif self.next_actions == '' and player_action == 'deal':
+            pass
+        else:
+            return False
+
+        self.player_action = player_action
+        self._drawn, self._dealt, self._settled = [], (), None
+        try:
+            getattr(self, player_action)()
+        finally:
+            drawn, dealt, settled = self.__dict__.pop('_drawn'), self.__dict__.pop('_dealt'), \
+                self.__dict__.pop('_settled')
+
+        # A finished game never draws again, the deal event still holds its deck
+        if self.end_game_action:
+            self.action_deck = []
+            HouseRollup.add_game(self, settled or 0)
+
+        # The action and its settlement are appended to the game's event log, a deal keeps the seed it shuffled
+        self.record(player_action, drawn, dealt, deck_seed=self.deck_seed if player_action == 'deal' else None)
+        if settled is not None:
+            self.record('settle', amount=settled)
+
+        # Every accepted action is a new revision, clients revalidate their copies against it
+        self.version += 1
+        return True
+
+    def deal(self, deck=None):
         """
         Deal game action
+        :param deck: CompactDeck to deal from, a freshly shuffled one when omitted
         :return: None
+        :raise ValidationError: the wallet can't cover the bet
         """
 
-        # Initialize the deck
-        deck = FrenchDeck()
-        self.action_deck = deck.cards
+        # The bet is on the table before the cards are, so a short wallet can never see them
+        self.reserve()
+
+        # Initialize the deck, games bound to a shoe keep no private deck
+        if deck is None and self.shoe_id:
+            self.shoe.start_hand()
+            self._shoe_cards = self.shoe.claim(4)
+            self.action_deck = []
+
+        # Other games shuffle from their own seed, one given beforehand replays that exact deck
+        elif deck is None:
+            if self.deck_seed is None:
+                self.deck_seed = new_seed()
+            self.deck_cursor = 0
+            self.action_deck = []
+        else:
+            self.deck_seed = None
+            self.action_deck = deck.as_stack()
+
+        # The starting deck goes into the deal event, so the game can be replayed from it
+        if '_dealt' in self.__dict__:
+            self._dealt = list(self.action_deck)
 
         # Set a game action
         self.action_type = 'deal'
 
         # Generate hands
-        self.player_hand = [self.action_deck.pop() for i in range(2)]
-        self.dealer_hand = [self.action_deck.pop() for i in range(2)]
+        self.player_hand = [self.draw() for i in range(2)]
+        self.dealer_hand = [self.draw() for i in range(2)]
 
         # Calculate points
-        self.player_points = self.calculate_points(self.player_hand)
-        self.dealer_points = self.calculate_points(self.dealer_hand)
+        self.player_points = Hand(self.player_hand).points
+        self.dealer_points = Hand(self.dealer_hand).points
 
         # Conditions
 
@@ -93,6 +551,7 @@ class GameAction(models.Model):
             self.dealer_blackjack = True
             self.player_blackjack = True
             self.next_actions = 'new'
+            self.settle(0)
 
         # If a player has blackjack and the dealer has less than 21 after deal (second card is revealed), player wins
         elif self.player_points == 21 and self.dealer_points < 21:
@@ -100,8 +559,7 @@ class GameAction(models.Model):
             self.player_win = True
             self.player_blackjack = True
             self.next_actions = 'new'
-            self.player.wallet_balance += self.bet * 1.5
-            self.player.save()
+            self.settle(self.bet * 1.5)
 
         # If a player has less than 21 points and dealer has <= 21 points (second card is hidden)
         #  The player chooses to hit or stand
@@ -117,11 +575,13 @@ class GameAction(models.Model):
         # Setting action type
         self.action_type = 'hit'
 
-        # One more card for the player
-        self.player_hand.append(self.action_deck.pop())
+        # One more card for the player, the hand state is rebuilt once and then updated incrementally
+        hand = Hand(self.player_hand)
+        card = self.draw()
+        self.player_hand.append(card)
 
         # Calculate points
-        self.player_points = self.calculate_points(self.player_hand)
+        self.player_points = hand.add(card)
 
         # Conditions
         # If the player has 21 and after revealing second card the dealer has 21, dealer has blackjack
@@ -129,8 +589,7 @@ class GameAction(models.Model):
             self.end_game_action = True
             self.dealer_blackjack = True
             self.dealer_win = True
-            self.player.wallet_balance -= self.bet
-            self.player.save()
+            self.settle(-self.bet)
             self.next_actions = 'new'
 
         # Player bust
@@ -138,8 +597,7 @@ class GameAction(models.Model):
             self.end_game_action = True
             self.player_bust = True
             self.dealer_win = True
-            self.player.wallet_balance -= self.bet
-            self.player.save()
+            self.settle(-self.bet)
             self.next_actions = 'new'
 
         # Player got under 21
@@ -150,8 +608,7 @@ class GameAction(models.Model):
         elif self.player_points == 21 and self.dealer_points < 21:
             self.end_game_action = True
             self.player_win = True
-            self.player.wallet_balance += self.bet
-            self.player.save()
+            self.settle(self.bet)
             self.next_actions = 'new'
 
     def stand(self):
@@ -168,33 +625,32 @@ class GameAction(models.Model):
             self.dealer_blackjack = True
             self.dealer_win = True
             self.end_game_action = True
-            self.player.wallet_balance -= self.bet
-            self.player.save()
+            self.settle(-self.bet)
             self.next_actions = 'new'
 
         # Player wins if dealer points greater than 17 and player points greater than dealer points
         elif self.dealer_points > 17 and self.player_points > self.dealer_points:
             self.player_win = True
             self.end_game_action = True
-            self.player.wallet_balance += self.bet
-            self.player.save()
+            self.settle(self.bet)
             self.next_actions = 'new'
 
         # Dealer points greater than player ones after revealing the second card
         elif self.dealer_points > self.player_points:
             self.end_game_action = True
             self.dealer_win = True
-            self.player.wallet_balance -= self.bet
-            self.player.save()
+            self.settle(-self.bet)
             self.next_actions = 'new'
 
         # Cards for the dealer if total points <= 17 and dealer points are less or equal than player points
         elif self.dealer_points <= 17 and self.dealer_points <= self.player_points:
 
             # Pick cards until bust, 21, or win
+            hand = Hand(self.dealer_hand)
             while self.dealer_points < 21:
-                self.dealer_hand.append(self.action_deck.pop())
-                self.dealer_points = self.calculate_points(self.dealer_hand)
+                card = self.draw()
+                self.dealer_hand.append(card)
+                self.dealer_points = hand.add(card)
 
                 # Conditions
                 # Dealer bust
@@ -202,8 +658,7 @@ class GameAction(models.Model):
                     self.end_game_action = True
                     self.dealer_bust = True
                     self.player_win = True
-                    self.player.wallet_balance += self.bet
-                    self.player.save()
+                    self.settle(self.bet)
                     self.next_actions = 'new'
                     break
 
@@ -211,8 +666,7 @@ class GameAction(models.Model):
                 elif self.dealer_points == 21:
                     self.end_game_action = True
                     self.dealer_win = True
-                    self.player.wallet_balance -= self.bet
-                    self.player.save()
+                    self.settle(-self.bet)
                     self.next_actions = 'new'
                     break
 
@@ -220,7 +674,474 @@ class GameAction(models.Model):
                 elif self.dealer_points > self.player_points:
                     self.end_game_action = True
                     self.dealer_win = True
-                    self.player.wallet_balance -= self.bet
-                    self.player.save()
+                    self.settle(-self.bet)
                     self.next_actions = 'new'
-                    break
\ No newline at end of file
+                    break
+
+        # Dealer over 17 tying the player is a push, the reserved bet goes back
+        else:
+            self.end_game_action = True
+            self.game_push = True
+            self.settle(0)
+            self.next_actions = 'new'
+
+class GameEvent(models.Model):
+    """
+    Append-only log of a game, one event per accepted action and one per settlement
+
+    The GameAction document is the snapshot, an event whose sequence is above the snapshot's version has not
+    been folded into it yet. Settlements are kept for the audit trail, replaying them never touches the wallet.
+    """
+
+    # GameEvent instance variables
+    event_id = models.TextField(primary_key=True)
+    action = models.ForeignKey(GameAction, related_name='events', on_delete=models.CASCADE)
+    sequence = models.PositiveIntegerField()
+    event_type = models.TextField()
+    cards = ListField()
+    deck = ListField()
+    amount = models.FloatField(null=True, blank=True)
+    deck_seed = models.BigIntegerField(null=True, blank=True)
+    event_time = models.DateTimeField()
+
+    class MongoMeta:
+        # Events are replayed and listed per game in sequence order
+        indexes = [
+            {'fields': ['action', 'sequence']},
+        ]
+
+
+# Outcome flags of a game, packed into one integer in the archive
+OUTCOME_FLAGS = ('player_blackjack', 'dealer_blackjack', 'player_bust', 'dealer_bust', 'game_push', 'player_win',
+                 'dealer_win', 'end_game_action')
+
+
+class GameArchive(models.Model):
+    """
+    Finished game moved out of the hot collection, cards as codes, flags as bits and events as plain lists
+
+    Archived games expire after settings.BLACKJACK_ARCHIVE_TTL_DAYS, the TTL index is created with the others.
+    """
+
+    # GameArchive instance variables
+    action_id = models.TextField(primary_key=True)
+    player = models.TextField()
+    shoe = models.TextField(null=True, blank=True)
+    bet = models.PositiveIntegerField(default=0)
+    action_time = models.DateTimeField()
+    archived_at = models.DateTimeField()
+    action_type = models.TextField()
+    player_action = models.TextField()
+    player_hand = ListField()
+    dealer_hand = ListField()
+    player_points = models.PositiveSmallIntegerField(default=0)
+    dealer_points = models.SmallIntegerField(default=0)
+    flags = models.PositiveIntegerField(default=0)
+    version = models.PositiveIntegerField(default=0)
+    deck_seed = models.BigIntegerField(null=True, blank=True)
+    deck_cursor = models.PositiveSmallIntegerField(default=0)
+    events = ListField()
+
+    class MongoMeta:
+        indexes = [
+            {'fields': ['player', ('action_time', DESCENDING)]},
+            {'fields': ['archived_at'],
+             'expireAfterSeconds': getattr(settings, 'BLACKJACK_ARCHIVE_TTL_DAYS', 365) * 24 * 60 * 60},
+        ]
+
+    @classmethod
+    def from_game(cls, action, events=(), archived_at=None):
+        """
+        Archive record of a finished game
+        :param action: GameAction
+        :param events: iterable of its GameEvent
+        :param archived_at: datetime, now when omitted
+        :return: GameArchive
+        """
+
+        # Games read back from the database carry naive UTC times
+        action_time = action.action_time
+        if action_time is not None and timezone.is_naive(action_time):
+            action_time = timezone.make_aware(action_time, timezone.utc)
+
+        return cls(action_id=action.pk, player=action.player_id, shoe=action.shoe_id, bet=action.bet,
+                   action_time=action_time, archived_at=archived_at or timezone.now(),
+                   action_type=action.action_type, player_action=action.player_action,
+                   player_hand=[encode(card) for card in action.player_hand],
+                   dealer_hand=[encode(card) for card in action.dealer_hand],
+                   player_points=action.player_points, dealer_points=action.dealer_points,
+                   flags=sum(1 << bit for bit, name in enumerate(OUTCOME_FLAGS) if getattr(action, name)),
+                   version=action.version, deck_seed=action.deck_seed, deck_cursor=action.deck_cursor,
+                   events=[[event.sequence, event.event_type, list(event.cards), event.amount]
+                           for event in events])
+
+    def to_game(self):
+        """
+        The game as it was before archiving, unsaved and without its event log
+        :return: GameAction
+        """
+
+        action = GameAction(action_id=self.action_id, player_id=self.player, shoe_id=self.shoe, bet=self.bet,
+                            action_time=self.action_time, action_type=self.action_type,
+                            player_action=self.player_action, next_actions='new',
+                            player_hand=[CARDS[code] for code in self.player_hand],
+                            dealer_hand=[CARDS[code] for code in self.dealer_hand],
+                            player_points=self.player_points, dealer_points=self.dealer_points,
+                            version=self.version, deck_seed=self.deck_seed, deck_cursor=self.deck_cursor)
+        for bit, name in enumerate(OUTCOME_FLAGS):
+            setattr(action, name, bool(self.flags & (1 << bit)))
+        return action
+
+
+class HouseRollup(models.Model):
+    """
+    House totals of the games that ended in one hour or one day, so dashboards never aggregate the games
+
+    Each finished game increments its hour and its day bucket with one upsert per bucket, sent as one bulk write.
+    """
+
+    # Bucket lengths in minutes
+    PERIODS = {'hour': 60, 'day': 24 * 60}
+
+    # HouseRollup instance variables
+    rollup_id = models.TextField(primary_key=True)
+    period = models.TextField()
+    start = models.DateTimeField()
+    hands = models.PositiveIntegerField(default=0)
+    player_wins = models.PositiveIntegerField(default=0)
+    dealer_wins = models.PositiveIntegerField(default=0)
+    pushes = models.PositiveIntegerField(default=0)
+    player_blackjacks = models.PositiveIntegerField(default=0)
+    player_busts = models.PositiveIntegerField(default=0)
+    dealer_busts = models.PositiveIntegerField(default=0)
+    wagered = models.PositiveIntegerField(default=0)
+    house_net = models.FloatField(default=0)
+
+    class MongoMeta:
+        # Dashboards read a range of buckets of one period
+        indexes = [
+            {'fields': ['period', 'start']},
+        ]
+
+    @classmethod
+    def bucket_start(cls, period, when):
+        """
+        Start of the bucket a time falls in
+        :param period: str hour or day
+        :param when: datetime, aware
+        :return: datetime
+        """
+
+        start = timezone.localtime(when, timezone.utc).replace(minute=0, second=0, microsecond=0)
+        return start.replace(hour=0) if period == 'day' else start
+
+    @classmethod
+    def add_game(cls, action, amount, when=None):
+        """
+        Count a finished game in its hour and day buckets
+        :param action: GameAction that just ended
+        :param amount: signed amount paid to the player, 0 for a push
+        :param when: datetime the game ended, now when omitted
+        :return: None
+        """
+
+        cls.add({'hands': 1, 'player_wins': int(action.player_win), 'dealer_wins': int(action.dealer_win),
+                 'pushes': int(action.game_push), 'player_blackjacks': int(action.player_blackjack),
+                 'player_busts': int(action.player_bust), 'dealer_busts': int(action.dealer_bust),
+                 'wagered': action.bet, 'house_net': -amount}, when)
+
+    @classmethod
+    def add(cls, increments, when=None):
+        """
+        Add to the totals of the hour and day buckets of a time
+        :param increments: dict of counter field and increment
+        :param when: datetime, now when omitted
+        :return: None
+        """
+
+        when = when or timezone.now()
+        requests = []
+        for period in sorted(cls.PERIODS):
+            start = cls.bucket_start(period, when)
+            requests.append(UpdateOne({'_id': '%s:%s' % (period, start.strftime('%Y-%m-%dT%H:%M'))},
+                                      {'$inc': increments, '$setOnInsert': {'period': period, 'start': start}},
+                                      upsert=True))
+        connections[cls.objects.db].get_collection(cls._meta.db_table).bulk_write(requests, ordered=False)
+
+
+class Table(models.Model):
+    """
+    Up to seven seats playing against one dealer, every round of the table is dealt from its shoe
+    """
+
+    MAX_SEATS = 7
+
+    # Table instance variables
+    table_id = models.TextField(default=new_id, primary_key=True)
+    shoe = models.ForeignKey(Shoe, related_name='tables', on_delete=models.CASCADE)
+    seats = ListField()
+    bet = models.PositiveIntegerField(default=50, validators=[MinValueValidator(1)])
+    rounds_played = models.PositiveIntegerField(default=0)
+
+    def clean(self):
+        """
+        Seats hold one to seven distinct wallets
+        :return: None
+        :raise ValidationError:
+        """
+
+        if not 1 <= len(self.seats) <= self.MAX_SEATS or len(set(self.seats)) != len(self.seats):
+            raise ValidationError({'seats': ['1 to %d distinct wallets are required.' % self.MAX_SEATS]})
+
+
+class Round(models.Model):
+    """
+    One deal of a table: the seats play their hands in turn, then the dealer, then every seat is settled at once
+
+    Cards are stored as integer codes. Each seat is a dict with wallet_id, bet, hand, points and status (playing,
+    stood, bust or blackjack), settled rounds add outcome (win, lose or push), amount and settled. The bets are
+    taken from the wallets at the deal, so settling only ever credits them.
+
+    The dealer follows the table rule and stands on any 17. A single-player GameAction keeps its own house rule:
+    there the dealer draws past a 17 that doesn't beat the player's hand. With several seats there is no one
+    hand to beat, so the two games don't share dealer logic.
+    """
+
+    # Round instance variables
+    round_id = models.TextField(default=new_id, primary_key=True)
+    table = models.ForeignKey(Table, related_name='table_rounds', on_delete=models.CASCADE)
+    number = models.PositiveIntegerField(default=0)
+    round_time = models.DateTimeField(auto_now_add=True, auto_now=True)
+    dealer_hand = ListField()
+    dealer_points = models.PositiveSmallIntegerField(default=0)
+    seats = ListField()
+    turn = models.PositiveSmallIntegerField(default=0)
+    next_actions = models.TextField(default='')
+    end_round = models.BooleanField(default=False)
+    version = models.PositiveIntegerField(default=0)
+
+    # Lease of the request playing the round, two requests never draw and settle the same turn
+    claimed_until = models.DateTimeField(null=True, blank=True)
+
+    class MongoMeta:
+        # A table's rounds are read newest first
+        indexes = [
+            {'fields': ['table', ('number', DESCENDING)]},
+        ]
+
+    def save(self, *args, **kwargs):
+        """
+        Save the round, and the shoe it drew from if that was never saved
+        :return: None
+        """
+
+        super(Round, self).save(*args, **kwargs)
+        if getattr(self, '_shoe_drawn', False):
+            if self.table.shoe._state.adding:
+                self.table.shoe.save()
+            self._shoe_drawn = False
+
+    def draw(self):
+        """
+        Draw the next card from the table's shoe
+        :return: int card code
+        """
+
+        self._shoe_drawn = True
+        return self.table.shoe.draw()
+
+    def deal(self, bets=None):
+        """
+        Deal every seat and the dealer, finishing the round at once when nobody has a decision to make
+        :param bets: dict of wallet id and bet, the table bet for the seats left out
+        :return: None
+        :raise ValidationError: a wallet can't cover its bet
+        """
+
+        bets = bets or {}
+        self.seats = [{'wallet_id': wallet_id, 'bet': bets.get(wallet_id, self.table.bet), 'hand': [],
+                       'points': 0, 'status': 'playing'} for wallet_id in self.table.seats]
+        self.reserve()
+        self.table.shoe.start_hand()
+        self.dealer_hand = []
+
+        # Two passes round the table, each ending with the dealer, as a live deal goes. The whole deal is claimed
+        # from the shoe at once
+        self._shoe_drawn = True
+        claimed = self.table.shoe.claim(2 * (len(self.seats) + 1))
+        for i in range(2):
+            for seat in self.seats:
+                seat['hand'].append(claimed.pop(0))
+            self.dealer_hand.append(claimed.pop(0))
+
+        for seat in self.seats:
+            hand = Hand(seat['hand'])
+            seat['points'] = hand.points
+            if hand.blackjack:
+                seat['status'] = 'blackjack'
+        self.dealer_points = Hand(self.dealer_hand).points
+
+        # The dealer checks for blackjack before anyone plays
+        if Hand(self.dealer_hand).blackjack:
+            self.settle()
+        else:
+            self.next_turn(0)
+
+    def next_turn(self, start):
+        """
+        Pass the turn to the first seat from start with a decision to make, after the last one the dealer plays
+        and the round settles
+        :param start: int seat index
+        :return: None
+        """
+
+        self.turn = start
+        while self.turn < len(self.seats) and self.seats[self.turn]['status'] != 'playing':
+            self.turn += 1
+        if self.turn < len(self.seats):
+            self.next_actions = 'hit/stand'
+            return
+
+        # The dealer draws to 17 unless every seat is already decided, unlike GameAction.stand it never chases a hand
+        if any(seat['status'] == 'stood' for seat in self.seats):
+            hand = Hand(self.dealer_hand)
+            while self.dealer_points < 17:
+                card = self.draw()
+                self.dealer_hand.append(card)
+                self.dealer_points = hand.add(card)
+        self.settle()
+
+    def apply(self, seat, player_action):
+        """
+        Run a seat's action if it is that seat's turn
+        :param seat: int seat index
+        :param player_action: str hit or stand
+        :return: bool False when the action is not allowed in the current state
+        """
+
+        if self.end_round or seat != self.turn or player_action not in ('hit', 'stand'):
+            return False
+
+        state = self.seats[seat]
+        if player_action == 'hit':
+            state['hand'].append(self.draw())
+            state['points'] = Hand(state['hand']).points
+            if state['points'] > 21:
+                state['status'] = 'bust'
+            elif state['points'] == 21:
+                state['status'] = 'stood'
+        else:
+            state['status'] = 'stood'
+        if state['status'] != 'playing':
+            self.next_turn(seat + 1)
+
+        # Every accepted action is a new revision, clients revalidate their copies against it
+        self.version += 1
+        return True
+
+    def _players(self):
+        """
+
+        :return: Collection
+        """
+
+        return connections[Player.objects.db].get_collection(Player._meta.db_table)
+
+    def reserve(self):
+        """
+        Take every seat's bet from its wallet with one bulk write, the round id marks the bet as held
+        :return: None
+        :raise ValidationError: a wallet can't cover its bet, the bets already taken are given back
+        """
+
+        players = self._players()
+        requests = [UpdateOne({'_id': seat['wallet_id'], 'wallet_balance': {'$gte': seat['bet']},
+                               'held_rounds': {'$ne': self.round_id}},
+                              {'$inc': {'wallet_balance': -seat['bet'], 'version': 1},
+                               '$push': {'held_rounds': self.round_id}}) for seat in self.seats]
+        if players.bulk_write(requests, ordered=False).matched_count == len(requests):
+            return
+
+        held = set(document['_id'] for document in players.find(
+            {'_id': {'$in': [seat['wallet_id'] for seat in self.seats]}, 'held_rounds': self.round_id}, {'_id': 1}))
+        refunds = [UpdateOne({'_id': seat['wallet_id'], 'held_rounds': self.round_id},
+                             {'$inc': {'wallet_balance': seat['bet'], 'version': 1},
+                              '$pull': {'held_rounds': self.round_id}})
+                   for seat in self.seats if seat['wallet_id'] in held]
+        if refunds:
+            players.bulk_write(refunds, ordered=False)
+        short = [seat['wallet_id'] for seat in self.seats if seat['wallet_id'] not in held]
+        raise ValidationError({'wallet_balance': ['Insufficient funds: %s.' % ', '.join(short)]})
+
+    @staticmethod
+    def seat_stats(seat):
+        """
+        Player counter increments for a decided seat
+        :param seat: dict with outcome and amount
+        :return: dict of Player field and increment
+        """
+
+        return {'hands_played': 1, 'hands_won': int(seat['outcome'] == 'win'),
+                'hands_lost': int(seat['outcome'] == 'lose'), 'hands_pushed': int(seat['outcome'] == 'push'),
+                'blackjacks': int(seat['status'] == 'blackjack'), 'busts': int(seat['status'] == 'bust'),
+                'total_wagered': seat['bet'], 'net_winnings': seat['amount']}
+
+    def settle(self):
+        """
+        Decide every seat and settle all wallets with one bulk write, each seat's held bet is paid out once
+        :return: None
+        """
+
+        dealer_blackjack = Hand(self.dealer_hand).blackjack
+        dealer_bust = self.dealer_points > 21
+        for seat in self.seats:
+            if seat['status'] == 'blackjack':
+                outcome, amount = ('push', 0) if dealer_blackjack else ('win', seat['bet'] * 1.5)
+            elif seat['status'] == 'bust' or dealer_blackjack:
+                outcome, amount = 'lose', -seat['bet']
+            elif dealer_bust or seat['points'] > self.dealer_points:
+                outcome, amount = 'win', seat['bet']
+            elif seat['points'] < self.dealer_points:
+                outcome, amount = 'lose', -seat['bet']
+            else:
+                outcome, amount = 'push', 0
+            seat.update(outcome=outcome, amount=amount)
+
+        # Only a wallet still holding the round's bet is paid, and the id this call records tells its seats apart
+        # from those a concurrent settlement paid
+        players = self._players()
+        settlement = '%s:%s' % (self.round_id, uuid4().hex)
+        unapplied, mark = once_per_batch(settlement)
+        requests = []
+        for seat in self.seats:
+            stats = self.seat_stats(seat)
+            stats.update(wallet_balance=seat['bet'] + seat['amount'], version=1)
+            update = dict(mark, **{'$inc': stats, '$pull': {'held_rounds': self.round_id}})
+            requests.append(UpdateOne(dict(unapplied, _id=seat['wallet_id'], held_rounds=self.round_id), update))
+        matched = players.bulk_write(requests, ordered=False).matched_count
+        if matched == len(requests):
+            applied = self.seats
+        elif matched:
+            paid = set(document['_id'] for document in players.find(
+                {'_id': {'$in': [seat['wallet_id'] for seat in self.seats]}, 'applied_batches': settlement},
+                {'_id': 1}))
+            applied = [seat for seat in self.seats if seat['wallet_id'] in paid]
+        else:
+            applied = []
+
+        # Every held bet is paid out by one settlement or another, the seats paid here are counted here only
+        for seat in self.seats:
+            seat['settled'] = True
+        if applied:
+            HouseRollup.add({'hands': len(applied),
+                             'player_wins': sum(seat['outcome'] == 'win' for seat in applied),
+                             'dealer_wins': sum(seat['outcome'] == 'lose' for seat in applied),
+                             'pushes': sum(seat['outcome'] == 'push' for seat in applied),
+                             'player_blackjacks': sum(seat['status'] == 'blackjack' for seat in applied),
+                             'player_busts': sum(seat['status'] == 'bust' for seat in applied),
+                             'dealer_busts': len(applied) if dealer_bust else 0,
+                             'wagered': sum(seat['bet'] for seat in applied),
+                             'house_net': -sum(seat['amount'] for seat in applied)})
+        self.turn = len(self.seats)
+        self.end_round = True
+        self.next_actions = 'new'
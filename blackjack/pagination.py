@@ -0,0 +1,202 @@
+"""
+Keyset pagination, every page is an indexed range query that costs the same however deep it is
+"""
+
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Pages after or before the key of the last row seen, never by offset
+
+    The ordering must end with a unique field so every row has a distinct key. Cursors are opaque tokens holding
+    that key and the direction, rows inserted while a client scrolls never shift the pages it hasn't read yet.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = api_settings.PAGINATE_BY or api_settings.PAGE_SIZE
+    max_page_size = 100
+    ordering = ()
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        One page of the queryset
+        :param queryset: QuerySet
+        :param request: rest_framework Request
+        :param view: APIView
+        :return: list of model instances
+        """
+
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.model = queryset.model
+        position, reverse = self.decode_cursor(request)
+
+        ordering = [_flip(field) for field in self.ordering] if reverse else list(self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._after(ordering, position))
+
+        # One extra row tells whether there is another page in the direction we are going
+        rows = list(queryset[:self.page_size + 1])
+        more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.has_next = more if not reverse else position is not None
+        self.has_previous = more if reverse else position is not None
+        self.first = self._position(rows[0]) if rows else None
+        self.last = self._position(rows[-1]) if rows else None
+        return rows
+
+    def get_page_size(self, request):
+        """
+        Page size asked for by the client, capped at max_page_size
+        :param request: rest_framework Request
+        :return: int
+        """
+
+        try:
+            return _positive_int(request.query_params[self.page_size_query_param], strict=True,
+                                 cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_next_link(self):
+        """
+        :return: str url of the following page or None
+        """
+
+        if not self.has_next or self.last is None:
+            return None
+        return self.encode_cursor(self.last, False)
+
+    def get_previous_link(self):
+        """
+        :return: str url of the preceding page or None
+        """
+
+        if not self.has_previous:
+            return None
+        if self.first is None:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.first, True)
+
+    def get_paginated_response(self, data):
+        """
+
+        :param data: list of serialized rows
+        :return: Response
+        """
+
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def encode_cursor(self, position, reverse):
+        """
+        Url of the page next to a key
+        :param position: list of key values
+        :param reverse: bool page precedes the key
+        :return: str
+        """
+
+        token = urlsafe_b64encode(json.dumps({'p': position, 'r': int(reverse)}, separators=(',', ':')))
+        return replace_query_param(self.base_url, self.cursor_query_param, token.rstrip('='))
+
+    def decode_cursor(self, request):
+        """
+        Key and direction held by the request's cursor
+        :param request: rest_framework Request
+        :return: tuple of list of key values or None and bool reverse
+        :raise NotFound: the cursor was tampered with or belongs to another ordering
+        """
+
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            token = json.loads(urlsafe_b64decode(str(encoded) + '=' * (-len(encoded) % 4)))
+            position = token['p']
+            if len(position) != len(self.ordering):
+                raise ValueError(position)
+            fields = [self.model._meta.get_field(field.lstrip('-')) for field in self.ordering]
+            return [field.to_python(value) for field, value in zip(fields, position)], bool(token.get('r'))
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def _position(self, instance):
+        """
+        Key of a row, in a JSON friendly form
+        :param instance: model instance
+        :return: list
+        """
+
+        position = []
+        for field in self.ordering:
+            value = getattr(instance, field.lstrip('-'))
+            if hasattr(value, 'isoformat'):
+                # MongoDB hands datetimes back naive, they are stored in UTC
+                if settings.USE_TZ and timezone.is_naive(value):
+                    value = timezone.make_aware(value, timezone.utc)
+                value = value.isoformat()
+            position.append(value)
+        return position
+
+    def _after(self, ordering, position):
+        """
+        Rows past a key in the given ordering, as an OR over the key's prefixes
+        :param ordering: list of field names, '-' for descending
+        :param position: list of key values
+        :return: Q
+        """
+
+        condition = None
+        for i, field in enumerate(ordering):
+            name = field.lstrip('-')
+            term = Q(**{'%s__%s' % (name, 'lt' if field.startswith('-') else 'gt'): position[i]})
+            for prefix, value in zip(ordering[:i], position[:i]):
+                term &= Q(**{prefix.lstrip('-'): value})
+            condition = term if condition is None else condition | term
+        return condition
+
+
+def _flip(field):
+    """
+    Opposite direction of an ordering field
+    :param field: str field name, '-' for descending
+    :return: str
+    """
+
+    return field[1:] if field.startswith('-') else '-' + field
+
+
+class GameActionPagination(KeysetPagination):
+    """
+    Newest games first, the action id breaks ties between games written in the same millisecond
+    """
+
+    ordering = ('-action_time', '-action_id')
+
+
+class PlayerPagination(KeysetPagination):
+    """
+    Players in wallet id order
+    """
+
+    ordering = ('wallet_id',)
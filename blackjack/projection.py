@@ -0,0 +1,22 @@
+"""
+Projections the database actually receives
+
+The engine's find only sends the fields of a values() query, a queryset narrowed by only() or defer() still reads
+whole documents and drops the unused fields afterwards. projected() hands the loaded fields to the find as well.
+"""
+
+
+def projected(queryset):
+    """
+    Queryset whose find reads only the fields only() or defer() leave loaded, apply it after those
+    :param queryset: QuerySet
+    :return: QuerySet, the same one when nothing is deferred
+    """
+
+    loaded = queryset.query.get_loaded_field_names().get(queryset.model)
+    if not loaded:
+        return queryset
+    queryset = queryset._clone()
+    queryset.query.select_fields = [field for field in queryset.model._meta.fields
+                                    if field.primary_key or field.name in loaded]
+    return queryset
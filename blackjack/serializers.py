@@ -1,8 +1,29 @@
-from blackjack.models import Player, GameAction
+from blackjack.cards import decode
+from blackjack.hands import Hand
+from blackjack.models import Player, GameAction, GameEvent, HouseRollup, Round, Shoe, Table
 from rest_framework import serializers
 
 
-class PlayerSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin(object):
+    """
+    Serializer that emits only the fields passed in its fields keyword, all of them when it is None
+    """
+
+    def __init__(self, *args, **kwargs):
+        """
+
+        :param fields: iterable of field names to keep
+        :return:
+        """
+
+        fields = kwargs.pop('fields', None)
+        super(SparseFieldsMixin, self).__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class PlayerSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Auto-serialize Player model fields
     """
@@ -12,7 +33,18 @@ class PlayerSerializer(serializers.ModelSerializer):
         fields = ('wallet_id', 'wallet_balance')
 
 
-class GameActionSerializer(serializers.ModelSerializer):
+class PlayerStatsSerializer(serializers.ModelSerializer):
+    """
+    Serialize the counters a player's finished games have added up
+    """
+
+    class Meta:
+        model = Player
+        fields = ('wallet_id', 'hands_played', 'hands_won', 'hands_lost', 'hands_pushed', 'blackjacks', 'busts',
+                  'total_wagered', 'net_winnings')
+
+
+class GameActionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Serialize GameAction model fields
     """
@@ -30,4 +62,94 @@ class GameActionSerializer(serializers.ModelSerializer):
         fields = ('action_type', 'action_time', 'action_id', 'player_hand', 'dealer_hand', 'dealer_points',
                   'player_points', 'end_game_action', 'player_blackjack', 'dealer_blackjack', 'player_bust',
                   'dealer_bust', 'player_win', 'dealer_win', 'game_push', 'next_actions', 'bet', 'player_action',
-                  'player')
\ No newline at end of file
+                  'player', 'shoe')
+
+
+class ShoeSerializer(serializers.ModelSerializer):
+    """
+    Serialize Shoe settings and position, never the card order
+    """
+
+    cursor = serializers.IntegerField(read_only=True)
+    cut_card = serializers.IntegerField(read_only=True)
+    shuffles = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Shoe
+        fields = ('shoe_id', 'decks', 'penetration', 'cursor', 'cut_card', 'shuffles')
+
+class GameEventSerializer(serializers.ModelSerializer):
+    """
+    Serialize a game event, the starting deck stays private
+    """
+
+    cards = serializers.ListField(read_only=True)
+
+    class Meta:
+        model = GameEvent
+        fields = ('event_id', 'action', 'sequence', 'event_type', 'cards', 'amount', 'event_time')
+
+
+class HouseRollupSerializer(serializers.ModelSerializer):
+    """
+    Serialize the house totals of one time bucket
+    """
+
+    class Meta:
+        model = HouseRollup
+        fields = ('period', 'start', 'hands', 'player_wins', 'dealer_wins', 'pushes', 'player_blackjacks',
+                  'player_busts', 'dealer_busts', 'wagered', 'house_net')
+
+
+class TableSerializer(serializers.ModelSerializer):
+    """
+    Serialize a table and the wallets in its seats
+    """
+
+    seats = serializers.ListField(read_only=True)
+
+    class Meta:
+        model = Table
+        fields = ('table_id', 'shoe', 'seats', 'bet', 'rounds_played')
+
+
+class RoundSerializer(serializers.ModelSerializer):
+    """
+    Serialize a table round, cards as rank/suit pairs and the dealer's hole card hidden until the round ends
+    """
+
+    dealer_hand = serializers.SerializerMethodField()
+    dealer_points = serializers.SerializerMethodField()
+    seats = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Round
+        fields = ('round_id', 'table', 'number', 'round_time', 'dealer_hand', 'dealer_points', 'seats', 'turn',
+                  'next_actions', 'end_round', 'version')
+
+    def get_dealer_hand(self, obj):
+        """
+
+        :param obj: Round
+        :return: list of namedtuple
+        """
+
+        return [decode(code) for code in (obj.dealer_hand if obj.end_round else obj.dealer_hand[:1])]
+
+    def get_dealer_points(self, obj):
+        """
+
+        :param obj: Round
+        :return: int
+        """
+
+        return obj.dealer_points if obj.end_round else Hand(obj.dealer_hand[:1]).points
+
+    def get_seats(self, obj):
+        """
+
+        :param obj: Round
+        :return: list of dict
+        """
+
+        return [dict(seat, hand=[decode(code) for code in seat['hand']]) for seat in obj.seats]
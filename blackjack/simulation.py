@@ -0,0 +1,282 @@
+"""
+Vectorized Monte Carlo simulation of the house rules coded in GameAction.deal, hit and stand
+"""
+
+import math
+import numpy as np
+from hands import CODE_VALUES
+
+# Hand outcomes, in the order the rules in GameAction check them
+OUTCOMES = (
+    'double_blackjack',     # deal: both have 21, push
+    'player_blackjack',     # deal: player 21, dealer under 21, pays 1.5
+    'player_21',            # hit: player reaches 21, dealer under 21
+    'dealer_21_on_hit',     # hit: player reaches 21, dealer already has 21
+    'player_bust',          # hit: player over 21
+    'dealer_21_on_stand',   # stand: dealer has 21 with two cards
+    'stand_win',            # stand: dealer over 17, player higher
+    'stand_loss',           # stand: dealer higher without drawing
+    'dealer_bust',          # stand: dealer draws over 21
+    'dealer_draws_21',      # stand: dealer draws to 21
+    'dealer_draws_over',    # stand: dealer draws past the player
+    'stand_push',           # stand: dealer over 17 ties the player, push
+)
+(DOUBLE_BLACKJACK, PLAYER_BLACKJACK, PLAYER_21, DEALER_21_ON_HIT, PLAYER_BUST, DEALER_21_ON_STAND, STAND_WIN,
+ STAND_LOSS, DEALER_BUST, DEALER_DRAWS_21, DEALER_DRAWS_OVER, STAND_PUSH) = range(len(OUTCOMES))
+
+# Payout of each outcome in half bets, so totals stay exact integers
+PAYOUT_HALVES = (0, 3, 2, -2, -2, -2, 2, -2, 2, -2, -2, 0)
+
+WINS = (PLAYER_BLACKJACK, PLAYER_21, STAND_WIN, DEALER_BUST)
+PUSHES = (DOUBLE_BLACKJACK, STAND_PUSH)
+
+# Hands evaluated per batch, large enough to amortize numpy overhead and small enough to stay in cache
+CHUNK = 1 << 16
+
+# Hard totals stay below 21 while either side keeps drawing, so a hand never uses more than 2 * (20 + 10) points
+HARD_LIMIT = 60
+
+
+def max_draws(decks=1):
+    """
+    Upper bound on the cards a single hand can use
+    :param decks: int number of decks
+    :return: int
+    """
+
+    total = 0
+    for count, value in enumerate(sorted(CODE_VALUES * decks)):
+        total += value
+        if total > HARD_LIMIT:
+            return count
+    return len(CODE_VALUES) * decks
+
+
+def draw_values(rng, hands, decks=1):
+    """
+    Card values for a batch of independently shuffled decks, one row per hand in draw order
+    :param rng: numpy RandomState
+    :param hands: int number of rows
+    :param decks: int decks per shuffle
+    :return: numpy int8 array of shape (hands, max_draws(decks)), aces as 1
+    """
+
+    # Partial Fisher-Yates on every row at once, only the cards a hand can reach are shuffled into place
+    base = np.array(CODE_VALUES * decks, dtype=np.int8)
+    size = len(base)
+    depth = max_draws(decks)
+    values = np.tile(base, (hands, 1))
+    rows = np.arange(hands)
+    for k in range(depth):
+        j = k + (rng.random_sample(hands) * (size - k)).astype(np.intp)
+        picked = values[rows, j]
+        values[rows, j] = values[:, k]
+        values[:, k] = picked
+    return values[:, :depth]
+
+
+def _points(hard, aces):
+    """
+    Best totals for arrays of hard totals and ace counts
+    :param hard: numpy int array
+    :param aces: numpy int array
+    :return: numpy int array
+    """
+
+    return hard + 10 * ((aces > 0) & (hard <= 11))
+
+
+def play(values, stand_on=17):
+    """
+    Play a batch of hands, the player hits below stand_on and otherwise stands
+    :param values: numpy int array from draw_values
+    :param stand_on: int player total to stand on
+    :return: numpy int array of outcome codes, one per hand
+    """
+
+    values = values.astype(np.int16)
+    hands = len(values)
+    outcome = np.full(hands, -1, dtype=np.int8)
+
+    # Deal, two cards each
+    p_hard = values[:, 0] + values[:, 1]
+    p_aces = (values[:, 0] == 1).astype(np.int16) + (values[:, 1] == 1)
+    d_hard = values[:, 2] + values[:, 3]
+    d_aces = (values[:, 2] == 1).astype(np.int16) + (values[:, 3] == 1)
+    p = _points(p_hard, p_aces)
+    d = _points(d_hard, d_aces)
+    cursor = np.full(hands, 4, dtype=np.intp)
+
+    outcome[(p == 21) & (d == 21)] = DOUBLE_BLACKJACK
+    outcome[(p == 21) & (d < 21)] = PLAYER_BLACKJACK
+
+    # Hit while under the player's threshold
+    live = np.flatnonzero((outcome < 0) & (p < stand_on))
+    while len(live):
+        card = values[live, cursor[live]]
+        cursor[live] += 1
+        p_hard[live] += card
+        p_aces[live] += card == 1
+        p[live] = pl = _points(p_hard[live], p_aces[live])
+        dl = d[live]
+        result = np.select([(pl == 21) & (dl == 21), pl > 21, (pl == 21) & (dl < 21)],
+                           [DEALER_21_ON_HIT, PLAYER_BUST, PLAYER_21], -1)
+        outcome[live] = result
+        live = live[(result < 0) & (pl < stand_on)]
+
+    # Stand, the dealer draws only when at or under 17 and not ahead of the player
+    live = np.flatnonzero(outcome < 0)
+    pl, dl = p[live], d[live]
+    drawing = (dl <= 17) & (dl <= pl)
+    outcome[live] = np.select([dl == 21, (dl > 17) & (pl > dl), dl > pl, drawing],
+                              [DEALER_21_ON_STAND, STAND_WIN, STAND_LOSS, -1], STAND_PUSH)
+    live = live[drawing]
+    while len(live):
+        card = values[live, cursor[live]]
+        cursor[live] += 1
+        d_hard[live] += card
+        d_aces[live] += card == 1
+        dl = _points(d_hard[live], d_aces[live])
+        d[live] = dl
+        result = np.select([dl > 21, dl == 21, dl > p[live]], [DEALER_BUST, DEALER_DRAWS_21, DEALER_DRAWS_OVER], -1)
+        outcome[live] = result
+        live = live[result < 0]
+
+    return outcome
+
+
+class SimulationResult(object):
+    """
+    Outcome counts of a simulation run, mergeable across batches and workers
+    """
+
+    def __init__(self, counts=None):
+        """
+
+        :param counts: list of int, one per entry in OUTCOMES
+        :return:
+        """
+
+        self.counts = list(counts) if counts is not None else [0] * len(OUTCOMES)
+
+    def add(self, outcome):
+        """
+        Count a batch of outcome codes
+        :param outcome: numpy int array from play
+        :return: None
+        """
+
+        batch = np.bincount(outcome, minlength=len(OUTCOMES))
+        self.counts = [total + int(count) for total, count in zip(self.counts, batch)]
+
+    def merge(self, other):
+        """
+        Add another result's counts to this one
+        :param other: SimulationResult
+        :return: SimulationResult self
+        """
+
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        return self
+
+    @property
+    def hands(self):
+        """
+        Hands played
+        :return: int
+        """
+
+        return sum(self.counts)
+
+    def rate(self, outcomes):
+        """
+        Share of hands ending in any of the given outcomes
+        :param outcomes: iterable of outcome codes
+        :return: float
+        """
+
+        return float(sum(self.counts[o] for o in outcomes)) / self.hands if self.hands else 0.0
+
+    @property
+    def ev(self):
+        """
+        Expected value per unit bet
+        :return: float
+        """
+
+        if not self.hands:
+            return 0.0
+        return sum(c * h for c, h in zip(self.counts, PAYOUT_HALVES)) / (2.0 * self.hands)
+
+    @property
+    def ev_stderr(self):
+        """
+        Standard error of the EV estimate
+        :return: float
+        """
+
+        if self.hands < 2:
+            return 0.0
+        second = sum(c * h * h for c, h in zip(self.counts, PAYOUT_HALVES)) / (4.0 * self.hands)
+        return math.sqrt(max(second - self.ev ** 2, 0.0) / (self.hands - 1))
+
+    def confidence_interval(self, z=1.96):
+        """
+        Normal approximation interval for the EV
+        :param z: float critical value, 1.96 for 95%
+        :return: tuple of float
+        """
+
+        return self.ev - z * self.ev_stderr, self.ev + z * self.ev_stderr
+
+    def as_dict(self):
+        """
+        Summary for reports and checkpoints
+        :return: dict
+        """
+
+        low, high = self.confidence_interval()
+        return {
+            'hands': self.hands,
+            'counts': dict(zip(OUTCOMES, self.counts)),
+            'win_rate': self.rate(WINS),
+            'push_rate': self.rate(PUSHES),
+            'loss_rate': 1.0 - self.rate(WINS) - self.rate(PUSHES) if self.hands else 0.0,
+            'player_bust_rate': self.rate([PLAYER_BUST]),
+            'dealer_bust_rate': self.rate([DEALER_BUST]),
+            'blackjack_rate': self.rate([PLAYER_BLACKJACK, DOUBLE_BLACKJACK]),
+            'ev': self.ev,
+            'ev_95_ci': [low, high],
+        }
+
+
+def simulate(hands, stand_on=17, decks=1, seed=None, chunk=CHUNK):
+    """
+    Play a number of hands, each from a freshly shuffled deck
+    :param hands: int number of hands
+    :param stand_on: int player total to stand on
+    :param decks: int decks per shuffle
+    :param seed: int or list of int for numpy RandomState
+    :param chunk: int hands per batch
+    :return: SimulationResult
+    """
+
+    rng = np.random.RandomState(seed)
+    result = SimulationResult()
+    for start in range(0, hands, chunk):
+        result.add(play(draw_values(rng, min(chunk, hands - start), decks), stand_on))
+    return result
+
+
+def simulate_shard(index, hands, master_seed, stand_on=17, decks=1):
+    """
+    Play one shard of a larger run, seeded from the master seed and the shard index only
+    :param index: int shard index
+    :param hands: int hands in this shard
+    :param master_seed: int seed of the whole run
+    :param stand_on: int player total to stand on
+    :param decks: int decks per shuffle
+    :return: tuple of shard index and outcome counts
+    """
+
+    return index, simulate(hands, stand_on, decks, seed=[master_seed, index]).counts
@@ -0,0 +1,332 @@
+"""
+Hit/stand strategy and expected values under the house rules in GameAction.hit and stand
+"""
+
+import json
+import logging
+import os
+import threading
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Bump when the rules in GameAction change so cached tables are rebuilt
+RULES_VERSION = 1
+
+# Card values 1 (ace) to 10, a composition is a tuple of counts indexed by value - 1
+VALUES = range(1, 11)
+
+
+def full_composition(decks=1):
+    """
+    Card counts of a full shoe
+    :param decks: int number of decks
+    :return: tuple of int
+    """
+
+    return tuple([4 * decks] * 9 + [16 * decks])
+
+
+def _remove(comp, value):
+    """
+    Composition with one card of a value taken out
+    :param comp: tuple of int
+    :param value: int card value 1-10
+    :return: tuple of int
+    """
+
+    return comp[:value - 1] + (comp[value - 1] - 1,) + comp[value:]
+
+
+def _points(hard, soft):
+    """
+    Best total of a hand
+    :param hard: int total with aces as 1
+    :param soft: bool hand holds an ace
+    :return: int
+    """
+
+    return hard + 10 if soft and hard <= 11 else hard
+
+
+class StrategyEngine(object):
+    """
+    Exact hit/stand values by memoized recursion over the remaining deck composition
+    """
+
+    def __init__(self, decks=1):
+        """
+
+        :param decks: int number of decks in the shoe
+        :return:
+        """
+
+        self.decks = decks
+        self._dealer = {}
+        self._value = {}
+
+    def dealer_draws(self, player, hard, soft, comp):
+        """
+        Player EV once the dealer has started drawing, stand() keeps drawing until bust, 21 or ahead of the player
+        :param player: int player total
+        :param hard: int dealer hard total
+        :param soft: bool dealer holds an ace
+        :param comp: tuple of int remaining cards
+        :return: float
+        """
+
+        key = (player, hard, soft, comp)
+        if key in self._dealer:
+            return self._dealer[key]
+
+        total = float(sum(comp))
+        ev = 0.0
+        for value in VALUES:
+            count = comp[value - 1]
+            if not count:
+                continue
+            new_hard = hard + value
+            new_soft = (soft or value == 1) and new_hard <= 11
+            points = _points(new_hard, new_soft)
+            if points > 21:
+                outcome = 1.0
+            elif points == 21 or points > player:
+                outcome = -1.0
+            else:
+                outcome = self.dealer_draws(player, new_hard, new_soft, _remove(comp, value))
+            ev += count / total * outcome
+        self._dealer[key] = ev
+        return ev
+
+    def dealer_revealed(self, player, upcard, hole, comp):
+        """
+        Player EV on stand with the dealer's two cards known
+        :param player: int player total
+        :param upcard: int dealer upcard value
+        :param hole: int dealer hole card value
+        :param comp: tuple of int remaining cards
+        :return: float
+        """
+
+        hard, soft = upcard + hole, upcard == 1 or hole == 1
+        dealer = _points(hard, soft)
+        if dealer == 21:
+            return -1.0
+        if dealer > 17 and player > dealer:
+            return 1.0
+        if dealer > player:
+            return -1.0
+        if dealer <= 17 and dealer <= player:
+            return self.dealer_draws(player, hard, soft, comp)
+
+        # Dealer over 17 tying the player, stand() settles it as a push
+        return 0.0
+
+    def _over_hole(self, upcard, comp, outcome):
+        """
+        Average an outcome over the unseen hole card
+        :param upcard: int dealer upcard value
+        :param comp: tuple of int remaining cards, hole card included
+        :param outcome: callable of hole value and composition without it
+        :return: float
+        """
+
+        total = float(sum(comp))
+        return sum(comp[hole - 1] / total * outcome(hole, _remove(comp, hole)) for hole in VALUES if comp[hole - 1])
+
+    def stand(self, hard, soft, upcard, comp):
+        """
+        EV of standing
+        :param hard: int player hard total
+        :param soft: bool player holds an ace
+        :param upcard: int dealer upcard value
+        :param comp: tuple of int remaining cards, hole card included
+        :return: float
+        """
+
+        player = _points(hard, soft)
+        return self._over_hole(upcard, comp, lambda hole, rest: self.dealer_revealed(player, upcard, hole, rest))
+
+    def hit(self, hard, soft, upcard, comp):
+        """
+        EV of hitting once and then playing on optimally
+        :param hard: int player hard total
+        :param soft: bool player holds an ace
+        :param upcard: int dealer upcard value
+        :param comp: tuple of int remaining cards, hole card included
+        :return: float
+        """
+
+        total = float(sum(comp))
+        ev = 0.0
+        for value in VALUES:
+            count = comp[value - 1]
+            if not count:
+                continue
+            new_hard = hard + value
+            new_soft = (soft or value == 1) and new_hard <= 11
+            rest = _remove(comp, value)
+            points = _points(new_hard, new_soft)
+            if points > 21:
+                outcome = -1.0
+            elif points == 21:
+                # hit() settles at once, the player wins unless the dealer's two cards already make 21
+                outcome = self._over_hole(
+                    upcard, rest,
+                    lambda hole, left: -1.0 if _points(upcard + hole, upcard == 1 or hole == 1) == 21 else 1.0)
+            else:
+                outcome = self.value(new_hard, new_soft, upcard, rest)[0]
+            ev += count / total * outcome
+        return ev
+
+    def value(self, hard, soft, upcard, comp):
+        """
+        Best EV and decision for a player hand
+        :param hard: int player hard total
+        :param soft: bool player holds an ace
+        :param upcard: int dealer upcard value
+        :param comp: tuple of int remaining cards, hole card included
+        :return: tuple of best EV, action, hit EV and stand EV
+        """
+
+        key = (hard, soft, upcard, comp)
+        if key not in self._value:
+            hit, stand = self.hit(hard, soft, upcard, comp), self.stand(hard, soft, upcard, comp)
+            self._value[key] = (max(hit, stand), 'hit' if hit > stand else 'stand', hit, stand)
+        return self._value[key]
+
+    def table(self):
+        """
+        Decisions for every player total, soft flag and dealer upcard, starting from the shoe minus the upcard
+        :return: dict keyed by table_key
+        """
+
+        table = {}
+        for upcard in VALUES:
+            comp = _remove(full_composition(self.decks), upcard)
+            for total in range(4, 21):
+                for soft in (False, True):
+                    if soft and total < 12:
+                        continue
+                    ev, action, hit, stand = self.value(total - 10 if soft else total, soft, upcard, comp)
+                    table[table_key(total, soft, upcard)] = {'action': action, 'ev': ev, 'hit_ev': hit,
+                                                             'stand_ev': stand}
+        return table
+
+
+def table_key(total, soft, upcard):
+    """
+    Lookup key of a table entry
+    :param total: int player points
+    :param soft: bool player points count an ace as 11
+    :param upcard: int dealer upcard value, aces as 1
+    :return: str
+    """
+
+    return '%d:%s:%d' % (total, 's' if soft else 'h', upcard)
+
+
+def rules_key(decks):
+    """
+    Identifies the rule set a cached table was computed for
+    :param decks: int number of decks
+    :return: str
+    """
+
+    return 'v%d-decks%d' % (RULES_VERSION, decks)
+
+
+# Lazily loaded tables keyed by rules_key, _lock guards them and the cache file, _build_lock serializes the
+# computations so _lock is never held for seconds
+_tables = {}
+_building = set()
+_lock = threading.Lock()
+_build_lock = threading.Lock()
+
+
+def _read_cache(path):
+    """
+
+    :param path: str cache file
+    :return: dict of rules_key and table
+    """
+
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def get_table(decks=None, compute=True):
+    """
+    Strategy table for the configured rules, read from the cache file or computed once and written to it
+    :param decks: int number of decks, settings.BLACKJACK_STRATEGY_DECKS by default
+    :param compute: bool compute a missing table in this thread, otherwise a background thread computes it
+    :return: dict keyed by table_key, None while a background computation runs
+    """
+
+    decks = decks or getattr(settings, 'BLACKJACK_STRATEGY_DECKS', 1)
+    key = rules_key(decks)
+    table = _tables.get(key)
+    if table is not None:
+        return table
+
+    with _lock:
+        if key not in _tables:
+            cached = _read_cache(settings.BLACKJACK_STRATEGY_CACHE)
+            if key in cached:
+                _tables[key] = cached[key]
+            elif not compute:
+                if key not in _building:
+                    _building.add(key)
+                    thread = threading.Thread(target=_build, args=(decks, key), name='strategy-%s' % key)
+                    thread.daemon = True
+                    thread.start()
+                return None
+        if key in _tables:
+            return _tables[key]
+
+    # Computing takes seconds, build_strategy runs it ahead of time
+    with _build_lock:
+        if key not in _tables:
+            table = StrategyEngine(decks).table()
+            with _lock:
+                path = settings.BLACKJACK_STRATEGY_CACHE
+                cached = _read_cache(path)
+                cached[key] = table
+                tmp = path + '.tmp'
+                with open(tmp, 'w') as f:
+                    json.dump(cached, f, sort_keys=True)
+                os.rename(tmp, path)
+                _tables[key] = table
+    return _tables[key]
+
+
+def _build(decks, key):
+    """
+    Background computation of a missing table, a failure is logged and the next request starts another
+    :param decks: int number of decks
+    :param key: str rules_key of the table
+    :return: None
+    """
+
+    try:
+        get_table(decks)
+    except Exception:
+        logger.exception('Building the strategy table %s failed', key)
+    finally:
+        with _lock:
+            _building.discard(key)
+
+
+def lookup(total, soft, upcard, decks=None):
+    """
+    Table entry for a hand
+    :param total: int player points
+    :param soft: bool player points count an ace as 11
+    :param upcard: int dealer upcard value, aces as 1
+    :param decks: int number of decks, settings.BLACKJACK_STRATEGY_DECKS by default
+    :return: dict or None when the hand is not in the table
+    """
+
+    return get_table(decks).get(table_key(total, soft, upcard))
@@ -7,10 +7,51 @@ Replace this with more appropriate tests for your application.
 
 from rest_framework.test import APIRequestFactory, APIClient
 from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, connections
+from django.core.exceptions import ValidationError
 from django.test import TestCase, Client
+from django.utils.unittest import skipIf
 from .import cards
-from .models import Player, GameAction
+from .hands import Hand, CODE_VALUES
+from . import strategy
+from .strategy import StrategyEngine, full_composition
+from .gamecache import GameBusy, GameCache, get_game_cache
+from . import fastserializers
+from .fastserializers import compile_serializer
+from . import loadtest
+from . import metrics
+from .serializers import PlayerSerializer, GameActionSerializer
+from .models import Player, GameAction, GameArchive, GameEvent, HouseRollup, Round, Shoe, Table
+from . import archive
+from datetime import timedelta
+from django.utils import timezone
 import json
+import os
+import pickle
+import random
+import shutil
+import tempfile
+import threading
+from StringIO import StringIO
+
+try:
+    import numpy
+    from . import simulation
+except ImportError:
+    numpy = None
+
+
+def stacked_deck(*drawn):
+    """
+    Full deck that deals the given cards first, in order
+    :param drawn: tuples of rank and suit
+    :return: CompactDeck
+    """
+
+    first = [cards.encode(card) for card in drawn]
+    return cards.CompactDeck(first + [code for code in range(len(cards.CARDS)) if code not in first])
 
 
 class ModelTest(TestCase):
@@ -22,6 +63,15 @@ class ModelTest(TestCase):
         self.assertEqual(player.wallet_balance, 5000)
         self.assertIsNotNone(player.wallet_id)
 
+    def test_default_ids_are_unique(self):
+        """
+        Objects created without an id each get their own, concurrent load-test players never share a wallet
+        """
+
+        self.assertNotEqual(Player().wallet_id, Player().wallet_id)
+        self.assertNotEqual(GameAction().action_id, GameAction().action_id)
+        self.assertNotEqual(Shoe().shoe_id, Shoe().shoe_id)
+
     def test_game_action_creation(self):
         """
         Tests whether gameactions are being created properly
@@ -47,17 +97,60 @@ class ModelTest(TestCase):
         self.assertIsNotNone(action.dealer_points)
         self.assertIsNotNone(action.next_actions)
 
+    def test_adjust_balance_guard(self):
+        """
+        Wallet adjustments never take the balance below zero
+        """
+
+        player = Player()
+        self.assertFalse(player.adjust_balance(-5001))
+        self.assertEqual(player.wallet_balance, 5000)
+        self.assertTrue(player.adjust_balance(-5000))
+        self.assertEqual(player.wallet_balance, 0)
+
+    def test_bet_is_reserved_on_deal(self):
+        """
+        A wallet that can't cover the bet is never dealt, a lost bet is already gone when the game settles
+        """
+
+        player = Player(wallet_balance=40)
+        action = GameAction(player=player, bet=50)
+        self.assertRaises(ValidationError, action.apply, 'deal')
+        self.assertEqual((action.player_hand, action.version, player.wallet_balance), ([], 0, 40))
+
+        player = Player(wallet_balance=50)
+        action = GameAction(player=player, bet=50)
+        action.deal(stacked_deck(('10', 'spades'), ('9', 'spades'), ('K', 'hearts'), ('Q', 'hearts')))
+        self.assertEqual(player.wallet_balance, 0)
+        action.stand()
+        self.assertTrue(action.dealer_win)
+        self.assertEqual(player.wallet_balance, 0)
+
+    def test_tie_over_17_on_stand_is_a_push(self):
+        """
+        A dealer over 17 tying the player ends the game and hands the reserved bet back
+        """
+
+        player = Player()
+        action = GameAction(player=player, bet=50)
+        action.deal(stacked_deck(('10', 'spades'), ('8', 'spades'), ('K', 'hearts'), ('8', 'hearts')))
+        self.assertEqual(player.wallet_balance, 4950)
+        action.stand()
+        self.assertEqual((action.player_points, action.dealer_points), (18, 18))
+        self.assertTrue(action.game_push)
+        self.assertTrue(action.end_game_action)
+        self.assertFalse(action.player_win or action.dealer_win)
+        self.assertEqual(action.next_actions, 'new')
+        self.assertEqual(player.wallet_balance, 5000)
+
     def test_blackjack_on_deal_action(self):
         """
         Test if we can get blackjack on deal
         """
 
-        while True:
-            player = Player()
-            action = GameAction(player=player, bet=50)
-            action.deal()
-            if action.player_points == 21 and action.dealer_points < 21:
-                break
+        player = Player()
+        action = GameAction(player=player, bet=50)
+        action.deal(stacked_deck(('A', 'spades'), ('K', 'spades'), ('9', 'hearts'), ('7', 'hearts')))
         self.assertTrue(action.player_blackjack)
         self.assertEqual(len(action.player_hand), 2)
         self.assertEqual(len(action.action_deck), 48)
@@ -71,12 +164,9 @@ class ModelTest(TestCase):
         Test push with two blackjacks on deal
         """
 
-        while True:
-            player = Player()
-            action = GameAction(player=player, bet=50)
-            action.deal()
-            if action.player_points == 21 and action.dealer_points == 21:
-                break
+        player = Player()
+        action = GameAction(player=player, bet=50)
+        action.deal(stacked_deck(('A', 'spades'), ('K', 'spades'), ('A', 'hearts'), ('Q', 'hearts')))
         self.assertTrue(action.player_blackjack)
         self.assertTrue(action.dealer_blackjack)
         self.assertTrue(action.game_push)
@@ -93,20 +183,107 @@ class ModelTest(TestCase):
         Test if blackjack doesn't happen on deal when dealer has 21
         """
 
-        while True:
-            player = Player()
-            action = GameAction(player=player, bet=50)
-            action.deal()
-            if action.player_points < 21 and action.dealer_points == 21:
-                break
+        player = Player()
+        action = GameAction(player=player, bet=50)
+        action.deal(stacked_deck(('9', 'spades'), ('7', 'spades'), ('A', 'hearts'), ('K', 'hearts')))
         self.assertFalse(action.dealer_blackjack)
         self.assertEqual(len(action.player_hand), 2)
         self.assertEqual(len(action.dealer_hand), 2)
-        self.assertEqual(action.player.wallet_balance, 5000)
+        self.assertEqual(action.player.wallet_balance, 4950)
         self.assertFalse(action.end_game_action)
         self.assertEqual(action.next_actions, 'hit/stand')
 
 
+class GameEventTest(TestCase):
+    """
+    Test the game event log
+    """
+
+    def test_replay_rebuilds_the_game(self):
+        """
+        Replaying a game's events over its first snapshot gives its final state, without paying out twice
+        """
+
+        player = Player(wallet_id="events-player")
+        player.save()
+        action = GameAction(player=player, bet=50, action_id="events-game")
+        action.save()
+        snapshot = GameAction.objects.get(action_id="events-game")
+
+        action.apply("deal")
+        while action.next_actions == "hit/stand" and action.player_points < 17:
+            action.apply("hit")
+        if action.next_actions == "hit/stand":
+            action.apply("stand")
+        action.save()
+        balance = Player.objects.get(wallet_id="events-player").wallet_balance
+
+        events = list(GameEvent.objects.filter(action="events-game").order_by("sequence"))
+        self.assertEqual([event.sequence for event in events if event.event_type != "settle"],
+                         range(1, action.version + 1))
+        self.assertEqual(sum(len(event.cards) for event in events),
+                         len(action.player_hand) + len(action.dealer_hand))
+        self.assertEqual(snapshot.replay(events), action.version)
+        for field in ("player_hand", "dealer_hand", "player_points", "dealer_points", "next_actions",
+                      "end_game_action", "player_win", "dealer_win", "game_push", "action_deck", "deck_seed",
+                      "deck_cursor", "version"):
+            self.assertEqual(getattr(snapshot, field), getattr(action, field))
+        self.assertEqual(Player.objects.get(wallet_id="events-player").wallet_balance, balance)
+        if action.end_game_action and not action.game_push:
+            self.assertEqual([event.event_type for event in events].count("settle"), 1)
+
+    def test_archive_games(self):
+        """
+        Old finished games move to the archive with their events, live and recent games stay
+        """
+
+        player = Player(wallet_id="archive-player")
+        player.save()
+        old = GameAction(player=player, bet=50, action_id="archive-old")
+        old.save()
+        old.deal(deck=stacked_deck(("10", "clubs"), ("9", "clubs"), ("K", "spades"), ("7", "hearts")))
+        old.apply("stand")
+        old.save()
+        self.assertEqual((old.player_win, old.action_deck), (True, []))
+        GameAction(player=player, bet=50, action_id="archive-live").save()
+        GameAction.objects.filter(action_id__in=["archive-old", "archive-live"]).update(
+            action_time=timezone.now() - timedelta(days=40))
+
+        self.assertEqual(archive.archive_games(days=30), 1)
+        self.assertEqual(sorted(GameAction.objects.values_list("action_id", flat=True)), ["archive-live"])
+        self.assertEqual(GameEvent.objects.filter(action="archive-old").count(), 0)
+        restored = GameArchive.objects.get(action_id="archive-old").to_game()
+        for field in ("player_hand", "dealer_hand", "player_points", "dealer_points", "player_win", "dealer_win",
+                      "end_game_action", "version"):
+            self.assertEqual(getattr(restored, field), getattr(old, field))
+        self.assertEqual([event[1] for event in GameArchive.objects.get(action_id="archive-old").events],
+                         ["stand", "settle"])
+
+    def test_compact_events(self):
+        """
+        Compaction catches snapshots up with their events and prunes the events of finished games on request
+        """
+
+        player = Player(wallet_id="compact-player")
+        player.save()
+        live = GameAction(player=player, bet=50, action_id="compact-live")
+        live.save()
+
+        # The deal is logged but its snapshot never written
+        live.apply("deal")
+        live.save_events()
+        done = GameAction(player=player, bet=50, action_id="compact-done", end_game_action=True)
+        done.save()
+        done.record("stand")
+        done.save_events()
+
+        call_command("compact_events", prune_days=0, stdout=StringIO())
+        snapshot = GameAction.objects.get(action_id="compact-live")
+        self.assertEqual((snapshot.version, snapshot.player_hand), (1, [list(card) for card in live.player_hand]))
+        self.assertEqual(GameEvent.objects.filter(action="compact-live").count(), 0 if snapshot.end_game_action else 1)
+        self.assertEqual(GameEvent.objects.filter(action="compact-done").count(), 0)
+
+
 class CardTest(TestCase):
     """
     Test our card deck :D
@@ -132,124 +309,1369 @@ class CardTest(TestCase):
             carddeck.pop()
         self.assertEqual(len(carddeck), 47)
 
+    def test_compact_deck_round_trip(self):
+        """
+        Integer coded deck converts to and from Card tuples and bytes
+        """
+
+        deck = cards.FrenchDeck()
+        compact = deck.compact()
+        self.assertEqual(len(compact), 52)
+        self.assertEqual(compact.draw_card(), deck.cards[-1])
+        self.assertEqual(len(compact), 51)
+        self.assertEqual(compact.to_cards(), list(reversed(deck.cards[:-1])))
+        self.assertEqual(cards.CompactDeck.frombytes(compact.tobytes()), compact)
+        self.assertEqual(cards.decode(cards.encode(cards.Card('10', 'hearts'))), ('10', 'hearts'))
 
-class ApiTest(TestCase):
+    def test_deal_from_compact_deck(self):
+        """
+        Deal draws in deck order and keeps the remaining deck as codes
+        """
+
+        deck = cards.CompactDeck()
+        expected = deck.copy().to_cards()
+        action = GameAction(player=Player(), bet=50)
+        action.deal(deck=deck)
+        self.assertEqual(action.player_hand, expected[:2])
+        self.assertEqual(action.dealer_hand, expected[2:4])
+        self.assertEqual(len(action.action_deck), 48)
+
+    def test_seeded_game_stores_no_deck(self):
+        """
+        A game dealt without a deck keeps only its seed and cursor, the seed reproduces every card it drew
+        """
+
+        action = GameAction(player=Player(), bet=50)
+        action.apply("deal")
+        if action.next_actions == "hit/stand":
+            action.apply("hit")
+        self.assertEqual(action.action_deck, [])
+        self.assertIsNotNone(action.deck_seed)
+        self.assertEqual(action.deck_cursor, len(action.player_hand) + len(action.dealer_hand))
+
+        deck = cards.CompactDeck.seeded(action.deck_seed)
+        self.assertEqual(deck.to_cards()[:4], action.player_hand[:2] + action.dealer_hand)
+        self.assertEqual(action.seeded_deck().remaining(), deck.remaining()[action.deck_cursor:])
+        self.assertEqual(cards.FrenchDeck(seed=7).cards, cards.FrenchDeck(seed=7).cards)
+
+
+class ShoeTest(TestCase):
     """
-    Test our api
+    Test the persistent multi-deck shoe
     """
 
-    def test_root_view_for_non_authenticated_user(self):
+    def test_shoe_reshuffles_at_cut_card(self):
         """
-        Request without credentials
+        A new shoe shuffles on the first hand and again once the cut card is out
         """
 
-        client = Client()
-        response = client.get("/")
-        self.assertJSONEqual(response.content, {"detail":"Authentication credentials were not provided."})
+        shoe = Shoe(decks=2, penetration=0.5)
+        shoe.start_hand()
+        self.assertEqual(len(shoe.cards), 104)
+        self.assertEqual(shoe.cut_card, 52)
+        self.assertEqual(shoe.shuffles, 1)
+        for i in range(52):
+            shoe.draw()
+        shoe.start_hand()
+        self.assertEqual(shoe.shuffles, 2)
+        self.assertEqual(shoe.cursor, 0)
 
-    def test_user_authentication(self):
+    def test_stored_shoe_hands_each_card_out_once(self):
         """
-        User auth test
+        Stale copies of a stored shoe claim different cards, and running dry reshuffles it only once
         """
 
-        test_superuser = User.objects.create_superuser(username="vagrant", password="vagrant", email="")
-        test_superuser.save()
-        client = Client()
-        self.assertTrue(client.login(username="vagrant", password="vagrant"))
+        shoe = Shoe(decks=1)
+        shoe.shuffle()
+        shoe.save()
+        first, second = Shoe.objects.get(shoe_id=shoe.pk), Shoe.objects.get(shoe_id=shoe.pk)
+        drawn = first.claim(4) + second.claim(4) + [first.draw(), second.draw()]
+        self.assertEqual(drawn, shoe.cards[:10])
+        self.assertEqual(Shoe.objects.get(shoe_id=shoe.pk).cursor, 10)
 
-    def test_root_view_for_authenticated_user(self):
+        Shoe.objects.filter(shoe_id=shoe.pk).update(cursor=52)
+        first.draw()
+        second.draw()
+        stored = Shoe.objects.get(shoe_id=shoe.pk)
+        self.assertEqual((stored.shuffles, stored.cursor), (2, 2))
+        self.assertEqual(second.cards, stored.cards)
+
+    def test_deal_from_shoe(self):
         """
-        Request root with credentials
+        Games bound to a shoe draw from it instead of a private deck
         """
 
-        test_superuser = User.objects.create_superuser(username="vagrant", password="vagrant", email="")
-        test_superuser.save()
-        client = Client()
-        client.login(username="vagrant", password="vagrant")
-        response = client.get("/")
-        self.assertJSONEqual(response.content, {"gameactions":"http://testserver/blackjack/gameactions/","players":"http://testserver/players/"})
+        shoe = Shoe(decks=1)
+        action = GameAction(player=Player(), bet=50, shoe=shoe)
+        action.deal()
+        self.assertEqual(action.action_deck, [])
+        self.assertEqual(shoe.cursor, 4)
+        self.assertEqual(action.player_hand, [cards.decode(code) for code in shoe.cards[:2]])
 
-    def test_default_player_creation(self):
+
+class RecordedFinds(object):
+    """
+    Context manager keeping the projection of every find sent to a model's collection
+    """
+
+    def __init__(self, model):
         """
-        Test player creation through post
+
+        :param model: Model class
+        :return:
         """
 
-        test_superuser = User.objects.create_superuser(username="vagrant", password="vagrant", email="")
-        test_superuser.save()
-        client = Client()
-        client.login(username="vagrant", password="vagrant")
-        response = client.post("/players/", data={})
-        self.assertEqual(response.data['wallet_balance'], 5000)
-        self.assertIsNotNone(response.data['wallet_id'])
+        self.model = model
+        self.projections = []
 
-    def test_player_creation_with_negative_wallet_value(self):
+    def __enter__(self):
+        self.connection = connections[self.model.objects.db]
+        self.get_collection = get_collection = self.connection.get_collection
+        recorded = self
+
+        class Collection(object):
+            def __init__(self, collection):
+                self.collection = collection
+
+            def __getattr__(self, attr):
+                return getattr(self.collection, attr)
+
+            def find(self, spec=None, fields=None, *args, **kwargs):
+                recorded.projections.append(fields)
+                return self.collection.find(spec, fields, *args, **kwargs)
+
+        def collection(name, **kwargs):
+            found = get_collection(name, **kwargs)
+            return Collection(found) if name == self.model._meta.db_table else found
+        self.connection.get_collection = collection
+        return self
+
+    def __exit__(self, *exc_info):
+        self.connection.get_collection = self.get_collection
+        return False
+
+
+class GameCacheTest(TestCase):
+    """
+    Test the live game cache
+    """
+
+    def test_intermediate_states_are_written_behind(self):
         """
-        Test player creation through post with a negative wallet balance
+        A live game is served from the cache and only reaches the database on flush
         """
 
-        test_superuser = User.objects.create_superuser(username="vagrant", password="vagrant", email="")
-        test_superuser.save()
-        client = Client()
-        client.login(username="vagrant", password="vagrant")
-        response = client.post("/players/", data={"wallet_balance":"-50"})
-        self.assertJSONEqual(response.content, {"wallet_balance":["Ensure this value is greater than or equal to 1."]})
+        player = Player()
+        player.save()
+        action = GameAction(player=player, bet=50, deck_seed=0)
+        action.save()
 
-    def test_default_game_action_creation(self):
+        game_cache = GameCache(alias=None)
+        cached = game_cache.get(action.pk)
+        self.assertTrue(cached.apply('deal'))
+        game_cache.store(cached)
+
+        self.assertEqual(GameAction.objects.get(action_id=action.pk).next_actions, '')
+        self.assertEqual(game_cache.get(action.pk).next_actions, 'hit/stand')
+        self.assertEqual(game_cache.flush(), 1)
+        self.assertEqual(GameAction.objects.get(action_id=action.pk).next_actions, 'hit/stand')
+
+    def test_live_snapshots_are_written_periodically(self):
         """
-        Test gameaction creation through post
+        Without a cache a live game logs its events and writes its snapshot every few revisions
         """
 
-        test_superuser = User.objects.create_superuser(username="vagrant", password="vagrant", email="")
-        test_superuser.save()
-        client = Client()
-        client.login(username="vagrant", password="vagrant")
         player = Player()
         player.save()
-        response = client.post("/blackjack/gameactions/", data={"player": str(player.wallet_id), "bet": "50"})
-        self.assertIsNotNone(response.data["action_id"])
-        self.assertIsNotNone(response.data["bet"])
-        self.assertIsNotNone(response.data["action_time"])
+        action = GameAction(player=player, bet=50, deck_seed=0)
+        action.save()
 
-    def test_game_action_creation_with_negative_bet(self):
+        game_cache = GameCache(snapshot_every=2)
+        dealt = game_cache.get(action.pk)
+        self.assertTrue(dealt.apply('deal'))
+        game_cache.store(dealt)
+
+        # The snapshot trails the deal, reads replay it
+        self.assertEqual(GameAction.objects.get(action_id=action.pk).version, 0)
+        self.assertEqual(game_cache.get(action.pk).version, 1)
+        self.assertEqual(game_cache.get(action.pk).next_actions, 'hit/stand')
+
+        hit = game_cache.get(action.pk)
+        self.assertTrue(hit.apply('hit'))
+        game_cache.store(hit)
+        self.assertEqual(GameAction.objects.get(action_id=action.pk).version, 2)
+        self.assertEqual(game_cache.get(action.pk).version, 2)
+
+    def test_finished_games_are_written_through(self):
         """
-        Same as previous but negative bet value
+        Settling a game saves it at once and drops it from the cache
         """
 
-        test_superuser = User.objects.create_superuser(username="vagrant", password="vagrant", email="")
-        test_superuser.save()
-        client = Client()
-        client.login(username="vagrant", password="vagrant")
         player = Player()
         player.save()
-        response = client.post("/blackjack/gameactions/", data={"player": str(player.wallet_id), "bet": "-50"})
-        self.assertJSONEqual(response.content, {"bet":["Ensure this value is greater than or equal to 1."]})
+        action = GameAction(player=player, bet=50)
+        action.save()
 
-    def test_deal_game_action(self):
+        game_cache = GameCache(alias=None)
+        cached = game_cache.get(action.pk)
+        cached.deal(deck=cards.CompactDeck(range(52)))
+        cached.stand()
+        game_cache.store(cached)
+
+        self.assertTrue(GameAction.objects.get(action_id=action.pk).end_game_action)
+        self.assertEqual(len(game_cache.local), 0)
+        self.assertEqual(game_cache.flush(), 0)
+
+    def test_lost_snapshot_is_replayed_from_events(self):
         """
-        Test deal gameaction
+        A cached game whose snapshot was never written is rebuilt from its event log
+        """
+
+        player = Player()
+        player.save()
+        action = GameAction(player=player, bet=50)
+        action.save()
+
+        # A deck seed that leaves the game live after the deal
+        game_cache = GameCache(alias=None)
+        cached = game_cache.get(action.pk)
+        cached.deck_seed = 0
+        cached.apply('deal')
+        self.assertFalse(cached.end_game_action)
+        game_cache.store(cached)
+        expected = game_cache.get(action.pk)
+
+        # The worker goes away without flushing, a new one only has the snapshot and the events
+        fresh = GameCache(alias=None).get(action.pk)
+        self.assertEqual(GameAction.objects.get(action_id=action.pk).version, 0)
+        self.assertEqual(fresh.version, 1)
+        self.assertEqual((fresh.player_hand, fresh.dealer_hand, fresh.next_actions, fresh.action_deck),
+                         (expected.player_hand, expected.dealer_hand, expected.next_actions, expected.action_deck))
+        self.assertEqual(GameCache(alias=None).validators(action.pk)[0], 1)
+
+    def test_claimed_game_is_played_by_one_request(self):
+        """
+        A game held by one request is refused to the next, in the process, the shared cache and the database
+        """
+
+        player = Player()
+        player.save()
+        action = GameAction(player=player, bet=50)
+        action.save()
+
+        shared = 'django.core.cache.backends.locmem.LocMemCache'
+        for game_cache in (GameCache(alias=None, claim_wait=0), GameCache(alias=shared, claim_wait=0),
+                           GameCache(claim_wait=0)):
+            with game_cache.claim(action.pk):
+                with self.assertRaises(GameBusy):
+                    with game_cache.claim(action.pk):
+                        pass
+            with game_cache.claim(action.pk) as claimed:
+                self.assertEqual(claimed.pk, action.pk)
+
+        # The database lease is given back with the game
+        self.assertIsNone(GameAction.objects.get(action_id=action.pk).claimed_until)
+
+    def test_finished_game_is_not_revived(self):
+        """
+        A stale copy stored after the game finished elsewhere is refused
+        """
+
+        player = Player(wallet_balance=5000)
+        player.save()
+        action = GameAction(player=player, bet=50, deck_seed=0)
+        action.save()
+
+        game_cache = GameCache(alias='django.core.cache.backends.locmem.LocMemCache')
+        with game_cache.claim(action.pk) as claimed:
+            claimed.apply('deal')
+            game_cache.store(claimed)
+        stale = game_cache.get(action.pk)
+        with game_cache.claim(action.pk) as claimed:
+            claimed.apply('stand')
+            game_cache.store(claimed)
+
+        stale.apply('stand')
+        with self.assertRaises(GameBusy):
+            game_cache.store(stale)
+
+    def test_cached_game_leaves_its_shoe_behind(self):
+        """
+        A pickled game keeps no copy of a stored shoe, whose position only the database knows
+        """
+
+        shoe = Shoe(decks=1)
+        shoe.save()
+        action = GameAction(player=Player.objects.create(), bet=50, shoe=shoe)
+        self.assertIs(action.shoe, shoe)
+        self.assertNotIn('_shoe_cache', pickle.loads(pickle.dumps(action, pickle.HIGHEST_PROTOCOL)).__dict__)
+
+
+class HandTest(TestCase):
+    """
+    Test incremental hand evaluation
+    """
+
+    def test_soft_ace_before_high_card(self):
+        """
+        An ace dealt first must drop back to 1 instead of busting the hand
+        """
+
+        hand = Hand()
+        self.assertEqual(hand.add(cards.Card('A', 'spades')), 11)
+        self.assertTrue(hand.soft)
+        self.assertEqual(hand.add(cards.Card('K', 'hearts')), 21)
+        self.assertEqual(hand.add(cards.Card('5', 'clubs')), 16)
+        self.assertFalse(hand.soft)
+        self.assertFalse(hand.bust)
+
+    def test_blackjack_and_bust_flags(self):
+        """
+        Flags follow the running total
+        """
+
+        self.assertTrue(Hand([('A', 'spades'), ('10', 'hearts')]).blackjack)
+        self.assertFalse(Hand([('7', 'spades'), ('4', 'hearts'), ('K', 'clubs')]).blackjack)
+        self.assertTrue(Hand([('K', 'spades'), ('Q', 'hearts'), ('2', 'clubs')]).bust)
+        self.assertEqual(Hand([('A', 'spades'), ('A', 'hearts'), ('A', 'clubs')]).points, 13)
+
+    def test_calculate_points_matches_hand(self):
+        """
+        GameAction.calculate_points delegates to the hand state
+        """
+
+        action = GameAction(player=Player(), bet=50)
+        self.assertEqual(action.calculate_points([['A', 'spades'], ['9', 'hearts'], ['5', 'clubs']]), 15)
+
+
+@skipIf(numpy is None, 'numpy is not installed')
+class SimulationTest(TestCase):
+    """
+    Test the vectorized simulator against the model rules
+    """
+
+    def test_simulator_agrees_with_game_action(self):
+        """
+        Same decks played through GameAction and the simulator settle the same way
+        """
+
+        rng = random.Random(1)
+        for stand_on in (12, 17, 21):
+            decks = []
+            for i in range(200):
+                codes = list(range(52))
+                rng.shuffle(codes)
+                decks.append(codes)
+            values = numpy.array([[CODE_VALUES[code] for code in codes[:simulation.max_draws()]] for codes in decks])
+            outcomes = simulation.play(values, stand_on)
+
+            for codes, outcome in zip(decks, outcomes):
+                action = GameAction(player=Player(wallet_id="simulation-player"), bet=50)
+                action.deal(deck=cards.CompactDeck(codes))
+                while action.next_actions == 'hit/stand' and action.player_points < stand_on:
+                    action.hit()
+                if action.next_actions == 'hit/stand':
+                    action.stand()
+                self.assertEqual(action.player.wallet_balance - 5000, simulation.PAYOUT_HALVES[outcome] * 25)
+                self.assertTrue(action.end_game_action)
+                self.assertEqual(action.game_push, outcome in simulation.PUSHES)
+
+    def test_simulation_report(self):
+        """
+        Seeded runs are reproducible and the rates add up
+        """
+
+        result = simulation.simulate(20000, seed=3)
+        self.assertEqual(result.hands, 20000)
+        self.assertEqual(result.counts, simulation.simulate(20000, seed=3).counts)
+        report = result.as_dict()
+        self.assertAlmostEqual(report['win_rate'] + report['push_rate'] + report['loss_rate'], 1.0)
+        low, high = report['ev_95_ci']
+        self.assertTrue(low < report['ev'] < high)
+
+    def test_sharded_run_resumes_from_a_checkpoint(self):
+        """
+        A run resumed from a checkpoint plays only the missing shards and merges to the uninterrupted totals
+        """
+
+        from .management.commands.simulate import Command
+        options = dict(hands=5000, shard_size=1000, seed=5, stand_on=17, decks=1)
+
+        def report(out):
+            output = out.getvalue()
+            return json.loads(output[output.index('{'):])
+
+        # The shards played one by one and added up
+        shards = [simulation.SimulationResult(simulation.simulate_shard(index, 1000, 5)[1]) for index in range(5)]
+        expected = simulation.SimulationResult()
+        for shard in shards:
+            expected.merge(shard)
+
+        out = StringIO()
+        call_command('simulate', workers=2, stdout=out, **options)
+        self.assertEqual(report(out), expected.as_dict())
+
+        # A run stopped after shards 0 and 3 left this checkpoint behind
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        checkpoint = os.path.join(directory, 'simulate.json')
+        interrupted = simulation.SimulationResult().merge(shards[0]).merge(shards[3])
+        Command().save_checkpoint(checkpoint, options, set([0, 3]), interrupted)
+
+        out = StringIO()
+        call_command('simulate', workers=2, checkpoint=checkpoint, stdout=out, **options)
+        self.assertIn('Resuming with 2 of 5 shards done', out.getvalue())
+        self.assertEqual(out.getvalue().count('Shard '), 3)
+        self.assertEqual(report(out), expected.as_dict())
+        with open(checkpoint) as f:
+            state = json.load(f)
+        self.assertEqual(state['done'], [0, 1, 2, 3, 4])
+        self.assertEqual(state['counts'], expected.counts)
+
+        # A checkpoint only resumes the run it was written for
+        with self.assertRaises(CommandError):
+            call_command('simulate', workers=2, checkpoint=checkpoint, stdout=StringIO(),
+                         **dict(options, seed=6))
+
+
+class StrategyTest(TestCase):
+    """
+    Test the memoized strategy engine
+    """
+
+    def test_stand_on_hard_twenty(self):
+        """
+        Hitting a hard 20 only wins with an ace
+        """
+
+        comp = full_composition()
+        comp = comp[:9] + (comp[9] - 1,)
+        ev, action, hit, stand = StrategyEngine().value(20, False, 10, comp)
+        self.assertEqual(action, 'stand')
+        self.assertEqual(ev, stand)
+        self.assertTrue(hit < 0 < stand)
+
+    def test_advice_never_computes_the_table_in_a_request(self):
+        """
+        A missing table is built by a background thread while the advice endpoint answers 503
         """
 
         test_superuser = User.objects.create_superuser(username="vagrant", password="vagrant", email="")
         test_superuser.save()
         client = APIClient()
         client.login(username="vagrant", password="vagrant")
-        player = Player()
-        player.save()
 
-        # Create game action
-        wid = str(player.wallet_id)
-        post_response = client.post("/blackjack/gameactions/", {"player": wid, "bet": "50"})
-        aid = str(post_response.data["action_id"])
-        at = str(post_response.data["action_time"])
+        # An engine stub stands in for the seconds-long computation
+        class Engine(object):
+            def __init__(self, decks):
+                pass
 
-        # Check whether we managed to create a gameaction
-        self.assertIsNotNone(at)
-        self.assertIsNotNone(aid)
+            def table(self):
+                return {strategy.table_key(16, False, 10): {'action': 'hit'}}
 
-        # Deal patch
-        patch_response = client.patch("/blackjack/gameactions/"+aid+"/", {"player_action":"deal"}, format="json")
+        cache = tempfile.mkdtemp()
+        engine, strategy.StrategyEngine = strategy.StrategyEngine, Engine
+        try:
+            with self.settings(BLACKJACK_STRATEGY_DECKS=5, BLACKJACK_STRATEGY_CACHE=os.path.join(cache, "s.json")):
+                response = client.get("/blackjack/strategy/", {"total": 16, "upcard": 10})
+                self.assertEqual(response.status_code, 503)
+                for thread in threading.enumerate():
+                    if thread.name == "strategy-" + strategy.rules_key(5):
+                        thread.join()
+                response = client.get("/blackjack/strategy/", {"total": 16, "upcard": 10})
+                self.assertEqual(response.data["action"], "hit")
+        finally:
+            strategy.StrategyEngine = engine
+            strategy._tables.pop(strategy.rules_key(5), None)
+            shutil.rmtree(cache)
 
-        # Assertion
+    def test_failed_background_build_is_retried(self):
+        """
+        A background computation that raises doesn't leave the table marked as building, the next request retries
+        """
+
+        test_superuser = User.objects.create_superuser(username="vagrant", password="vagrant", email="")
+        test_superuser.save()
+        client = APIClient()
+        client.login(username="vagrant", password="vagrant")
+
+        class Engine(object):
+            fail = True
+
+            def __init__(self, decks):
+                pass
+
+            def table(self):
+                if Engine.fail:
+                    raise MemoryError()
+                return {strategy.table_key(16, False, 10): {'action': 'stand'}}
+
+        def wait():
+            for thread in threading.enumerate():
+                if thread.name == "strategy-" + strategy.rules_key(6):
+                    thread.join()
+
+        cache = tempfile.mkdtemp()
+        engine, strategy.StrategyEngine = strategy.StrategyEngine, Engine
+        try:
+            with self.settings(BLACKJACK_STRATEGY_DECKS=6, BLACKJACK_STRATEGY_CACHE=os.path.join(cache, "s.json")):
+                self.assertEqual(client.get("/blackjack/strategy/", {"total": 16, "upcard": 10}).status_code, 503)
+                wait()
+                self.assertNotIn(strategy.rules_key(6), strategy._building)
+
+                Engine.fail = False
+                self.assertEqual(client.get("/blackjack/strategy/", {"total": 16, "upcard": 10}).status_code, 503)
+                wait()
+                response = client.get("/blackjack/strategy/", {"total": 16, "upcard": 10})
+                self.assertEqual(response.data["action"], "stand")
+        finally:
+            strategy.StrategyEngine = engine
+            strategy._tables.pop(strategy.rules_key(6), None)
+            shutil.rmtree(cache)
+
+    def test_standing_on_eight_always_loses(self):
+        """
+        stand() lets the dealer draw past any total the player can't beat without busting
+        """
+
+        comp = full_composition()
+        comp = comp[:5] + (comp[5] - 1,) + comp[6:]
+        ev, action, hit, stand = StrategyEngine().value(8, False, 6, comp)
+        self.assertEqual(action, 'hit')
+        self.assertEqual(stand, -1.0)
+
+
+class FastSerializerTest(TestCase):
+    """
+    Compiled serializers match DRF byte for byte
+    """
+
+    def test_compiled_output_matches_drf(self):
+        """
+        Full and sparse output of a dealt game and its player, before and after a database round trip
+        """
+
+        player = Player()
+        player.save()
+        action = GameAction(player=player, bet=50)
+        action.save()
+        action.deal()
+        action.save()
+        for instance, serializer_class in ((action, GameActionSerializer), (player, PlayerSerializer),
+                                           (GameAction.objects.get(action_id=action.pk), GameActionSerializer)):
+            expected = serializer_class(instance).data
+            self.assertEqual(json.dumps(compile_serializer(serializer_class)(instance)), json.dumps(expected))
+        sparse = compile_serializer(GameActionSerializer, ("player_points", "next_actions"))(action)
+        self.assertEqual(sparse, GameActionSerializer(action, fields=("player_points", "next_actions")).data)
+
+    def test_field_orders_share_one_compiled_function(self):
+        """
+        A selection asked in another order reuses the compiled function, and the cache stays bounded
+        """
+
+        first = compile_serializer(GameActionSerializer, ["player_points", "next_actions", "player_hand"])
+        self.assertIs(compile_serializer(GameActionSerializer, ["player_hand", "player_points", "next_actions"]), first)
+        limit, fastserializers.MAX_COMPILED = fastserializers.MAX_COMPILED, 8
+        try:
+            for name in GameActionSerializer.Meta.fields:
+                compile_serializer(GameActionSerializer, [name])
+            self.assertEqual(len(fastserializers._compiled), 8)
+        finally:
+            fastserializers.MAX_COMPILED = limit
+
+
+class ScriptedClient(object):
+    """
+    Load test client answering each call with the next scripted status and body
+    """
+
+    def __init__(self, *answers):
+        """
+
+        :param answers: tuples of status and body
+        :return:
+        """
+
+        self.answers = list(answers)
+        self.calls = []
+
+    def call(self, key, method, path, data=None):
+        self.calls.append(key)
+        return self.answers.pop(0)
+
+
+class LoadTestTest(TestCase):
+    """
+    Test the load generator's bookkeeping without a server
+    """
+
+    def game(self, **state):
+        """
+        Game state as the API serializes it
+        :param state: fields overriding an undealt game's
+        :return: dict
+        """
+
+        game = {"action_id": "load-game", "bet": 10, "player_hand": [], "end_game_action": False,
+                "player_win": False, "player_blackjack": False, "dealer_win": False, "game_push": False}
+        game.update(state)
+        return game
+
+    def test_percentile(self):
+        """
+        Nearest rank: the smallest value with at least that fraction of the values at or below it
+        """
+
+        values = [float(i) for i in range(1, 101)]
+        self.assertEqual(loadtest.percentile(values, 0.50), 50.0)
+        self.assertEqual(loadtest.percentile(values, 0.95), 95.0)
+        self.assertEqual(loadtest.percentile(values, 0.99), 99.0)
+        self.assertEqual(loadtest.percentile([3.0], 0.99), 3.0)
+        self.assertEqual(loadtest.percentile([1.0, 2.0, 3.0, 4.0], 0.5), 2.0)
+        self.assertEqual(loadtest.percentile([float(i) for i in range(1, 101)], 0.07), 7.0)
+        self.assertIsNone(loadtest.percentile([], 0.5))
+
+    def test_settlement(self):
+        """
+        Finished games settle as GameAction pays them, a dealt game left open keeps its reserved bet
+        """
+
+        dealt = [["10", "spades"], ["7", "hearts"]]
+        self.assertEqual(loadtest.settlement(self.game(end_game_action=True, player_win=True, player_blackjack=True,
+                                                       player_hand=dealt)), 15)
+        self.assertEqual(loadtest.settlement(self.game(end_game_action=True, player_win=True, player_hand=dealt)), 10)
+        self.assertEqual(loadtest.settlement(self.game(end_game_action=True, dealer_win=True, player_hand=dealt)), -10)
+        self.assertEqual(loadtest.settlement(self.game(end_game_action=True, game_push=True, player_hand=dealt)), 0)
+        self.assertEqual(loadtest.settlement(self.game(player_hand=dealt)), -10)
+        self.assertEqual(loadtest.settlement(self.game()), 0)
+
+    def test_abandoned_game_is_read_back(self):
+        """
+        A game whose action is turned away after the deal is counted as stored, one that can't be read is lost
+        """
+
+        dealt = self.game(player_hand=[["10", "spades"], ["7", "hearts"]], player_points=17, next_actions="hit/stand")
+        client = ScriptedClient((200, self.game()), (200, dealt), (409, {"detail": "busy"}), (200, dealt))
+        state = loadtest.play_game(client, "load-wallet", 10, 17)
+        self.assertEqual(client.calls, ["POST gameactions", "PATCH deal", "PATCH stand", "GET gameaction"])
+        self.assertEqual(loadtest.settlement(state), -10)
+
+        client = ScriptedClient((200, self.game()), (0, None), (0, None))
+        self.assertRaises(loadtest.LostGame, loadtest.play_game, client, "load-wallet", 10, 17)
+        self.assertIsNone(loadtest.play_game(ScriptedClient((400, None)), "load-wallet", 10, 17))
+
+    def test_balance_check(self):
+        """
+        A wallet is consistent only when it holds exactly its start plus its settlements and every game is known
+        """
+
+        self.assertTrue(loadtest.balance_check(1000, -25.0, 975)["ok"])
+        self.assertFalse(loadtest.balance_check(1000, -25.0, 985)["ok"])
+        self.assertFalse(loadtest.balance_check(1000, -25.0, None)["ok"])
+        check = loadtest.balance_check(1000, -25.0, 975, lost=1)
+        self.assertEqual((check["expected"], check["ok"], check["lost"]), (975.0, False, 1))
+
+
+class ApiTest(TestCase):
+    """
+    Test our api
+    """
+
+    def test_root_view_for_non_authenticated_user(self):
+        """
+        Request without credentials
+        """
+
+        client = Client()
+        response = client.get("/")
+        self.assertJSONEqual(response.content, {"detail":"Authentication credentials were not provided."})
+
+    def test_user_authentication(self):
+        """
+        User auth test
+        """
+
+        test_superuser = User.objects.create_superuser(username="vagrant", password="vagrant", email="")
+        test_superuser.save()
+        client = Client()
+        self.assertTrue(client.login(username="vagrant", password="vagrant"))
+
+    def test_root_view_for_authenticated_user(self):
+        """
+        Request root with credentials
+        """
+
+        test_superuser = User.objects.create_superuser(username="vagrant", password="vagrant", email="")
+        test_superuser.save()
+        client = Client()
+        client.login(username="vagrant", password="vagrant")
+        response = client.get("/")
+        self.assertJSONEqual(response.content, {"gameactions":"http://testserver/blackjack/gameactions/","players":"http://testserver/players/"})
+
+    def test_default_player_creation(self):
+        """
+        Test player creation through post
+        """
+
+        test_superuser = User.objects.create_superuser(username="vagrant", password="vagrant", email="")
+        test_superuser.save()
+        client = Client()
+        client.login(username="vagrant", password="vagrant")
+        response = client.post("/players/", data={})
+        self.assertEqual(response.data['wallet_balance'], 5000)
+        self.assertIsNotNone(response.data['wallet_id'])
+
+    def test_player_creation_with_negative_wallet_value(self):
+        """
+        Test player creation through post with a negative wallet balance
+        """
+
+        test_superuser = User.objects.create_superuser(username="vagrant", password="vagrant", email="")
+        test_superuser.save()
+        client = Client()
+        client.login(username="vagrant", password="vagrant")
+        response = client.post("/players/", data={"wallet_balance":"-50"})
+        self.assertJSONEqual(response.content, {"wallet_balance":["Ensure this value is greater than or equal to 1."]})
+
+    def test_default_game_action_creation(self):
+        """
+        Test gameaction creation through post
+        """
+
+        test_superuser = User.objects.create_superuser(username="vagrant", password="vagrant", email="")
+        test_superuser.save()
+        client = Client()
+        client.login(username="vagrant", password="vagrant")
+        player = Player()
+        player.save()
+        response = client.post("/blackjack/gameactions/", data={"player": str(player.wallet_id), "bet": "50"})
+        self.assertIsNotNone(response.data["action_id"])
+        self.assertIsNotNone(response.data["bet"])
+        self.assertIsNotNone(response.data["action_time"])
+
+    def test_game_action_creation_with_negative_bet(self):
+        """
+        Same as previous but negative bet value
+        """
+
+        test_superuser = User.objects.create_superuser(username="vagrant", password="vagrant", email="")
+        test_superuser.save()
+        client = Client()
+        client.login(username="vagrant", password="vagrant")
+        player = Player()
+        player.save()
+        response = client.post("/blackjack/gameactions/", data={"player": str(player.wallet_id), "bet": "-50"})
+        self.assertJSONEqual(response.content, {"bet":["Ensure this value is greater than or equal to 1."]})
+
+    def test_deal_game_action(self):
+        """
+        Test deal gameaction
+        """
+
+        test_superuser = User.objects.create_superuser(username="vagrant", password="vagrant", email="")
+        test_superuser.save()
+        client = APIClient()
+        client.login(username="vagrant", password="vagrant")
+        player = Player()
+        player.save()
+
+        # Create game action
+        wid = str(player.wallet_id)
+        post_response = client.post("/blackjack/gameactions/", {"player": wid, "bet": "50"})
+        aid = str(post_response.data["action_id"])
+        at = str(post_response.data["action_time"])
+
+        # Check whether we managed to create a gameaction
+        self.assertIsNotNone(at)
+        self.assertIsNotNone(aid)
+
+        # Deal patch
+        patch_response = client.patch("/blackjack/gameactions/"+aid+"/", {"player_action":"deal"}, format="json")
+
+        # Assertion
         self.assertEqual(patch_response.data["action_type"], "deal")
         self.assertIsNotNone(patch_response.data["dealer_hand"])
-        self.assertIsNotNone(patch_response.data["next_actions"])
\ No newline at end of file
+        self.assertIsNotNone(patch_response.data["next_actions"])
+
+    def test_player_balance_adjustment(self):
+        """
+        Relative balance changes are applied atomically and can't overdraw the wallet
+        """
+
+        test_superuser = User.objects.create_superuser(username="vagrant", password="vagrant", email="")
+        test_superuser.save()
+        client = APIClient()
+        client.login(username="vagrant", password="vagrant")
+        player = Player()
+        player.save()
+
+        wid = str(player.wallet_id)
+        response = client.put("/players/"+wid+"/", {"amount": "-6000"}, format="json")
+        self.assertEqual(response.status_code, 400)
+        response = client.put("/players/"+wid+"/", {"amount": "250"}, format="json")
+        self.assertEqual(response.data["wallet_balance"], 5250)
+        self.assertEqual(Player.objects.get(wallet_id=wid).wallet_balance, 5250)
+
+    def test_batch_game_actions(self):
+        """
+        A list of actions is applied in one PATCH and stops at the first terminal state
+        """
+
+        test_superuser = User.objects.create_superuser(username="vagrant", password="vagrant", email="")
+        test_superuser.save()
+        client = APIClient()
+        client.login(username="vagrant", password="vagrant")
+        player = Player()
+        player.save()
+
+        post_response = client.post("/blackjack/gameactions/", {"player": str(player.wallet_id), "bet": "50"})
+        aid = str(post_response.data["action_id"])
+        patch_response = client.patch("/blackjack/gameactions/"+aid+"/",
+                                      {"player_actions": ["deal", "hit", "hit", "hit", "hit", "stand"]}, format="json")
+
+        states = patch_response.data
+        self.assertEqual(states[0]["action_type"], "deal")
+        self.assertTrue(states[-1]["end_game_action"] or states[-1]["action_type"] == "stand")
+        self.assertFalse(any(state["end_game_action"] for state in states[:-1]))
+        self.assertEqual(GameAction.objects.get(action_id=aid).action_type, states[-1]["action_type"])
+
+    def test_batch_rejects_invalid_action(self):
+        """
+        An action the game doesn't allow fails the whole batch
+        """
+
+        test_superuser = User.objects.create_superuser(username="vagrant", password="vagrant", email="")
+        test_superuser.save()
+        client = APIClient()
+        client.login(username="vagrant", password="vagrant")
+        player = Player()
+        player.save()
+
+        post_response = client.post("/blackjack/gameactions/", {"player": str(player.wallet_id), "bet": "50"})
+        aid = str(post_response.data["action_id"])
+        patch_response = client.patch("/blackjack/gameactions/"+aid+"/", {"player_actions": ["hit"]}, format="json")
+        self.assertEqual(patch_response.status_code, 400)
+        self.assertEqual(GameAction.objects.get(action_id=aid).next_actions, "")
+
+    def test_batch_keeps_the_actions_before_a_rejected_one(self):
+        """
+        A batch rejected after its deal still stores the dealt game, so the bet is never reserved twice
+        """
+
+        test_superuser = User.objects.create_superuser(username="vagrant", password="vagrant", email="")
+        test_superuser.save()
+        client = APIClient()
+        client.login(username="vagrant", password="vagrant")
+        player = Player()
+        player.save()
+
+        # Seed 0 deals 15 against 15, the game stays open after the deal
+        action = GameAction(player=player, bet=50, deck_seed=0)
+        action.save()
+        url = "/blackjack/gameactions/%s/" % action.pk
+        self.assertEqual(client.patch(url, {"player_actions": ["deal", "deal"]}, format="json").status_code, 400)
+        game = get_game_cache().get(action.pk)
+        self.assertEqual((game.action_type, game.next_actions, game.version), ("deal", "hit/stand", 1))
+        self.assertEqual(Player.objects.get(wallet_id=player.wallet_id).wallet_balance, 4950)
+
+        self.assertEqual(client.patch(url, {"player_actions": ["deal"]}, format="json").status_code, 400)
+        self.assertEqual(Player.objects.get(wallet_id=player.wallet_id).wallet_balance, 4950)
+
+    def test_conditional_game_action_get(self):
+        """
+        A client holding the current revision gets a 304, every accepted action moves the ETag on
+        """
+
+        test_superuser = User.objects.create_superuser(username="vagrant", password="vagrant", email="")
+        test_superuser.save()
+        client = APIClient()
+        client.login(username="vagrant", password="vagrant")
+        player = Player()
+        player.save()
+
+        post_response = client.post("/blackjack/gameactions/", {"player": str(player.wallet_id), "bet": "50"})
+        aid = str(post_response.data["action_id"])
+        response = client.get("/blackjack/gameactions/"+aid+"/")
+        etag = response["ETag"]
+        self.assertEqual(response["Cache-Control"], "private, no-cache")
+        self.assertEqual(client.get("/blackjack/gameactions/"+aid+"/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        client.patch("/blackjack/gameactions/"+aid+"/", {"player_action": "deal"}, format="json")
+        response = client.get("/blackjack/gameactions/"+aid+"/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_conditional_player_get(self):
+        """
+        A balance change invalidates the player's ETag
+        """
+
+        test_superuser = User.objects.create_superuser(username="vagrant", password="vagrant", email="")
+        test_superuser.save()
+        client = APIClient()
+        client.login(username="vagrant", password="vagrant")
+        player = Player()
+        player.save()
+
+        wid = str(player.wallet_id)
+        etag = client.get("/players/"+wid+"/")["ETag"]
+        self.assertEqual(client.get("/players/"+wid+"/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        client.put("/players/"+wid+"/", {"amount": "-50"}, format="json")
+        self.assertEqual(client.get("/players/"+wid+"/", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_keyset_pagination(self):
+        """
+        Cursors walk the game list forwards and back without skipping or repeating rows
+        """
+
+        test_superuser = User.objects.create_superuser(username="vagrant", password="vagrant", email="")
+        test_superuser.save()
+        client = APIClient()
+        client.login(username="vagrant", password="vagrant")
+        player = Player()
+        player.save()
+        for i in range(7):
+            GameAction.objects.create(player=player, bet=50, action_id="game-%d" % i)
+
+        first = client.get("/blackjack/gameactions/", {"page_size": 3})
+        second = client.get(first.data["next"])
+        third = client.get(second.data["next"])
+        ids = [row["action_id"] for page in (first, second, third) for row in page.data["results"]]
+        self.assertEqual(len(set(ids)), 7)
+        self.assertIsNone(first.data["previous"])
+        self.assertIsNone(third.data["next"])
+        back = client.get(third.data["previous"])
+        self.assertEqual(back.data["results"], second.data["results"])
+        self.assertEqual(client.get("/blackjack/gameactions/", {"cursor": "bogus"}).status_code, 404)
+
+    def test_game_list_order_is_indexed(self):
+        """
+        ensure_indexes builds the index of the game list order on the stored _id key, not on an action_id column
+        """
+
+        call_command("ensure_indexes", stdout=StringIO())
+        collection = connection.get_collection(GameAction._meta.db_table)
+        keys = [info["key"] for info in collection.index_information().values()]
+        self.assertIn([("action_time", -1), ("_id", -1)], keys)
+
+    def test_player_game_history(self):
+        """
+        A player's history lists only their games, filtered by outcome, without the remaining deck
+        """
+
+        test_superuser = User.objects.create_superuser(username="vagrant", password="vagrant", email="")
+        test_superuser.save()
+        client = APIClient()
+        client.login(username="vagrant", password="vagrant")
+        player, other = Player(wallet_id="history-player"), Player(wallet_id="history-other")
+        player.save()
+        other.save()
+        GameAction.objects.create(player=player, bet=50, action_id="won", player_win=True, end_game_action=True)
+        GameAction.objects.create(player=player, bet=50, action_id="lost", dealer_win=True, end_game_action=True)
+        GameAction.objects.create(player=other, bet=50, action_id="other", player_win=True, end_game_action=True)
+
+        with RecordedFinds(GameAction) as finds:
+            response = client.get("/players/history-player/gameactions/")
+        self.assertEqual(sorted(row["action_id"] for row in response.data["results"]), ["lost", "won"])
+        self.assertTrue(finds.projections)
+        for fields in finds.projections:
+            self.assertIn("player_hand", fields)
+            self.assertNotIn("action_deck", fields)
+        response = client.get("/players/history-player/gameactions/", {"outcome": "win"})
+        self.assertEqual([row["action_id"] for row in response.data["results"]], ["won"])
+        response = client.get("/players/history-player/gameactions/", {"since": "2999-01-01T00:00:00Z"})
+        self.assertEqual(response.data["results"], [])
+        self.assertEqual(client.get("/players/history-player/gameactions/", {"outcome": "x"}).status_code, 400)
+
+    def test_sparse_fieldsets(self):
+        """
+        ?fields= trims game and player output, unknown fields are rejected
+        """
+
+        test_superuser = User.objects.create_superuser(username="vagrant", password="vagrant", email="")
+        test_superuser.save()
+        client = APIClient()
+        client.login(username="vagrant", password="vagrant")
+        player = Player()
+        player.save()
+
+        wid = str(player.wallet_id)
+        post_response = client.post("/blackjack/gameactions/", {"player": wid, "bet": "50"})
+        aid = str(post_response.data["action_id"])
+        client.patch("/blackjack/gameactions/"+aid+"/", {"player_action": "deal"}, format="json")
+
+        with RecordedFinds(GameAction) as finds:
+            response = client.get("/blackjack/gameactions/"+aid+"/", {"fields": "player_points,next_actions"})
+        self.assertEqual(set(response.data), set(["player_points", "next_actions"]))
+        self.assertTrue(set(["player_points", "next_actions"]) <= set(finds.projections[0]))
+        self.assertNotIn("player_hand", finds.projections[0])
+        self.assertEqual(response.data["next_actions"], get_game_cache().get(aid).next_actions)
+        response = client.get("/players/"+wid+"/gameactions/", {"fields": "player_hand"})
+        self.assertEqual([set(row) for row in response.data["results"]], [set(["player_hand"])])
+        with RecordedFinds(Player) as finds:
+            response = client.get("/players/"+wid+"/", {"fields": "wallet_balance"})
+        self.assertEqual(response.data, {"wallet_balance": Player.objects.get(wallet_id=wid).wallet_balance})
+        self.assertTrue(finds.projections)
+        self.assertEqual(set(finds.projections[-1]), set(["wallet_id", "wallet_balance", "version"]))
+        self.assertEqual(client.get("/players/"+wid+"/", {"fields": "action_deck"}).status_code, 400)
+
+    def test_metrics(self):
+        """
+        Requests are recorded per view and action while metrics are on, /metrics is for admins only
+        """
+
+        self.assertEqual(Client().get("/metrics").status_code, 403)
+        test_superuser = User.objects.create_superuser(username="vagrant", password="vagrant", email="")
+        test_superuser.save()
+        with self.settings(BLACKJACK_METRICS=True):
+            client = APIClient()
+            client.login(username="vagrant", password="vagrant")
+            player = Player()
+            player.save()
+            post_response = client.post("/blackjack/gameactions/", {"player": str(player.wallet_id), "bet": "50"})
+            aid = str(post_response.data["action_id"])
+            client.patch("/blackjack/gameactions/"+aid+"/", {"player_action": "deal"}, format="json")
+            response = client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        self.assertIn('blackjack_engine_seconds_count{view="GameActionDetail",action="deal"}', response.content)
+        self.assertIn('blackjack_request_seconds_bucket{view="GameActionDetail",action="deal",le="+Inf"}',
+                      response.content)
+
+    def test_metered_collection(self):
+        """
+        Operations and document bytes are counted into the request being served
+        """
+
+        collection = metrics.MeteredCollection(connection.get_collection("metered"))
+        context = metrics.begin()
+        try:
+            collection.save({"_id": "a", "hand": [1, 2, 3]})
+            collection.update({"_id": "a"}, {"$inc": {"points": 1}})
+            self.assertEqual(len(list(collection.find({"_id": "a"}).limit(1))), 1)
+        finally:
+            metrics.finish()
+        self.assertEqual(context.db_operations, 3)
+        self.assertTrue(context.db_bytes_written > 0 and context.db_bytes_read > 0)
+
+    def test_game_session(self):
+        """
+        A session plays a game with bare action messages and answers with the changed fields only
+        """
+
+        test_superuser = User.objects.create_superuser(username="vagrant", password="vagrant", email="")
+        test_superuser.save()
+        client = APIClient()
+        client.login(username="vagrant", password="vagrant")
+        player = Player()
+        player.save()
+        post_response = client.post("/blackjack/gameactions/", {"player": str(player.wallet_id), "bet": "50"})
+        aid = str(post_response.data["action_id"])
+
+        response = client.post("/blackjack/gameactions/"+aid+"/session/")
+        self.assertEqual(response.data["state"]["next_actions"], "")
+        url, token = response.data["url"], response.data["session"]
+        self.assertNotIn(token, url)
+        anonymous = Client()
+
+        def play(player_action, token=token):
+            return anonymous.post(url, player_action, content_type="text/plain", HTTP_X_GAME_SESSION=token)
+
+        response = play("hit")
+        self.assertEqual(response.status_code, 400)
+
+        # A session action is a PATCH by another door, both refuse the same way
+        patch_response = client.patch("/blackjack/gameactions/"+aid+"/", {"player_action": "hit"}, format="json")
+        self.assertEqual(json.loads(response.content), patch_response.data)
+        delta = json.loads(play("deal").content)
+        self.assertEqual(delta["version"], 1)
+        self.assertEqual(len(delta["player_hand"]), 2)
+        self.assertNotIn("bet", delta)
+        if not delta.get("end_game_action"):
+            delta = json.loads(play("stand").content)
+            self.assertEqual(delta["version"], 2)
+        game = GameAction.objects.get(action_id=aid)
+        if game.end_game_action:
+            self.assertEqual(game.version, delta["version"])
+        self.assertEqual(play("hit", token[:-1] + "x").status_code, 403)
+        self.assertEqual(anonymous.post(url, "hit", content_type="text/plain").status_code, 403)
+
+        # A session ends with its admin's access
+        test_superuser.is_active = False
+        test_superuser.save()
+        response = play("hit")
+        self.assertEqual(response.status_code, 403)
+        self.assertIn("no longer has access", response.content)
+
+    def test_bulk_players(self):
+        """
+        Bulk creation and adjustment report every row, bad rows don't stop the others and a batch applies once
+        """
+
+        test_superuser = User.objects.create_superuser(username="vagrant", password="vagrant", email="")
+        test_superuser.save()
+        client = APIClient()
+        client.login(username="vagrant", password="vagrant")
+
+        response = client.post("/players/bulk/", {"players": [
+            {"wallet_id": "bulk-a", "wallet_balance": 100}, {"wallet_balance": -5}, {"wallet_id": "bulk-a"}, {},
+        ]}, format="json")
+        self.assertEqual([row["status"] for row in response.data["results"]], ["created", "error", "error", "created"])
+        self.assertEqual(response.data["summary"], {"created": 2, "error": 2})
+        self.assertEqual(Player.objects.get(wallet_id=response.data["results"][3]["wallet_id"]).wallet_balance, 5000)
+        self.assertEqual(client.post("/players/bulk/", {"players": [{"wallet_id": "bulk-a"}]}, format="json")
+                         .data["results"][0]["errors"], {"wallet_id": ["Already exists."]})
+
+        adjustments = {"batch": "promo", "adjustments": [
+            {"wallet_id": "bulk-a", "amount": -40}, {"wallet_id": "missing", "amount": 5},
+            {"wallet_id": response.data["results"][3]["wallet_id"], "amount": -6000},
+            {"wallet_id": "bulk-a", "amount": 1},
+        ]}
+        response = client.post("/players/bulk/adjust/", adjustments, format="json")
+        self.assertEqual([row["status"] for row in response.data["results"]], ["applied", "error", "error", "error"])
+        self.assertEqual(Player.objects.get(wallet_id="bulk-a").wallet_balance, 60)
+        self.assertEqual(Player.objects.get(wallet_id="bulk-a").version, 1)
+        response = client.post("/players/bulk/adjust/", adjustments, format="json")
+        self.assertEqual(response.data["results"][0]["status"], "skipped")
+        self.assertEqual(Player.objects.get(wallet_id="bulk-a").wallet_balance, 60)
+
+        # Another batch reaching the wallet in between doesn't let the first one pay again
+        client.post("/players/bulk/adjust/", {"batch": "bonus", "adjustments": [{"wallet_id": "bulk-a", "amount": 5}]},
+                    format="json")
+        response = client.post("/players/bulk/adjust/", adjustments, format="json")
+        self.assertEqual(response.data["results"][0]["status"], "skipped")
+        self.assertEqual(Player.objects.get(wallet_id="bulk-a").wallet_balance, 65)
+        self.assertEqual(client.post("/players/bulk/adjust/", {"adjustments": []}, format="json").status_code, 400)
+
+    def test_player_stats_and_leaderboard(self):
+        """
+        Finished games add up on the player as they end, and the leaderboard ranks players by those counters
+        """
+
+        test_superuser = User.objects.create_superuser(username="vagrant", password="vagrant", email="")
+        test_superuser.save()
+        client = APIClient()
+        client.login(username="vagrant", password="vagrant")
+
+        # A blackjack, a push of two blackjacks and a bust, dealt from a stacked shoe
+        player = Player(wallet_id="stats-player")
+        player.save()
+        drawn = [("A", "spades"), ("K", "spades"), ("9", "hearts"), ("7", "hearts"),
+                 ("A", "hearts"), ("Q", "hearts"), ("A", "clubs"), ("K", "clubs"),
+                 ("10", "clubs"), ("9", "clubs"), ("K", "hearts"), ("7", "clubs"), ("5", "spades")]
+        shoe = Shoe(cards=[cards.encode(card) for card in drawn], cut_card=len(drawn))
+        shoe.save()
+        for actions in (["deal"], ["deal"], ["deal", "hit"]):
+            action = GameAction(player=player, bet=50, shoe=shoe)
+            for player_action in actions:
+                self.assertTrue(action.apply(player_action))
+            action.save()
+        Player(wallet_id="stats-other").save()
+
+        response = client.get("/players/stats-player/stats/")
+        self.assertEqual(response.data, {"wallet_id": "stats-player", "hands_played": 3, "hands_won": 1,
+                                         "hands_lost": 1, "hands_pushed": 1, "blackjacks": 2, "busts": 1,
+                                         "total_wagered": 150, "net_winnings": 25.0})
+        self.assertEqual(Player.objects.get(wallet_id="stats-player").wallet_balance, 5025)
+
+        response = client.get("/players/leaderboard/", {"by": "hands_played", "limit": 1})
+        self.assertEqual([row["wallet_id"] for row in response.data["results"]], ["stats-player"])
+        response = client.get("/players/leaderboard/")
+        self.assertEqual([row["net_winnings"] for row in response.data["results"]], [25.0, 0.0])
+        self.assertEqual(client.get("/players/leaderboard/", {"by": "balance"}).status_code, 400)
+        self.assertEqual(client.get("/players/leaderboard/", {"limit": 0}).status_code, 400)
+
+        # Counters recounted from the games match the ones kept as they ended
+        Player.objects.filter(wallet_id="stats-player").update(hands_played=0, net_winnings=0)
+        with RecordedFinds(GameAction) as finds:
+            call_command("rebuild_player_stats", stdout=StringIO())
+        self.assertNotIn("player_hand", finds.projections[0])
+        self.assertEqual(client.get("/players/stats-player/stats/").data["net_winnings"], 25.0)
+        self.assertEqual(client.get("/players/stats-player/stats/").data["hands_played"], 3)
+
+    def test_house_analytics(self):
+        """
+        Finished games are counted in hourly and daily rollups, analytics answer ranges from those alone
+        """
+
+        test_superuser = User.objects.create_superuser(username="vagrant", password="vagrant", email="")
+        test_superuser.save()
+        client = APIClient()
+        client.login(username="vagrant", password="vagrant")
+
+        # A blackjack and a bust now, and a game ended three days ago
+        player = Player(wallet_id="rollup-player")
+        player.save()
+        drawn = [("A", "spades"), ("K", "spades"), ("9", "hearts"), ("7", "hearts"),
+                 ("10", "clubs"), ("9", "clubs"), ("K", "hearts"), ("7", "clubs"), ("5", "spades")]
+        shoe = Shoe(cards=[cards.encode(card) for card in drawn], cut_card=len(drawn))
+        shoe.save()
+        for actions in (["deal"], ["deal", "hit"]):
+            action = GameAction(player=player, bet=50, shoe=shoe)
+            for player_action in actions:
+                action.apply(player_action)
+        HouseRollup.add_game(GameAction(bet=20, dealer_win=True), -20, timezone.now() - timedelta(days=3))
+        self.assertEqual(sum(HouseRollup.objects.filter(period="hour").values_list("hands", flat=True)), 3)
+
+        response = client.get("/blackjack/analytics/")
+        totals = response.data["totals"]
+        self.assertEqual((totals["hands"], totals["house_net"], totals["wagered"]), (2, -25.0, 100))
+        self.assertEqual((totals["blackjack_rate"], totals["player_bust_rate"]), (0.5, 0.5))
+        self.assertEqual(client.get("/blackjack/analytics/", {"period": "day"}).data["totals"]["house_net"], -5.0)
+        self.assertEqual(client.get("/blackjack/analytics/", {"period": "week"}).status_code, 400)
+        self.assertEqual(client.get("/blackjack/analytics/", {"start": "yesterday"}).status_code, 400)
+
+    def test_table_round(self):
+        """
+        Seats are dealt from one shoe, play in turn and are all settled once the dealer has played
+        """
+
+        test_superuser = User.objects.create_superuser(username="vagrant", password="vagrant", email="")
+        test_superuser.save()
+        client = APIClient()
+        client.login(username="vagrant", password="vagrant")
+        for wallet_id in ("seat-a", "seat-b", "seat-c"):
+            Player(wallet_id=wallet_id).save()
+
+        # 19 stands, a blackjack and 16 that busts on a king, the dealer stands on 17
+        drawn = [("10", "clubs"), ("A", "spades"), ("10", "hearts"), ("9", "diamonds"),
+                 ("9", "clubs"), ("K", "spades"), ("6", "hearts"), ("8", "diamonds"), ("K", "hearts")]
+        shoe = Shoe(cards=[cards.encode(card) for card in drawn], cut_card=len(drawn))
+        shoe.save()
+        response = client.post("/blackjack/tables/", {"seats": ["seat-a", "seat-b", "seat-c"], "shoe": shoe.pk},
+                               format="json")
+        self.assertEqual(response.status_code, 201)
+        table = response.data["table_id"]
+        self.assertEqual(client.post("/blackjack/tables/", {"seats": ["seat-a", "nobody"]}, format="json")
+                         .status_code, 400)
+
+        response = client.post("/blackjack/tables/" + table + "/rounds/", {}, format="json")
+        self.assertEqual(response.status_code, 201)
+        round_id = response.data["round_id"]
+        self.assertEqual([seat["status"] for seat in response.data["seats"]], ["playing", "blackjack", "playing"])
+        self.assertEqual((response.data["turn"], len(response.data["dealer_hand"])), (0, 1))
+        self.assertEqual(client.post("/blackjack/tables/" + table + "/rounds/", {}, format="json").status_code, 400)
+
+        self.assertEqual(client.patch("/blackjack/rounds/" + round_id + "/", {"seat": 1, "player_action": "hit"},
+                                      format="json").status_code, 400)
+        client.patch("/blackjack/rounds/" + round_id + "/", {"seat": 0, "player_action": "stand"}, format="json")
+        response = client.patch("/blackjack/rounds/" + round_id + "/", {"seat": 2, "player_action": "hit"},
+                                format="json")
+        self.assertTrue(response.data["end_round"])
+        self.assertEqual(response.data["dealer_points"], 17)
+        self.assertEqual([(seat["outcome"], seat["amount"], seat["settled"]) for seat in response.data["seats"]],
+                         [("win", 50, True), ("win", 75.0, True), ("lose", -50, True)])
+
+        # Settling again is a no-op for wallets the round already paid
+        Round.objects.get(round_id=round_id).settle()
+        self.assertEqual([Player.objects.get(wallet_id=wallet_id).wallet_balance
+                          for wallet_id in ("seat-a", "seat-b", "seat-c")], [5050, 5075, 4950])
+        self.assertEqual(Player.objects.get(wallet_id="seat-c").busts, 1)
+        self.assertEqual(sum(HouseRollup.objects.filter(period="day").values_list("house_net", flat=True)), -75.0)
+        self.assertEqual(Shoe.objects.get(shoe_id=shoe.pk).cursor, len(drawn))
+        self.assertEqual(client.get("/blackjack/tables/" + table + "/").data["rounds_played"], 1)
+
+        # Recounting the counters keeps what the round's settlement added
+        Player.objects.filter(wallet_id="seat-b").update(hands_played=0, net_winnings=0, blackjacks=0)
+        call_command("rebuild_player_stats", stdout=StringIO())
+        stats = client.get("/players/seat-b/stats/").data
+        self.assertEqual((stats["hands_played"], stats["net_winnings"], stats["blackjacks"]), (1, 75.0, 1))
+
+    def test_round_deals_and_turns_are_claimed(self):
+        """
+        A round number is dealt once, a turned away deal leaves it alone and a leased round answers 409
+        """
+
+        test_superuser = User.objects.create_superuser(username="vagrant", password="vagrant", email="")
+        test_superuser.save()
+        client = APIClient()
+        client.login(username="vagrant", password="vagrant")
+        Player(wallet_id="claim-a").save()
+        Player(wallet_id="claim-b", wallet_balance=10).save()
+
+        # 19 and 17 against the dealer's 16, nobody is decided at the deal
+        drawn = [("10", "clubs"), ("10", "hearts"), ("10", "spades"), ("9", "clubs"), ("7", "diamonds"),
+                 ("6", "hearts")]
+        shoe = Shoe(cards=[cards.encode(card) for card in drawn], cut_card=len(drawn))
+        shoe.save()
+        table = Table(seats=["claim-a", "claim-b"], shoe=shoe)
+        table.save()
+        url = "/blackjack/tables/" + table.pk + "/rounds/"
+
+        # Round 1 taken by another request that hasn't saved it yet
+        Table.objects.filter(table_id=table.pk).update(rounds_played=1)
+        self.assertEqual(client.post(url, {}, format="json").status_code, 400)
+        Table.objects.filter(table_id=table.pk).update(rounds_played=0)
+
+        self.assertEqual(client.post(url, {}, format="json").status_code, 400)
+        self.assertEqual(Table.objects.get(table_id=table.pk).rounds_played, 0)
+        response = client.post(url, {"bets": {"claim-b": 10}}, format="json")
+        self.assertEqual((response.status_code, response.data["number"]), (201, 1))
+        self.assertEqual(Table.objects.get(table_id=table.pk).rounds_played, 1)
+
+        round_id = response.data["round_id"]
+        Round.objects.filter(round_id=round_id).update(claimed_until=timezone.now() + timedelta(seconds=60))
+        response = client.patch("/blackjack/rounds/" + round_id + "/", {"seat": 0, "player_action": "stand"},
+                                format="json")
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Round.objects.get(round_id=round_id).version, 0)
+        Round.objects.filter(round_id=round_id).update(claimed_until=None)
+        response = client.patch("/blackjack/rounds/" + round_id + "/", {"seat": 0, "player_action": "stand"},
+                                format="json")
+        self.assertEqual((response.status_code, response.data["version"]), (200, 1))
+        self.assertIsNone(Round.objects.get(round_id=round_id).claimed_until)
+
+    def test_round_dealer_stands_on_17_unlike_a_single_game(self):
+        """
+        With the same cards a single game's dealer draws past 17 to beat an 18, a table's dealer stands on 17
+        """
+
+        drawn = [("10", "spades"), ("8", "spades"), ("10", "hearts"), ("7", "hearts"), ("2", "clubs"),
+                 ("2", "diamonds")]
+        action = GameAction(player=Player(), bet=50)
+        action.deal(stacked_deck(*drawn))
+        action.stand()
+        self.assertEqual((action.dealer_points, action.dealer_win), (19, True))
+
+        Player(wallet_id="solo-seat").save()
+        shoe = Shoe(cards=[cards.encode(card) for card in [drawn[0], drawn[2], drawn[1], drawn[3]] + drawn[4:]],
+                    cut_card=len(drawn))
+        shoe.save()
+        table = Table(seats=["solo-seat"], shoe=shoe)
+        table.save()
+        game_round = Round(table=table)
+        game_round.deal()
+        game_round.apply(0, "stand")
+        self.assertEqual((game_round.dealer_points, game_round.seats[0]["outcome"]), (17, "win"))
+
+    def test_round_holds_the_bets_from_the_deal(self):
+        """
+        A round takes every bet at the deal, a short wallet refunds the others, and settling only credits
+        """
+
+        Player(wallet_id="held-a", wallet_balance=100).save()
+        Player(wallet_id="held-b", wallet_balance=10).save()
+        shoe = Shoe()
+        shoe.save()
+        table = Table(seats=["held-a", "held-b"], shoe=shoe)
+        table.save()
+
+        with self.assertRaises(ValidationError):
+            Round(table=table).deal()
+        self.assertEqual([(player.wallet_balance, player.held_rounds) for player in
+                          Player.objects.filter(wallet_id__in=["held-a", "held-b"]).order_by("wallet_id")],
+                         [(100, []), (10, [])])
+
+        # A loss is already in the house's hands, the settlement returns nothing and counts the seat once
+        Player.objects.filter(wallet_id="held-b").update(wallet_balance=100)
+        game_round = Round(table=table)
+        game_round.deal()
+        self.assertEqual(Player.objects.get(wallet_id="held-a").wallet_balance, 50)
+        game_round.dealer_hand, game_round.dealer_points = [], 20
+        for seat in game_round.seats:
+            seat.update(status="stood", points=18)
+        game_round.settle()
+        game_round.settle()
+        self.assertEqual(Player.objects.get(wallet_id="held-a").wallet_balance, 50)
+        self.assertEqual(Player.objects.get(wallet_id="held-a").held_rounds, [])
+        self.assertEqual(sum(HouseRollup.objects.filter(period="day").values_list("hands", flat=True)), 2)
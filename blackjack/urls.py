@@ -1,8 +1,21 @@
 from django.conf.urls import patterns, url
-from blackjack.views import GameActionList, GameActionDetail
+from blackjack.views import GameActionList, GameActionDetail, GameEventList, GameSessionDetail, ShoeList, ShoeDetail, \
+    StrategyDetail, HouseAnalytics, TableList, TableDetail, TableRoundList, RoundDetail
 
 # Blackjack patterns
 urlpatterns = patterns('',
     url(r'^gameactions/$', GameActionList.as_view(), name='gameaction-list'),
     url(r'^gameactions/(?P<pk>[A-Za-z0-9-]+)/$', GameActionDetail.as_view(), name='gameaction-detail'),
+    url(r'^gameactions/(?P<pk>[A-Za-z0-9-]+)/strategy/$', StrategyDetail.as_view(), name='gameaction-strategy'),
+    url(r'^gameactions/(?P<pk>[A-Za-z0-9-]+)/events/$', GameEventList.as_view(), name='gameaction-events'),
+    url(r'^gameactions/(?P<pk>[A-Za-z0-9-]+)/session/$', GameSessionDetail.as_view(), name='gameaction-session'),
+    url(r'^sessions/$', 'blackjack.views.game_session', name='game-session'),
+    url(r'^strategy/$', StrategyDetail.as_view(), name='strategy'),
+    url(r'^analytics/$', HouseAnalytics.as_view(), name='house-analytics'),
+    url(r'^shoes/$', ShoeList.as_view(), name='shoe-list'),
+    url(r'^shoes/(?P<pk>[A-Za-z0-9-]+)/$', ShoeDetail.as_view(), name='shoe-detail'),
+    url(r'^tables/$', TableList.as_view(), name='table-list'),
+    url(r'^tables/(?P<pk>[A-Za-z0-9-]+)/$', TableDetail.as_view(), name='table-detail'),
+    url(r'^tables/(?P<pk>[A-Za-z0-9-]+)/rounds/$', TableRoundList.as_view(), name='table-round-list'),
+    url(r'^rounds/(?P<pk>[A-Za-z0-9-]+)/$', RoundDetail.as_view(), name='round-detail'),
 )
\ No newline at end of file
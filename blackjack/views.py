@@ -1,10 +1,27 @@
-from blackjack.models import Player, GameAction
+from blackjack.models import Player, GameAction, GameEvent, HouseRollup, Round, Shoe, Table
 from rest_framework import generics
 from rest_framework.decorators import api_view
+from rest_framework.exceptions import ParseError
 from rest_framework.reverse import reverse
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
-from blackjack.serializers import PlayerSerializer, GameActionSerializer
-from django.core.exceptions import ValidationError
+from blackjack.serializers import PlayerSerializer, PlayerStatsSerializer, GameActionSerializer, GameEventSerializer, \
+    HouseRollupSerializer, RoundSerializer, ShoeSerializer, TableSerializer
+from django.core.exceptions import PermissionDenied, ValidationError
+from datetime import timedelta
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from blackjack.hands import Hand, RANK_VALUES
+from blackjack import strategy
+from blackjack.gamecache import GameBusy, claim_row, get_game_cache
+from blackjack import bulk, conditional, fastserializers, metrics, sessions
+from django.core import signing
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from blackjack.pagination import GameActionPagination, PlayerPagination
+from blackjack.projection import projected
 
 @api_view(['GET'])
 def api_root(request, format=None):
@@ -18,7 +35,89 @@ def api_root(request, format=None):
     })
 
 
-class PlayerList(generics.ListCreateAPIView):
+class SparseFieldsMixin(object):
+    """
+    ?fields= support, the same field list trims the serializer output and the database read
+    """
+
+    # Fields the view needs loaded whatever the client asked for
+    required_fields = ()
+
+    def requested_fields(self):
+        """
+        Fields asked for in the query string
+        :return: list of str or None for all of them
+        :raise ParseError: unknown field names
+        """
+
+        value = self.request.query_params.get('fields')
+        if value is None:
+            return None
+        fields = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = set(fields) - set(self.serializer_class.Meta.fields)
+        if unknown or not fields:
+            raise ParseError('fields must be a comma separated list of %s.' %
+                             ', '.join(self.serializer_class.Meta.fields))
+        return fields
+
+    def load_fields(self):
+        """
+        Model fields to read for the requested output
+        :return: list of str or None for whole documents
+        """
+
+        fields = self.requested_fields()
+        if fields is None:
+            return None
+        return sorted(set(fields) | set(self.required_fields))
+
+    def restrict(self, queryset):
+        """
+        Project a queryset onto the requested fields
+        :param queryset: QuerySet
+        :return: QuerySet
+        """
+
+        fields = self.load_fields()
+        return queryset if fields is None else projected(queryset.only(*fields))
+
+    def get_serializer(self, *args, **kwargs):
+        """
+        Serializer trimmed to the requested fields, input is always validated in full
+        :return: Serializer
+        """
+
+        if 'data' not in kwargs:
+            kwargs.setdefault('fields', self.requested_fields())
+        return super(SparseFieldsMixin, self).get_serializer(*args, **kwargs)
+
+    def serialize(self, instance):
+        """
+        Output of the serializer for one instance, through its compiled fast path
+        :param instance: model instance
+        :return: OrderedDict
+        """
+
+        with metrics.timer('serializer'):
+            return fastserializers.serialize(self.serializer_class, instance, self.requested_fields())
+
+    def list(self, request, *args, **kwargs):
+        """
+        One page of rows rendered by the compiled serializer
+        :param request:
+        :return: Response
+        """
+
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        rows = page if page is not None else queryset
+        serialize = fastserializers.compile_serializer(self.serializer_class, self.requested_fields())
+        with metrics.timer('serializer'):
+            data = [serialize(instance) for instance in rows]
+        return self.get_paginated_response(data) if page is not None else Response(data)
+
+
+class PlayerList(SparseFieldsMixin, generics.ListCreateAPIView):
     """
     List Player instances
     """
@@ -28,9 +127,19 @@ class PlayerList(generics.ListCreateAPIView):
     queryset = Player.objects.all()
     model = Player
     serializer_class = PlayerSerializer
+    pagination_class = PlayerPagination
+    required_fields = ('wallet_id',)
 
+    def get_queryset(self):
+        """
+
+        :return: QuerySet
+        """
 
-class PlayerDetail(generics.RetrieveUpdateDestroyAPIView):
+        return self.restrict(Player.objects.all())
+
+
+class PlayerDetail(SparseFieldsMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     Player API
     """
@@ -38,6 +147,7 @@ class PlayerDetail(generics.RetrieveUpdateDestroyAPIView):
     lookup_field = 'wallet_id'
     model = Player
     serializer_class = PlayerSerializer
+    required_fields = ('version',)
 
     def get(self, request, pk, format=None):
         """
@@ -48,9 +158,17 @@ class PlayerDetail(generics.RetrieveUpdateDestroyAPIView):
         :return:
         """
 
-        player = Player.objects.get(wallet_id=pk)
-        serializer = self.serializer_class(player)
-        return Response(serializer.data)
+        # A polling client holding the current revision is answered from the version alone
+        if conditional.is_conditional(request):
+            rows = list(Player.objects.filter(wallet_id=pk).values_list('version', flat=True)[:1])
+            if not rows:
+                raise Player.DoesNotExist('Player matching query does not exist.')
+            etag = conditional.make_etag(pk, rows[0])
+            if conditional.not_modified(request, etag):
+                return conditional.not_modified_response(etag)
+
+        player = self.restrict(Player.objects.all()).get(wallet_id=pk)
+        return conditional.add_validators(Response(self.serialize(player)), conditional.make_etag(pk, player.version))
 
     def put(self, request, pk, format=None):
         """
@@ -61,16 +179,29 @@ class PlayerDetail(generics.RetrieveUpdateDestroyAPIView):
         :return:
         """
 
-        player = Player.objects.get(wallet_id=request.data.get('wallet_id'))
+        player = Player.objects.get(wallet_id=request.data.get('wallet_id', pk))
+
+        # Relative adjustments are applied as one guarded server-side increment
+        if request.data.get('amount') is not None:
+            try:
+                amount = int(request.data.get('amount'))
+            except (TypeError, ValueError):
+                return Response({'amount': ['A valid integer is required.']}, status=400)
+            if not player.adjust_balance(amount):
+                return Response({'wallet_balance': ['Insufficient funds.']}, status=400)
+            return Response(self.serialize(player))
+
         player.wallet_balance = request.data.get('wallet_balance')
         try:
             player.full_clean()
         except ValidationError as e:
             return Response(e.message_dict)
         else:
-            player.save()
-            serializer = self.serializer_class(player)
-            return Response(serializer.data)
+            # Only the balance is written, not the whole document
+            Player.objects.filter(wallet_id=player.wallet_id).update(wallet_balance=player.wallet_balance,
+                                                                     version=F('version') + 1)
+            player.version += 1
+            return Response(self.serialize(player))
 
     def post(self, request, format=None):
         """
@@ -86,7 +217,154 @@ class PlayerDetail(generics.RetrieveUpdateDestroyAPIView):
         return Response(serializer.data)
 
 
-class GameActionList(generics.ListCreateAPIView):
+class PlayerBulkCreate(generics.GenericAPIView):
+    """
+    Create many wallets in one call
+    """
+
+    def post(self, request, format=None):
+        """
+        Rows are validated one by one, the valid ones are inserted in chunks and each row gets its own result
+        :param request:
+        :param format:
+        :return:
+        """
+
+        rows = request.data.get('players')
+        if not isinstance(rows, list) or not rows or len(rows) > bulk.max_rows():
+            return Response({'players': ['A list of 1 to %d players is required.' % bulk.max_rows()]}, status=400)
+        results = bulk.create_players(rows)
+        return Response({'summary': bulk.summary(results), 'results': results})
+
+
+class PlayerBulkAdjust(generics.GenericAPIView):
+    """
+    Credit or debit many wallets in one call
+    """
+
+    def post(self, request, format=None):
+        """
+        Each row is a guarded atomic increment, rows that would overdraw or name unknown wallets are reported
+        :param request:
+        :param format:
+        :return:
+        """
+
+        rows = request.data.get('adjustments')
+        if not isinstance(rows, list) or not rows or len(rows) > bulk.max_rows():
+            return Response({'adjustments': ['A list of 1 to %d adjustments is required.' % bulk.max_rows()]},
+                            status=400)
+        batch = request.data.get('batch')
+        if batch is not None and not isinstance(batch, basestring):
+            return Response({'batch': ['Not a valid string.']}, status=400)
+        batch, results = bulk.adjust_balances(rows, batch)
+        return Response({'batch': batch, 'summary': bulk.summary(results), 'results': results})
+
+
+class PlayerStatsDetail(generics.GenericAPIView):
+    """
+    Lifetime counters of a player, kept up to date as games end
+    """
+
+    serializer_class = PlayerStatsSerializer
+
+    def get(self, request, pk, format=None):
+        """
+        One document read, however many games the player has finished
+        :param request:
+        :param pk:
+        :param format:
+        :return:
+        """
+
+        player = projected(Player.objects.only(*PlayerStatsSerializer.Meta.fields)).get(wallet_id=pk)
+        return Response(self.serializer_class(player).data)
+
+
+class PlayerLeaderboard(generics.GenericAPIView):
+    """
+    Top players by net winnings or hands played
+    """
+
+    serializer_class = PlayerStatsSerializer
+
+    # Leaderboard orderings, each backed by a descending index on the player collection
+    orderings = {'net_winnings': '-net_winnings', 'hands_played': '-hands_played'}
+    max_limit = 100
+
+    def get(self, request, format=None):
+        """
+        Reads the first entries of an index, so the cost depends on the limit and not on the history
+        :param request:
+        :param format:
+        :return:
+        """
+
+        by = request.query_params.get('by', 'net_winnings')
+        if by not in self.orderings:
+            return Response({'by': ['Expected one of: %s.' % ', '.join(sorted(self.orderings))]}, status=400)
+        try:
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= self.max_limit:
+            return Response({'limit': ['A number from 1 to %d is required.' % self.max_limit]}, status=400)
+
+        players = projected(Player.objects.only(*PlayerStatsSerializer.Meta.fields)).order_by(self.orderings[by])
+        players = players[:limit]
+        return Response({'by': by, 'results': self.serializer_class(players, many=True).data})
+
+
+class PlayerGameActionList(SparseFieldsMixin, generics.ListAPIView):
+    """
+    One player's games, newest first
+    """
+
+    model = GameAction
+    serializer_class = GameActionSerializer
+    pagination_class = GameActionPagination
+    required_fields = ('action_time', 'action_id')
+
+    # Outcome filters and the flags they match
+    outcomes = {
+        'win': {'player_win': True},
+        'loss': {'dealer_win': True},
+        'push': {'game_push': True},
+        'blackjack': {'player_blackjack': True},
+        'bust': {'player_bust': True},
+        'finished': {'end_game_action': True},
+        'live': {'end_game_action': False},
+    }
+
+    def get_queryset(self):
+        """
+        Games of the player in the url, filtered by outcome, since and until
+        :return: QuerySet
+        """
+
+        # The remaining deck is never served, so it is left out of the projection
+        queryset = self.restrict(projected(GameAction.objects.filter(player=self.kwargs['pk']).defer('action_deck')))
+
+        outcome = self.request.query_params.get('outcome')
+        if outcome:
+            if outcome not in self.outcomes:
+                raise ParseError('outcome must be one of %s.' % ', '.join(sorted(self.outcomes)))
+            queryset = queryset.filter(**self.outcomes[outcome])
+
+        for param, lookup in (('since', 'action_time__gte'), ('until', 'action_time__lt')):
+            value = self.request.query_params.get(param)
+            if value:
+                try:
+                    moment = parse_datetime(value)
+                except ValueError:
+                    moment = None
+                if moment is None:
+                    raise ParseError('%s must be an ISO 8601 datetime.' % param)
+                queryset = queryset.filter(**{lookup: moment})
+        return queryset
+
+
+class GameActionList(SparseFieldsMixin, generics.ListCreateAPIView):
     """
     List GameAction instances
     """
@@ -96,9 +374,19 @@ class GameActionList(generics.ListCreateAPIView):
     queryset = GameAction.objects.all()
     model = GameAction
     serializer_class = GameActionSerializer
+    pagination_class = GameActionPagination
+    required_fields = ('action_time', 'action_id')
+
+    def get_queryset(self):
+        """
+        Games without their remaining deck, which is never served
+        :return: QuerySet
+        """
+
+        return self.restrict(projected(GameAction.objects.defer('action_deck')))
 
 
-class GameActionDetail(generics.RetrieveUpdateDestroyAPIView):
+class GameActionDetail(SparseFieldsMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     GameAction API
     """
@@ -106,6 +394,7 @@ class GameActionDetail(generics.RetrieveUpdateDestroyAPIView):
     # Override defaults
     model = GameAction
     serializer_class = GameActionSerializer
+    required_fields = ('action_id', 'version', 'end_game_action', 'action_time')
 
     def get(self, request, pk, format=None):
         """
@@ -116,9 +405,20 @@ class GameActionDetail(generics.RetrieveUpdateDestroyAPIView):
         :return:
         """
 
-        action = GameAction.objects.get(action_id=pk)
-        serializer = self.serializer_class(action)
-        return Response(serializer.data)
+        game_cache = get_game_cache()
+
+        # A polling client holding the current revision is answered without loading or serializing the game
+        if conditional.is_conditional(request):
+            version, ended, action_time = game_cache.validators(pk)
+            etag, last_modified = conditional.game_validators(pk, version, ended, action_time)
+            if conditional.not_modified(request, etag, last_modified):
+                return conditional.not_modified_response(etag, last_modified, ended)
+
+        action = game_cache.get(pk, only=self.load_fields())
+        data = self.serialize(action)
+        etag, last_modified = conditional.game_validators(pk, action.version, action.end_game_action,
+                                                          action.action_time)
+        return conditional.add_validators(Response(data), etag, last_modified, action.end_game_action)
 
     def post(self, request, format=None):
         """
@@ -130,15 +430,18 @@ class GameActionDetail(generics.RetrieveUpdateDestroyAPIView):
 
         if request.data.get('player') and request.data.get('bet'):
             player = Player.objects.get(wallet_id=request.data.get('player'))
-            action = GameAction(player=player, bet=request.data.get('bet'))
+            action = GameAction(player=player, bet=request.data.get('bet'), shoe_id=request.data.get('shoe') or None)
             try:
                 action.full_clean()
             except ValidationError as e:
                 return Response(e.message_dict)
-            else:
-                action.save()
-                serializer = self.serializer_class(action)
-                return Response(serializer.data)
+
+            # The deal reserves the bet, a wallet that can't cover it is turned away before a game exists
+            if player.wallet_balance < action.bet:
+                return Response({'wallet_balance': ['Insufficient funds to cover the bet.']}, status=400)
+            action.save()
+            serializer = self.serializer_class(action)
+            return Response(serializer.data)
 
         else:
             return Response(data=None, status=400)
@@ -152,33 +455,454 @@ class GameActionDetail(generics.RetrieveUpdateDestroyAPIView):
         :return:
         """
 
-        action = GameAction.objects.get(action_id=pk)
+        # The game is held from the read to the write, so two requests can never both play the same revision
+        game_cache = get_game_cache()
+        try:
+            with game_cache.claim(pk) as action:
+                return self.play(request, pk, game_cache, action)
+        except GameBusy:
+            return Response({'detail': 'The game is being played by another request.'}, status=409)
+
+    def play(self, request, pk, game_cache, action):
+        """
+        Apply the request's actions to a claimed game and store it
+        :param request:
+        :param pk: str action id
+        :param game_cache: GameCache
+        :param action: GameAction
+        :return: Response
+        """
 
+        # A finished game never changes again, the client is pointed back at its cached copy
         if action.end_game_action:
-            serializer = self.serializer_class(action)
-            return Response(serializer.data, status=304)
+            etag, last_modified = conditional.game_validators(pk, action.version, True, action.action_time)
+            return conditional.not_modified_response(etag, last_modified, True)
+
+        # Batch mode, actions are applied in memory up to the first terminal state and persisted once
+        player_actions = request.data.get('player_actions')
+        if player_actions is not None:
+            if not isinstance(player_actions, list) or not player_actions:
+                return Response(data=None, status=400)
+            metrics.set_action('batch')
+            states, rejected = [], None
+            try:
+                for player_action in player_actions:
+                    if action.end_game_action:
+                        break
+                    with metrics.timer('engine'):
+                        applied = action.apply(player_action)
+                    if not applied:
+                        rejected = Response(data=None, status=400)
+                        break
+                    states.append(self.serialize(action))
+            except ValidationError as e:
+                rejected = Response(e.message_dict, status=400)
 
-        # Conditions
-        elif action.next_actions == 'hit/stand' and request.data.get('player_action') == 'hit':
-            action.player_action = 'hit'
-            action.hit()
-            action.save()
-            serializer = self.serializer_class(action)
-            return Response(serializer.data)
+            # The actions before a rejected one already reserved or settled money, the state they reached is kept
+            if states:
+                game_cache.store(action)
+            return rejected if rejected is not None else Response(states)
 
-        elif action.next_actions == 'hit/stand' and request.data.get('player_action') == 'stand':
-            action.player_action = 'stand'
-            action.stand()
-            action.save()
-            serializer = self.serializer_class(action)
-            return Response(serializer.data)
+        errors = play_action(game_cache, action, request.data.get('player_action'))
+        if errors is not None:
+            return Response(errors, status=400)
+        return Response(self.serialize(action))
 
-        elif action.next_actions == '' and request.data.get('player_action') == 'deal':
-            action.player_action = 'deal'
-            action.deal()
-            action.save()
-            serializer = self.serializer_class(action)
-            return Response(serializer.data)
 
+def play_action(game_cache, action, player_action):
+    """
+    Apply one player action to a claimed game and store the state it reaches, PATCH and game sessions share it
+    :param game_cache: GameCache
+    :param action: GameAction
+    :param player_action: str deal, hit or stand
+    :return: dict of errors when the action is refused and the game is left as it was, None once it is stored
+    """
+
+    metrics.set_action(player_action)
+    try:
+        with metrics.timer('engine'):
+            applied = action.apply(player_action)
+
+    # The wallet could not cover the bet
+    except ValidationError as e:
+        return e.message_dict
+    if not applied:
+        return {'detail': 'Action not allowed, next actions: %s.' % (action.next_actions or 'none')}
+
+    game_cache.store(action)
+    return None
+
+
+class GameEventList(generics.ListAPIView):
+    """
+    Event log of one game, oldest first
+    """
+
+    model = GameEvent
+    serializer_class = GameEventSerializer
+    pagination_class = None
+
+    def get_queryset(self):
+        """
+
+        :return: QuerySet
+        """
+
+        events = GameEvent.objects.filter(action=self.kwargs['pk']).defer('deck')
+        return projected(events).order_by('sequence', 'event_type')
+
+
+class GameSessionDetail(generics.GenericAPIView):
+    """
+    Opens a session on a live game
+    """
+
+    serializer_class = GameActionSerializer
+
+    def post(self, request, pk, format=None):
+        """
+        Token and url the game is played through from now on, the token goes in the X-Game-Session header of each
+        action, the game is warmed into the cache
+        :param request:
+        :param pk:
+        :param format:
+        :return:
+        """
+
+        action = get_game_cache().get(pk)
+        if action.end_game_action:
+            return Response(data=None, status=400)
+        token = sessions.open_session(action.pk, request.user)
+        return Response({
+            'session': token,
+            'url': reverse('game-session', request=request),
+            'state': fastserializers.serialize(GameActionSerializer, action),
+        })
+
+
+def _json(data, status=200):
+    """
+    Plain JSON response
+    :param data: object
+    :param status: int
+    :return: HttpResponse
+    """
+
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+
+@csrf_exempt
+@require_POST
+def game_session(request):
+    """
+    One action of a session, a PATCH of the game authenticated by the session token. The body is deal, hit or stand,
+    the answer holds the fields that changed and the version
+    :param request: carrying the session token in the X-Game-Session header
+    :return: HttpResponse
+    """
+
+    try:
+        pk = sessions.session_game(request.META.get(sessions.HEADER, ''))
+    except signing.BadSignature:
+        return _json({'detail': 'Invalid or expired session.'}, status=403)
+    except PermissionDenied:
+        return _json({'detail': 'The session was opened by a user who no longer has access.'}, status=403)
+
+    game_cache = get_game_cache()
+    try:
+        with game_cache.claim(pk) as action:
+            before = fastserializers.serialize(GameActionSerializer, action)
+            errors = play_action(game_cache, action, request.body.strip())
+    except GameAction.DoesNotExist:
+        return _json({'detail': 'Not found.'}, status=404)
+    except GameBusy:
+        return _json({'detail': 'The game is being played by another request.'}, status=409)
+    if errors is not None:
+        return _json(errors, status=400)
+
+    with metrics.timer('serializer'):
+        data = sessions.delta(before, fastserializers.serialize(GameActionSerializer, action))
+
+    # The revision lets the client check it has seen every delta
+    data['version'] = action.version
+    return _json(data)
+
+
+class MetricsDetail(generics.GenericAPIView):
+    """
+    Request histograms of this process in the Prometheus text format, admins only
+    """
+
+    def get(self, request, format=None):
+        """
+
+        :param request:
+        :param format:
+        :return: HttpResponse
+        """
+
+        return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class HouseAnalytics(generics.GenericAPIView):
+    """
+    House P&L and game rates over a time range, from the hourly or daily rollups, admins only
+    """
+
+    serializer_class = HouseRollupSerializer
+
+    # Range served when start is omitted
+    default_ranges = {'hour': timedelta(days=1), 'day': timedelta(days=30)}
+
+    def get(self, request, format=None):
+        """
+        Reads one rollup per bucket in the range, never the games
+        :param request:
+        :param format:
+        :return:
+        """
+
+        period = request.query_params.get('period', 'hour')
+        if period not in HouseRollup.PERIODS:
+            raise ParseError('period must be one of %s.' % ', '.join(sorted(HouseRollup.PERIODS)))
+        bounds = {}
+        for param in ('start', 'end'):
+            value = request.query_params.get(param)
+            if not value:
+                continue
+            try:
+                moment = parse_datetime(value)
+            except ValueError:
+                moment = None
+            if moment is None:
+                raise ParseError('%s must be an ISO 8601 datetime.' % param)
+            bounds[param] = timezone.make_aware(moment, timezone.utc) if timezone.is_naive(moment) else moment
+        end = bounds.get('end') or timezone.now()
+        start = HouseRollup.bucket_start(period, bounds.get('start') or end - self.default_ranges[period])
+        if start >= end:
+            raise ParseError('start must be before end.')
+
+        rollups = list(HouseRollup.objects.filter(period=period, start__gte=start, start__lt=end).order_by('start'))
+        totals = dict((name, sum(getattr(rollup, name) for rollup in rollups))
+                      for name in HouseRollupSerializer.Meta.fields[2:])
+        hands, minutes = totals['hands'], (end - start).total_seconds() / 60
+        totals.update(hands_per_minute=hands / minutes,
+                      blackjack_rate=float(totals['player_blackjacks']) / hands if hands else None,
+                      player_bust_rate=float(totals['player_busts']) / hands if hands else None,
+                      dealer_bust_rate=float(totals['dealer_busts']) / hands if hands else None,
+                      house_edge=totals['house_net'] / totals['wagered'] if totals['wagered'] else None)
+        return Response({'period': period, 'start': start, 'end': end, 'totals': totals,
+                         'buckets': self.serializer_class(rollups, many=True).data})
+
+
+class StrategyDetail(generics.GenericAPIView):
+    """
+    Hit/stand advice from the precomputed strategy table
+    """
+
+    def get(self, request, pk=None, format=None):
+        """
+
+        :param request:
+        :param pk: game action id, advice for its current hand when given
+        :param format:
+        :return:
+        """
+
+        if pk is not None:
+            action = get_game_cache().get(pk)
+            if action.next_actions != 'hit/stand':
+                return Response(data=None, status=400)
+            total = action.player_points
+            soft = Hand(action.player_hand).soft
+            upcard = RANK_VALUES[action.dealer_hand[0][0]]
         else:
-            return Response(data=None, status=400)
\ No newline at end of file
+            try:
+                total = int(request.query_params['total'])
+                soft = request.query_params.get('soft', '') in ('1', 'true', 'True')
+                upcard = request.query_params['upcard']
+                upcard = RANK_VALUES[upcard] if upcard in RANK_VALUES else int(upcard)
+            except (KeyError, ValueError):
+                return Response(data=None, status=400)
+
+        # A table that isn't cached yet is computed in the background, never in a request
+        table = strategy.get_table(compute=False)
+        if table is None:
+            return Response({'detail': 'The strategy table is being computed, run build_strategy to precompute it.'},
+                            status=503, headers={'Retry-After': '30'})
+        entry = table.get(strategy.table_key(total, soft, upcard))
+        if entry is None:
+            return Response(data=None, status=400)
+        data = {'total': total, 'soft': soft, 'upcard': upcard}
+        data.update(entry)
+        return Response(data)
+
+
+class ShoeList(generics.ListCreateAPIView):
+    """
+    List Shoe instances
+    """
+
+    # Override defaults
+    lookup_field = 'shoe_id'
+    queryset = Shoe.objects.all()
+    model = Shoe
+    serializer_class = ShoeSerializer
+
+
+class ShoeDetail(generics.RetrieveAPIView):
+    """
+    Shoe API
+    """
+
+    # Override defaults
+    lookup_field = 'shoe_id'
+    lookup_url_kwarg = 'pk'
+    queryset = Shoe.objects.all()
+    model = Shoe
+    serializer_class = ShoeSerializer
+
+
+class TableList(generics.ListCreateAPIView):
+    """
+    List Table instances
+    """
+
+    # Override defaults
+    lookup_field = 'table_id'
+    queryset = Table.objects.all()
+    model = Table
+    serializer_class = TableSerializer
+
+    def post(self, request, format=None):
+        """
+        Seat existing wallets at a new table, dealt from the given shoe or a new six-deck one
+        :param request:
+        :param format:
+        :return:
+        """
+
+        seats = request.data.get('seats')
+        if not isinstance(seats, list) or not all(isinstance(seat, basestring) for seat in seats):
+            return Response({'seats': ['A list of wallet ids is required.']}, status=400)
+        shoe = Shoe.objects.get(shoe_id=request.data['shoe']) if request.data.get('shoe') else Shoe()
+        table = Table(seats=seats, bet=request.data.get('bet', 50), shoe=shoe)
+        try:
+            table.full_clean(exclude=['shoe'])
+        except ValidationError as e:
+            return Response(e.message_dict, status=400)
+        unknown = set(seats) - set(Player.objects.filter(wallet_id__in=seats).values_list('wallet_id', flat=True))
+        if unknown:
+            return Response({'seats': ['Unknown wallets: %s.' % ', '.join(sorted(unknown))]}, status=400)
+
+        shoe.save()
+        table.shoe = shoe
+        table.save()
+        return Response(self.serializer_class(table).data, status=201)
+
+
+class TableDetail(generics.RetrieveAPIView):
+    """
+    Table API
+    """
+
+    # Override defaults
+    lookup_field = 'table_id'
+    lookup_url_kwarg = 'pk'
+    queryset = Table.objects.all()
+    model = Table
+    serializer_class = TableSerializer
+
+
+class TableRoundList(generics.ListAPIView):
+    """
+    Rounds of a table, newest first, and the deal of the next one
+    """
+
+    serializer_class = RoundSerializer
+
+    def get_queryset(self):
+        """
+
+        :return: QuerySet
+        """
+
+        return Round.objects.filter(table=self.kwargs['pk']).order_by('-number')
+
+    def post(self, request, pk, format=None):
+        """
+        Deal a round to every seat from the table's shoe, once the previous round is over
+        :param request:
+        :param pk:
+        :param format:
+        :return:
+        """
+
+        table = Table.objects.get(table_id=pk)
+        try:
+            bets = dict((wallet_id, int(bet)) for wallet_id, bet in (request.data.get('bets') or {}).items())
+        except (AttributeError, TypeError, ValueError):
+            bets = None
+        if bets is None or set(bets) - set(table.seats) or min(bets.values() or [1]) < 1:
+            return Response({'bets': ['Positive whole bets of seated wallets are required.']}, status=400)
+
+        # The last numbered round must be over, one still being dealt isn't saved yet and counts as being played
+        played = table.rounds_played
+        if played and not Round.objects.filter(table=pk, number=played, end_round=True).count():
+            return Response({'non_field_errors': ['The current round is still being played.']}, status=400)
+
+        # Every seat must cover its bet, the deal takes the bets and refunds them all if one wallet fell short since
+        balances = dict(Player.objects.filter(wallet_id__in=table.seats).values_list('wallet_id', 'wallet_balance'))
+        short = [wallet_id for wallet_id in table.seats if balances.get(wallet_id, 0) < bets.get(wallet_id, table.bet)]
+        if short:
+            return Response({'wallet_balance': ['Insufficient funds: %s.' % ', '.join(short)]}, status=400)
+
+        # The round number is taken with a compare-and-set before the deal, of two concurrent deals only one gets it
+        if not Table.objects.filter(table_id=pk, rounds_played=played).update(rounds_played=played + 1):
+            return Response({'detail': 'Another round is being dealt at this table.'}, status=409)
+        game_round = Round(table=table, number=played + 1)
+        try:
+            game_round.deal(bets)
+        except ValidationError as e:
+            Table.objects.filter(table_id=pk, rounds_played=played + 1).update(rounds_played=played)
+            return Response(e.message_dict, status=400)
+        game_round.save()
+        return Response(self.serializer_class(game_round).data, status=201)
+
+
+class RoundDetail(generics.RetrieveAPIView):
+    """
+    Round API
+    """
+
+    # Override defaults
+    lookup_field = 'round_id'
+    lookup_url_kwarg = 'pk'
+    queryset = Round.objects.all()
+    model = Round
+    serializer_class = RoundSerializer
+
+    def patch(self, request, pk, format=None):
+        """
+        Hit or stand for the seat whose turn it is, the last decision plays the dealer and settles the round
+        :param request:
+        :param pk:
+        :param format:
+        :return:
+        """
+
+        try:
+            seat = int(request.data.get('seat'))
+        except (TypeError, ValueError):
+            return Response(data=None, status=400)
+
+        # The round is leased from the read to the write, so two requests never both draw for and settle it
+        game_cache = get_game_cache()
+        try:
+            with claim_row(Round, pk, game_cache.claim_timeout, game_cache.claim_wait) as game_round:
+                if not game_round.apply(seat, request.data.get('player_action')):
+                    return Response(data=None, status=400)
+                game_round.save()
+        except GameBusy:
+            return Response({'detail': 'The round is being played by another request.'}, status=409)
+        return Response(self.serializer_class(game_round).data)
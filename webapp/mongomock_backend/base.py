@@ -0,0 +1,72 @@
+"""
+django_mongodb_engine on mongomock's in-process stand-in, for webapp.settings_local only
+
+Every connection shares one in-memory client. mongomock collections stand in for pymongo's, which can't wrap a
+mongomock database, and the few calls mongomock lacks are filled in. Indexes are not created. Importing this
+module patches mongomock and Django for the whole process, so only development settings load it.
+"""
+
+import mongomock
+import mongomock.collection
+from django.db.models.fields import AutoField
+from django.db.models.query import QuerySet
+from django_mongodb_engine import base
+from django_mongodb_engine.base import DatabaseWrapper as MongoDatabaseWrapper
+from django_mongodb_engine.creation import DatabaseCreation as MongoDatabaseCreation
+
+_client = mongomock.MongoClient()
+base.MongoClient = lambda *args, **kwargs: _client
+
+mongomock.collection.Collection.with_options = lambda self, **kwargs: self
+mongomock.collection.Collection.options = lambda self: {}
+
+# Stock Django where the engine expects django-nonrel: auth users get ObjectId string keys, which AutoField would
+# cast to int, and exists() adds an extra select the engine refuses
+AutoField.get_prep_value = lambda self, value: value
+AutoField.to_python = lambda self, value: value
+QuerySet.exists = lambda self: self.count() > 0
+
+
+def _collection(database, name, **kwargs):
+    """
+    mongomock collection, capped options are ignored
+    :param database: mongomock Database
+    :param name: str
+    :return: mongomock Collection
+    """
+
+    return database[name]
+
+
+class DatabaseCreation(MongoDatabaseCreation):
+    """
+    Collections appear on first write, nothing is created up front
+    """
+
+    def sql_create_model(self, model, *unused):
+        return [], {}
+
+    def sql_indexes_for_model(self, model, *unused):
+        return []
+
+
+class DatabaseWrapper(MongoDatabaseWrapper):
+    """
+    Engine connection handing out mongomock collections
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('collection_class', _collection)
+        super(DatabaseWrapper, self).__init__(*args, **kwargs)
+        self.creation = DatabaseCreation(self)
+
+    def get_collection(self, name, **kwargs):
+        """
+        Collection without the engine's DEBUG wrapper, whose pymongo cursors can't run on mongomock
+        :param name: str
+        :return: Collection or None when existing is set and it doesn't exist
+        """
+
+        if kwargs.pop('existing', False) and name not in self.database.collection_names():
+            return None
+        return self.collection_class(self.database, name, **kwargs)
@@ -50,6 +50,7 @@ REST_FRAMEWORK = {
 }
 
 MIDDLEWARE_CLASSES = (
+    'blackjack.metrics.MetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -81,6 +82,39 @@ CACHES = {
     }
 }
 
+# Live game cache, ALIAS must name a backend shared by every worker (e.g. memcached) to enable it,
+# None keeps games in this process only and is safe with a single worker. The default alias above is a
+# DummyCache, so out of the box caching is off: every action reads the game and appends its events, and requests
+# claim a game with a CLAIM_TIMEOUT seconds lease on it, waiting up to CLAIM_WAIT seconds for another to finish.
+# Either way a live game's document is rewritten every SNAPSHOT_EVERY revisions and when it ends
+
+BLACKJACK_GAME_CACHE = {
+    'ALIAS': 'default',
+    'MAX_ENTRIES': 1024,
+    'TIMEOUT': 300,
+    'CLAIM_TIMEOUT': 10,
+    'CLAIM_WAIT': 1.0,
+    'SNAPSHOT_EVERY': 8,
+}
+
+# Days archived games are kept before the TTL index removes them, changing it needs a collMod on the index
+
+BLACKJACK_ARCHIVE_TTL_DAYS = 365
+
+# Bulk wallet endpoints, rows accepted per call and rows written per bulk operation
+
+BLACKJACK_BULK_MAX_ROWS = 50000
+
+BLACKJACK_BULK_CHUNK = 1000
+
+# Seconds a game session token stays valid
+
+BLACKJACK_SESSION_MAX_AGE = 3600
+
+# Request histograms served at /metrics, the middleware unloads itself while this is off
+
+BLACKJACK_METRICS = False
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.6/topics/i18n/
 
@@ -100,3 +134,9 @@ USE_TZ = True
 STATIC_URL = '/static/'
 
 APPEND_SLASH = False
+
+# Strategy tables, computed once per rule set and cached on disk
+
+BLACKJACK_STRATEGY_DECKS = 1
+
+BLACKJACK_STRATEGY_CACHE = os.path.join(BASE_DIR, 'strategy_cache.json')
@@ -0,0 +1,9 @@
+"""
+Development settings running on an in-process MongoDB stand-in, mongomock must be installed
+
+    python manage.py benchmark --api --settings=webapp.settings_local
+"""
+
+from webapp.settings import *
+
+DATABASES['default']['ENGINE'] = 'webapp.mongomock_backend'
@@ -1,6 +1,7 @@
 from django.conf.urls import patterns, include, url
 from rest_framework.urlpatterns import format_suffix_patterns
-from blackjack.views import PlayerList, PlayerDetail
+from blackjack.views import PlayerList, PlayerDetail, PlayerBulkCreate, PlayerBulkAdjust, PlayerGameActionList, \
+    PlayerStatsDetail, PlayerLeaderboard, MetricsDetail
 
 from django.contrib import admin
 admin.autodiscover()
@@ -10,8 +11,14 @@ urlpatterns = patterns('',
     url(r'^admin/', include(admin.site.urls)),
     url(r'^$', 'blackjack.views.api_root'),
     url(r'^players/$', PlayerList.as_view(), name='player-list'),
+    url(r'^players/bulk/$', PlayerBulkCreate.as_view(), name='player-bulk-create'),
+    url(r'^players/bulk/adjust/$', PlayerBulkAdjust.as_view(), name='player-bulk-adjust'),
+    url(r'^players/leaderboard/$', PlayerLeaderboard.as_view(), name='player-leaderboard'),
     url(r'^players/(?P<pk>[A-Za-z0-9-]+)/$', PlayerDetail.as_view(), name='player-detail'),
+    url(r'^players/(?P<pk>[A-Za-z0-9-]+)/gameactions/$', PlayerGameActionList.as_view(), name='player-gameaction-list'),
+    url(r'^players/(?P<pk>[A-Za-z0-9-]+)/stats/$', PlayerStatsDetail.as_view(), name='player-stats'),
     url(r'^blackjack/', include('blackjack.urls')),
+    url(r'^metrics$', MetricsDetail.as_view(), name='metrics'),
 )
 
 # Format suffixes